@@ -11,6 +11,10 @@ import types
 import traceback
 import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from bcreg.config import config
 from bcreg.rocketchat_hooks import log_error, log_warning, log_info
@@ -22,6 +26,38 @@ INMEM_CACHE_TABLE_PREFIX = 'x_'
 INMEM_CACHE_SEC_TABLE_PREFIX = 'x_sec_'
 MAX_WHERE_IN = 1000
 
+# number of connections used to load the in-mem cache concurrently (1 to load over the main connection only)
+CACHE_LOAD_WORKERS = int(os.environ.get('CACHE_LOAD_WORKERS', 4))
+# rows fetched (and inserted into the in-mem cache) at a time, and chunks buffered per query, when loading the cache
+CACHE_LOAD_CHUNK_SIZE = int(os.environ.get('CACHE_LOAD_CHUNK_SIZE', 5000))
+CACHE_LOAD_QUEUE_SIZE = 2
+
+# code tables are static reference data, so they are loaded once per process and shared by all processor instances
+# (and re-loaded only if their contents change), as {(database name, table): {'version', 'desc', 'rows', 'lookups'}}
+CODE_TABLE_CACHE = {}
+CODE_TABLE_CACHE_LOCK = threading.Lock()
+
+# columns returned by get_bcreg_tables() when loading the in-mem cache (used to find the related records to load)
+CACHE_KEY_COLUMNS = {'corp_party': ['corp_num', 'bus_company_num'],
+                    'event': ['event_id'],
+                    'office': ['mailing_addr_id', 'delivery_addr_id'],
+                    'businesses': ['id'],
+                    'businesses_version': ['transaction_id'],
+                    'party_roles': ['party_id'],
+                    'filings': ['transaction_id'],
+                    'parties': ['identifier']}
+
+# columns used as lookup keys when querying the in-mem cache - an index is
+# created on each of these columns (if present) when a cache table is built
+INMEM_CACHE_INDEX_COLUMNS = ['event_id',
+                    'corp_num',
+                    'addr_id',
+                    'identifier',
+                    'business_id',
+                    'transaction_id',
+                    'party_id',
+                    'id']
+
 COLIN_SYSTEM_TYPE = 'BC_REG'
 LEAR_SYSTEM_TYPE = 'BCREG_LEAR'
 
@@ -54,7 +90,28 @@ class BCReg_Core:
     conn = None
 
 
-    def __init__(self, cache=False):
+    # if shared_with is provided, this instance uses the connections and in-mem cache of that (open) instance,
+    # whose secondary database must be our primary database (and vice versa)
+    def __init__(self, cache=False, shared_with=None):
+        # indexes built on the in-mem cache, as {cache table name: [column names]}
+        self.cache_indexes = {}
+        # connections used to load the in-mem cache, as {database name: queue of connections}
+        self.cache_load_conns = {}
+        # code tables checked against the process-wide code table cache by this instance, as {(database name, table): entry}
+        self.code_tables = {}
+        # in-mem cache table prefixes for the primary (False) and secondary (True) database
+        self.cache_table_prefixes = {False: INMEM_CACHE_TABLE_PREFIX, True: INMEM_CACHE_SEC_TABLE_PREFIX}
+        # time spent loading each in-mem cache table, as {cache table name: seconds} (reset by the caller)
+        self.cache_load_times = {}
+        self.shared_with = shared_with
+        if shared_with is not None:
+            if shared_with.SEC_PG_DATABASE_NAME != self.PG_DATABASE_NAME or shared_with.PG_DATABASE_NAME != self.SEC_PG_DATABASE_NAME:
+                raise ValueError("Can't share connections with a processor for " + shared_with.PG_DATABASE_NAME)
+            self.conn = shared_with.sec_conn
+            self.sec_conn = shared_with.conn
+            self.cache = shared_with.cache
+            self.cache_table_prefixes = {False: INMEM_CACHE_SEC_TABLE_PREFIX, True: INMEM_CACHE_TABLE_PREFIX}
+            return
         try:
             params = config(section=self.PG_DATABASE_NAME)
             self.conn = psycopg2.connect(**params)
@@ -67,7 +124,8 @@ class BCReg_Core:
             # Register the converter
             sqlite3.register_converter("decimal", convert_decimal)
             # connect to in-memory database
-            self.cache = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+            # (the cache may be loaded on a background thread and handed over, see EventProcessor.prefetch_corp_batch)
+            self.cache = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES, check_same_thread=False)
 
             # connect secondary datasource
             secondary_params = config(section=self.SEC_PG_DATABASE_NAME)
@@ -84,13 +142,27 @@ class BCReg_Core:
             log_error("BCRegistries exception connecting to DB: " + str(error))
             raise
 
-    def __del__(self):
+    # close the connections and in-mem cache now, rather than waiting for the instance to be garbage collected
+    def close(self):
+        if self.shared_with is not None:
+            # connections and cache are closed by the instance that owns them
+            return
+        for conns in self.cache_load_conns.values():
+            while conns is not None and not conns.empty():
+                conns.get().close()
+        self.cache_load_conns = {}
         if self.conn:
             self.conn.close()
+            self.conn = None
         if self.cache:
             self.cache.close()
+            self.cache = None
         if self.sec_conn:
             self.sec_conn.close()
+            self.sec_conn = None
+
+    def __del__(self):
+        self.close()
 
     def __enter__(self):
         return self
@@ -125,13 +197,13 @@ class BCReg_Core:
 
     def get_table_prefix(self, force_query_remote=False):
         if self.use_local_cache() and (not force_query_remote):
-            return INMEM_CACHE_TABLE_PREFIX
+            return self.cache_table_prefixes[False]
         else:
             return self.DB_TABLE_PREFIX
 
     def get_sec_table_prefix(self, force_query_remote=False):
         if self.use_local_cache() and (not force_query_remote):
-            return INMEM_CACHE_SEC_TABLE_PREFIX
+            return self.cache_table_prefixes[True]
         else:
             return self.SEC_DB_TABLE_PREFIX
 
@@ -213,7 +285,7 @@ class BCReg_Core:
 
     # return a sql to create an in-mem sqlite table
     def create_table_sql(self, table, table_desc, use_sec=False):
-        pfx = INMEM_CACHE_SEC_TABLE_PREFIX if use_sec else INMEM_CACHE_TABLE_PREFIX
+        pfx = self.cache_table_prefixes[use_sec]
         table_sql = 'create table if not exists ' + pfx + table + ' ('
         i = 0
         for col in table_desc:
@@ -228,6 +300,21 @@ class BCReg_Core:
                 table_sql = table_sql + ')'
         return table_sql
 
+    # return a list of sql to index an in-mem sqlite table on its lookup keys
+    def create_index_sqls(self, table, table_desc, use_sec=False):
+        pfx = self.cache_table_prefixes[use_sec]
+        col_names = [col[0] for col in table_desc]
+        index_sqls = []
+        for col_name in INMEM_CACHE_INDEX_COLUMNS:
+            if col_name in col_names:
+                index_name = pfx + table + '_' + col_name + '_idx'
+                index_sqls.append((col_name, 'create index if not exists ' + index_name + ' on ' + pfx + table + ' (' + col_name + ')'))
+        return index_sqls
+
+    # return the indexes built on the in-mem cache, as {cache table name: [column names]}
+    def get_cache_indexes(self):
+        return self.cache_indexes
+
     def get_sql_col_type(self, pg_type, use_sec=False):
         if pg_type == 1042:  # CHAR
             return 'text'  
@@ -300,7 +387,7 @@ class BCReg_Core:
     # note: "generate_individual_sql" will generate and print sql statements if True
     #       to be used to generate sample data for unit testing
     def cache_bcreg_data(self, table, desc, rows, generate_individual_sql=False, use_sec=False):
-        pfx = INMEM_CACHE_SEC_TABLE_PREFIX if use_sec else INMEM_CACHE_TABLE_PREFIX
+        pfx = self.cache_table_prefixes[use_sec]
         create_sql = self.create_table_sql(table, desc, use_sec=use_sec)
         # print("Creating cache table:", create_sql)
         col_keys = []
@@ -432,6 +519,8 @@ class BCReg_Core:
                 if 0 < len(rows):
                     cache_cursor.executemany(insert_sql, inserts)
 
+                self.create_cache_indexes(cache_cursor, table, desc, use_sec=use_sec)
+
                 cache_cursor.close()
                 cache_cursor = None
             except (Exception) as error:
@@ -445,6 +534,61 @@ class BCReg_Core:
                     cache_cursor.close()
                 cache_cursor = None
 
+    # index the lookup keys so per-corp queries don't scan the whole batch
+    def create_cache_indexes(self, cache_cursor, table, desc, use_sec=False):
+        pfx = self.cache_table_prefixes[use_sec]
+        cache_table = pfx + table
+        for (col_name, index_sql) in self.create_index_sqls(table, desc, use_sec=use_sec):
+            if col_name not in self.cache_indexes.get(cache_table, []):
+                cache_cursor.execute(index_sql)
+                self.cache_indexes.setdefault(cache_table, []).append(col_name)
+
+    # cache data from bc registries database into a local in-mem sqlite table, one chunk of rows at a time
+    # chunks is an iterable of (cursor description, list of row tuples), and must include at least one
+    # (possibly empty) chunk so the table is created
+    # returns the CACHE_KEY_COLUMNS values of the cached rows (an empty list if the table has no key columns)
+    def cache_bcreg_chunks(self, table, chunks, use_sec=False):
+        start_time = time.perf_counter()
+        pfx = self.cache_table_prefixes[use_sec]
+        key_rows = []
+        desc = None
+        cache_cursor = None
+        try:
+            cache_cursor = self.cache.cursor()
+            for (chunk_desc, rows) in chunks:
+                if desc is None:
+                    desc = chunk_desc
+                    cache_cursor.execute(self.create_table_sql(table, desc, use_sec=use_sec))
+                    col_names = [col[0] for col in desc]
+                    insert_sql = 'insert into ' + pfx + table + ' (' + ', '.join(col_names) + ') values (' + ', '.join(['?']*len(col_names)) + ')'
+                    json_cols = [i for i, col in enumerate(desc) if col[1] == 114 or col[1] == 3802]
+                    key_cols = [(col_name, col_names.index(col_name)) for col_name in CACHE_KEY_COLUMNS.get(table, []) if col_name in col_names]
+                if 0 < len(json_cols):
+                    rows = [list(row) for row in rows]
+                    for row in rows:
+                        for i in json_cols:
+                            row[i] = self.get_sql_insert_value(row[i], desc[i][1])
+                if 0 < len(rows):
+                    cache_cursor.executemany(insert_sql, rows)
+                if 0 < len(key_cols):
+                    key_rows.extend([{col_name: row[i] for (col_name, i) in key_cols} for row in rows])
+            if desc is not None:
+                self.create_cache_indexes(cache_cursor, table, desc, use_sec=use_sec)
+            cache_cursor.close()
+            cache_cursor = None
+            self.cache_load_times[pfx + table] = self.cache_load_times.get(pfx + table, 0) + (time.perf_counter() - start_time)
+            return key_rows
+        except (Exception) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("BCRegistries exception loading table: " + table)
+            log_error("BCRegistries exception reading DB: " + str(error))
+            raise 
+        finally:
+            if cache_cursor is not None:
+                cache_cursor.close()
+            cache_cursor = None
+
     def get_cache_sql(self, sql):
         cursor = None
         try:
@@ -536,12 +680,16 @@ class BCReg_Core:
     def get_bcreg_sql(self, table, sql, cache=False, generate_individual_sql=False, use_sec=False):
         if DEBUG_SQL_STATEMENTS:
             print(">>> sql for caching:", sql)
+        (desc, rows) = self.fetch_bcreg_sql(sql, self.sec_conn if use_sec else self.conn)
+        if self.use_local_cache() and cache:
+            self.cache_bcreg_data(table, desc, rows, generate_individual_sql, use_sec=use_sec)
+        return rows
+
+    # run a query and return the cursor description and an array of dicts
+    def fetch_bcreg_sql(self, sql, conn):
         cursor = None
         try:
-            if use_sec:
-                cursor = self.sec_conn.cursor()
-            else:
-                cursor = self.conn.cursor()
+            cursor = conn.cursor()
             cursor.execute(sql)
             desc = cursor.description
             column_names = [col[0] for col in desc]
@@ -549,9 +697,7 @@ class BCReg_Core:
                 for row in cursor]
             cursor.close()
             cursor = None
-            if self.use_local_cache() and cache:
-                self.cache_bcreg_data(table, desc, rows, generate_individual_sql, use_sec=use_sec)
-            return rows
+            return (desc, rows)
         except (Exception, psycopg2.DatabaseError) as error:
             LOGGER.error(error)
             LOGGER.error(traceback.print_exc())
@@ -562,10 +708,78 @@ class BCReg_Core:
                 cursor.close()
             cursor = None
 
+    # return the code tables from the process-wide code table cache, as {table: {'version', 'desc', 'rows', 'lookups'}}
+    # the first time a table is used by this instance its version (md5 of the contents) is checked in a single query,
+    # and the table is re-loaded if it has changed
+    def get_code_tables(self, tables, use_sec=False):
+        db_name = self.SEC_PG_DATABASE_NAME if use_sec else self.PG_DATABASE_NAME
+        pfx = self.SEC_DB_TABLE_PREFIX if use_sec else self.DB_TABLE_PREFIX
+        conn = self.sec_conn if use_sec else self.conn
+        check_tables = [table for table in tables if (db_name, table) not in self.code_tables]
+        if 0 < len(check_tables):
+            sql = " UNION ALL ".join(["SELECT '" + table + "' table_name, md5(coalesce(string_agg(t::text, ',' ORDER BY t::text), '')) table_version FROM " + pfx + table + " t"
+                                      for table in check_tables])
+            with CODE_TABLE_CACHE_LOCK:
+                (_desc, versions) = self.fetch_bcreg_sql(sql, conn)
+                for version in versions:
+                    key = (db_name, version['table_name'])
+                    if key not in CODE_TABLE_CACHE or CODE_TABLE_CACHE[key]['version'] != version['table_version']:
+                        LOGGER.info("Loading code table: " + version['table_name'])
+                        (desc, rows) = self.fetch_bcreg_table_rows(pfx + version['table_name'], conn)
+                        CODE_TABLE_CACHE[key] = {'version': version['table_version'], 'desc': desc, 'rows': rows, 'lookups': {}}
+                    self.code_tables[key] = CODE_TABLE_CACHE[key]
+        return {table: self.code_tables[(db_name, table)] for table in tables}
+
+    # code table lookups use the process-wide code table cache, unless the in-mem cache was loaded some other way
+    # (e.g. with sample data for unit testing)
+    def use_code_table_cache(self, table, use_sec=False):
+        db_name = self.SEC_PG_DATABASE_NAME if use_sec else self.PG_DATABASE_NAME
+        return (not self.use_local_cache()) or (db_name, table) in self.code_tables
+
+    # return the first code table row with the given key value, as a dict of the requested columns (or {} if not found)
+    def get_code_table_row(self, table, key_col, key_value, columns, use_sec=False):
+        code_table = self.get_code_tables([table], use_sec=use_sec)[table]
+        if key_col not in code_table['lookups']:
+            col_names = [col[0] for col in code_table['desc']]
+            lookup = {}
+            for row in code_table['rows']:
+                row_dict = dict(zip(col_names, row))
+                if row_dict[key_col] not in lookup:
+                    lookup[row_dict[key_col]] = row_dict
+            code_table['lookups'][key_col] = lookup
+        row = code_table['lookups'][key_col].get(key_value)
+        if row is None:
+            return {}
+        return {col: row[col] for col in columns}
+
+    # return the cursor description and all rows (as tuples) of a table
+    def fetch_bcreg_table_rows(self, table, conn):
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM " + table)
+            rows = cursor.fetchall()
+            desc = cursor.description
+            cursor.close()
+            cursor = None
+            return (desc, rows)
+        except (Exception, psycopg2.DatabaseError) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("BCRegistries exception reading DB: " + str(error))
+            raise 
+        finally:
+            if cursor is not None:
+                cursor.close()
+
     # get all records and return in an array of dicts
     # returns a zero-length array if none found
     # optionally takes a WHERE clause and ORDER BY clause (must be valid SQL)
     def get_bcreg_table(self, table, where="", orderby="", cache=False, generate_individual_sql=False, use_sec=False):
+        sql = self.get_bcreg_table_sql(table, where, orderby, use_sec=use_sec)
+        return self.get_bcreg_sql(table, sql, cache, generate_individual_sql, use_sec=use_sec)
+
+    def get_bcreg_table_sql(self, table, where="", orderby="", use_sec=False):
         pfx = self.SEC_DB_TABLE_PREFIX if use_sec else self.DB_TABLE_PREFIX
         sql = "SELECT * FROM " + pfx + table
         if 0 < len(where):
@@ -575,7 +789,161 @@ class BCReg_Core:
             sql = sql + " ORDER BY " + orderby
         if DEBUG_SQL_STATEMENTS:
             print(">>> caching data with:", sql)
-        return self.get_bcreg_sql(table, sql, cache, generate_individual_sql, use_sec=use_sec)
+        return sql
+
+    # load the records for a list of (table, where) queries into the in-mem cache, running the queries concurrently
+    # over the cache load connections (the results are cached in the order of the list)
+    # rows are streamed into the cache in chunks, and only the CACHE_KEY_COLUMNS of each row are returned
+    # (if not caching, or generating sql, the full rows are returned)
+    # returns an array of dicts for each query, in the same order
+    def get_bcreg_tables(self, table_wheres, cache=False, generate_individual_sql=False, use_sec=False):
+        if generate_individual_sql or not (self.use_local_cache() and cache):
+            return [self.get_bcreg_table(table, where, '', cache, generate_individual_sql, use_sec=use_sec) for (table, where) in table_wheres]
+
+        conns = None
+        if 1 < CACHE_LOAD_WORKERS and 1 < len(table_wheres):
+            conns = self.get_cache_load_conns(use_sec=use_sec)
+        if conns is None:
+            src_conn = self.sec_conn if use_sec else self.conn
+            return [self.cache_bcreg_chunks(table, self.fetch_bcreg_chunks(self.get_bcreg_table_sql(table, where, use_sec=use_sec), src_conn), use_sec=use_sec) 
+                        for (table, where) in table_wheres]
+
+        ret_rows = []
+        cancelled = threading.Event()
+        with ThreadPoolExecutor(max_workers=CACHE_LOAD_WORKERS) as executor:
+            try:
+                chunk_queues = []
+                for (table, where) in table_wheres:
+                    sql = self.get_bcreg_table_sql(table, where, use_sec=use_sec)
+                    chunk_queue = queue.Queue(maxsize=CACHE_LOAD_QUEUE_SIZE)
+                    executor.submit(self.queue_bcreg_chunks, sql, conns, chunk_queue, cancelled)
+                    chunk_queues.append(chunk_queue)
+                # the sqlite cache can only be updated from this thread
+                for (table, where), chunk_queue in zip(table_wheres, chunk_queues):
+                    ret_rows.append(self.cache_bcreg_chunks(table, self.dequeue_bcreg_chunks(chunk_queue), use_sec=use_sec))
+            except:
+                # stop any queries still running
+                cancelled.set()
+                raise
+        return ret_rows
+
+    # fetch the results of a query in chunks of CACHE_LOAD_CHUNK_SIZE rows, using a server-side cursor
+    # yields (cursor description, list of row tuples), the first chunk is returned even if there are no rows
+    def fetch_bcreg_chunks(self, sql, conn):
+        if DEBUG_SQL_STATEMENTS:
+            print(">>> sql for caching:", sql)
+        cursor = None
+        try:
+            cursor = conn.cursor('cache_load')
+            cursor.execute(sql)
+            rows = cursor.fetchmany(CACHE_LOAD_CHUNK_SIZE)
+            yield (cursor.description, rows)
+            while CACHE_LOAD_CHUNK_SIZE <= len(rows):
+                rows = cursor.fetchmany(CACHE_LOAD_CHUNK_SIZE)
+                if 0 < len(rows):
+                    yield (cursor.description, rows)
+            cursor.close()
+            cursor = None
+        except (Exception, psycopg2.DatabaseError) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("BCRegistries exception reading DB: " + str(error))
+            raise 
+        finally:
+            if cursor is not None:
+                cursor.close()
+            cursor = None
+
+    # run a query on the next available cache load connection, and put the chunks of rows on the queue
+    # (followed by None, or by the exception if the query fails)
+    def queue_bcreg_chunks(self, sql, conns, chunk_queue, cancelled):
+        conn = conns.get()
+        try:
+            chunks = self.fetch_bcreg_chunks(sql, conn)
+            try:
+                for chunk in chunks:
+                    if not self.put_bcreg_chunk(chunk_queue, chunk, cancelled):
+                        return
+            finally:
+                chunks.close()
+            self.put_bcreg_chunk(chunk_queue, None, cancelled)
+        except (Exception) as error:
+            self.put_bcreg_chunk(chunk_queue, error, cancelled)
+        finally:
+            conns.put(conn)
+
+    # put a chunk on the (bounded) queue, returns False if the load was cancelled
+    def put_bcreg_chunk(self, chunk_queue, chunk, cancelled):
+        while not cancelled.is_set():
+            try:
+                chunk_queue.put(chunk, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # return the chunks put on the queue by queue_bcreg_chunks()
+    def dequeue_bcreg_chunks(self, chunk_queue):
+        while True:
+            chunk = chunk_queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    # open the connections used to load the in-mem cache - these all share the snapshot of the main
+    # (REPEATABLE READ) connection, so they return the same data as if the queries were run on the main connection
+    # returns None if the snapshot can't be shared (e.g. on a read-only replica), in which case the cache is loaded sequentially
+    def get_cache_load_conns(self, use_sec=False):
+        db_name = self.SEC_PG_DATABASE_NAME if use_sec else self.PG_DATABASE_NAME
+        if db_name in self.cache_load_conns:
+            return self.cache_load_conns[db_name]
+
+        src_conn = self.sec_conn if use_sec else self.conn
+        conns = None
+        cursor = None
+        try:
+            # (the snapshot must be exported at the top level of the transaction, it can't be exported from a savepoint)
+            cursor = src_conn.cursor()
+            try:
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot_id = cursor.fetchone()[0]
+            except (Exception, psycopg2.DatabaseError) as error:
+                LOGGER.warning("Unable to export snapshot, caching data sequentially: " + str(error))
+                snapshot_id = None
+                # the failed transaction can't be used any more, so start over with a new one (with the same settings)
+                cursor.close()
+                cursor = None
+                src_conn.rollback()
+                src_conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+            if cursor is not None:
+                cursor.close()
+                cursor = None
+
+            if snapshot_id is not None:
+                params = config(section=db_name)
+                conns = queue.Queue()
+                for _i in range(CACHE_LOAD_WORKERS):
+                    conn = psycopg2.connect(**params)
+                    conns.put(conn)
+                    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+                    cursor = conn.cursor()
+                    cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+                    cursor.close()
+                    cursor = None
+            self.cache_load_conns[db_name] = conns
+            return conns
+        except (Exception, psycopg2.DatabaseError) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("BCRegistries exception connecting to DB: " + str(error))
+            while conns is not None and not conns.empty():
+                conns.get().close()
+            raise 
+        finally:
+            if cursor is not None:
+                cursor.close()
 
     # get all records and return in an array of dicts
     # returns a zero-length array if none found
@@ -682,8 +1050,9 @@ class BCReg_Core:
                 corp_nums_list_str = self.id_where_in(corp_nums_list, True)
                 corp_num_where = 'identifier in (' + corp_nums_list_str + ')' if 0 < len(corp_nums_list_str) else "identifier = ''"
                 corp_num_where_ex = corp_num_where + f" UNION {UNION_SELECT_PLACEHOLDER} WHERE id in (select distinct business_id from party_roles_version, parties_version where party_roles_version.party_id = parties_version.id and parties_version." + corp_num_where + ")"
-                for corp_table in self.lear_corp_tables:
-                    _rows = self.get_bcreg_table(corp_table, corp_num_where_ex, '', True, generate_individual_sql, use_sec=use_sec)
+                # (queries that don't depend on each other are run concurrently, see get_bcreg_tables())
+                rows_list = self.get_bcreg_tables([(corp_table, corp_num_where_ex) for corp_table in self.lear_corp_tables], True, generate_individual_sql, use_sec=use_sec)
+                for corp_table, _rows in zip(self.lear_corp_tables, rows_list):
                     if corp_table == 'businesses':
                         for _row in _rows:
                             bus_ids_list.append(_row['id'])
@@ -695,8 +1064,8 @@ class BCReg_Core:
                 party_ids_list = []
                 bus_id_where = 'business_id in (' + self.id_where_in(bus_ids_list, True) + ')' if 0 < len(bus_ids_list) else "business_id = 0"
                 bus_id_where += f" UNION {UNION_SELECT_PLACEHOLDER} WHERE business_id in (select distinct business_id from party_roles_version, parties_version where party_roles_version.party_id = parties_version.id and parties_version." + corp_num_where + ")"
-                for other_table in self.lear_other_tables:
-                    _rows = self.get_bcreg_table(other_table, bus_id_where, '', True, generate_individual_sql, use_sec=use_sec)
+                rows_list = self.get_bcreg_tables([(other_table, bus_id_where) for other_table in self.lear_other_tables], True, generate_individual_sql, use_sec=use_sec)
+                for other_table, _rows in zip(self.lear_other_tables, rows_list):
                     if other_table == 'party_roles':
                         for _row in _rows:
                             if _row['party_id'] is not None:
@@ -709,8 +1078,8 @@ class BCReg_Core:
                 additional_identifiers = []
                 party_id_where = 'id in (' + self.id_where_in(party_ids_list, True) + ')' if 0 < len(party_ids_list) else "id = 0"
                 party_id_where += f" UNION {UNION_SELECT_PLACEHOLDER} WHERE identifier in (" + self.id_where_in(corp_nums_list, True) + ")"
-                for other_table in self.lear_other_other_tables:
-                    _rows = self.get_bcreg_table(other_table, party_id_where, '', True, generate_individual_sql, use_sec=use_sec)
+                rows_list = self.get_bcreg_tables([(other_table, party_id_where) for other_table in self.lear_other_other_tables], True, generate_individual_sql, use_sec=use_sec)
+                for other_table, _rows in zip(self.lear_other_other_tables, rows_list):
                     if other_table == 'parties':
                         for _row in _rows:
                             if _row['identifier'] is not None and 0 < len(_row['identifier']):
@@ -718,16 +1087,16 @@ class BCReg_Core:
                 if 0 < len(additional_identifiers):
                     corp_nums_list_str = self.id_where_in(additional_identifiers, True)
                     corp_num_where = 'identifier in (' + corp_nums_list_str + ')'
-                    for corp_table in self.lear_corp_tables:
-                        _rows = self.get_bcreg_table(corp_table, corp_num_where, '', True, generate_individual_sql, use_sec=use_sec)
+                    _rows = self.get_bcreg_tables([(corp_table, corp_num_where) for corp_table in self.lear_corp_tables], True, generate_individual_sql, use_sec=use_sec)
 
+                txn_wheres = []
                 txn_id_where = 'id in (' + self.id_where_in(txn_ids_list, True) + ')' if 0 < len(txn_ids_list) else "id = 0"
                 for other_table in self.lear_other_other_other_tables:
-                    _rows = self.get_bcreg_table(other_table, txn_id_where, '', True, generate_individual_sql, use_sec=use_sec)
-
+                    txn_wheres.append((other_table, txn_id_where))
                 txn_id_where = 'transaction_id in (' + self.id_where_in(txn_ids_list, True) + ')' if 0 < len(txn_ids_list) else "transaction_id = 0"
                 for other_table in self.lear_other_other_other_other_tables:
-                    _rows = self.get_bcreg_table(other_table, txn_id_where, '', True, generate_individual_sql, use_sec=use_sec)
+                    txn_wheres.append((other_table, txn_id_where))
+                _rows = self.get_bcreg_tables(txn_wheres, True, generate_individual_sql, use_sec=use_sec)
 
     # load all bc registries data for the specified corps into our in-mem cache
     def cache_lear_bcreg_code_tables(self, generate_individual_sql=False, use_sec=False):
@@ -735,6 +1104,12 @@ class BCReg_Core:
             LOGGER.info('Caching data for code tables ...')
             self.generated_sqls = []
             self.generated_corp_nums = {}
-            for code_table in self.lear_code_tables:
-                _rows = self.get_bcreg_table(code_table, '', '', True, generate_individual_sql, use_sec=use_sec)
+            if generate_individual_sql:
+                for code_table in self.lear_code_tables:
+                    _rows = self.get_bcreg_table(code_table, '', '', True, generate_individual_sql, use_sec=use_sec)
+            else:
+                # code tables are shared across batches, see get_code_tables()
+                code_tables = self.get_code_tables(self.lear_code_tables, use_sec=use_sec)
+                for code_table in self.lear_code_tables:
+                    self.cache_bcreg_chunks(code_table, [(code_tables[code_table]['desc'], code_tables[code_table]['rows'])], use_sec=use_sec)
 
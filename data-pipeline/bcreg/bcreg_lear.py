@@ -122,13 +122,13 @@ class CustomJsonEncoder(json.JSONEncoder):
 # data is returned as dictionaries, using the sql column name as identifier
 class BCReg_Lear(BCReg_Core):
 
-    def __init__(self, cache=False):
+    def __init__(self, cache=False, shared_with=None):
         self.sql_local_cache = cache
         self.PG_DATABASE_NAME = BC_REGISTRIES_DATABASE_NAME
         self.source_system_type = lear_system_type
         self.SEC_DB_TABLE_PREFIX = BC_REG_COLIN_TABLE_PREFIX
         self.SEC_PG_DATABASE_NAME = BC_REG_COLIN_DATABASE_NAME
-        super().__init__(cache)
+        super().__init__(cache, shared_with=shared_with)
 
 
     ###########################################################################
@@ -137,7 +137,8 @@ class BCReg_Lear(BCReg_Core):
 
     # load all bc registries data for the specified corps into our in-mem cache
     def cache_bcreg_corps(self, specific_corps, generate_individual_sql=False):
-        if self.use_local_cache():
+        # if sharing a BC Reg processor's cache, the LEAR data is cached by that processor
+        if self.use_local_cache() and self.shared_with is None:
             self.cache_lear_bcreg_corps(specific_corps, generate_individual_sql=generate_individual_sql)
 
     # load all bc registries data for the specified corps into our in-mem cache
@@ -292,37 +293,43 @@ class BCReg_Lear(BCReg_Core):
 
     # return unprocessed corporations, based on an event range
     def get_unprocessed_corps(self, last_event_id, last_event_dt):
-        sqlt = """SELECT id, issued_at from transaction
-                  WHERE issued_at >= %s"""
-        sqlb = """SELECT identifier from businesses_version
-                  WHERE transaction_id = %s"""
+        # select the businesses changed since the last event, along with any related corps (organizations that are proprietors
+        # of a changed business) - one row per changed business and related corp
+        # (a party row for the changed corp itself would only return that corp, which is already selected, so it isn't queried)
+        sql = """WITH changed AS (
+                    SELECT bv.identifier, min(txn.id) first_txn_id
+                    FROM transaction txn, businesses_version bv
+                    WHERE txn.issued_at >= %s AND bv.transaction_id = txn.id
+                    GROUP BY bv.identifier
+                 )
+                 SELECT changed.identifier, changed.first_txn_id, NULL related_corp_num
+                 FROM changed
+                 UNION ALL
+                 SELECT changed.identifier, changed.first_txn_id, parties.identifier
+                 FROM changed, businesses businesses, parties_version parties, party_roles_version roles
+                 WHERE businesses.identifier = changed.identifier
+                   AND businesses.id = roles.business_id
+                   AND roles.party_id = parties.id 
+                   AND parties.party_type = 'organization' and roles.role in ('proprietor')
+                 ORDER BY 2"""
 
         corps = []
-        event_ids = []
         corp_set = {}
+        related_corps = {}
         cur = None
         try:
-            LOGGER.info("Executing: " + sqlt + " with " + str(last_event_dt))
-            cur = self.conn.cursor()
-            cur.execute(sqlt, (last_event_dt,))
-            row = cur.fetchone()
-            while row is not None:
-                event_ids.append(row[0])
-                row = cur.fetchone()
+            LOGGER.info("Executing: " + sql + " with " + str(last_event_dt))
+            # use a server-side cursor, the list of changed businesses can be large
+            cur = self.conn.cursor('unprocessed_corps')
+            cur.execute(sql, (last_event_dt,))
+            for row in cur:
+                if not row[0] in corp_set:
+                    corp_set[row[0]] = row[0]
+                    corps.append({'CORP_NUM':row[0],})
+                if row[2] is not None:
+                    related_corps.setdefault(row[0], []).append(row[2])
             cur.close()
             cur = None
-            for event_id in event_ids:
-                LOGGER.info("Executing: " + sqlb + " with " + str(event_id))
-                cur = self.conn.cursor()
-                cur.execute(sqlb, (event_id,))
-                row = cur.fetchone()
-                while row is not None:
-                    if not row[0] in corp_set:
-                        corp_set[row[0]] = row[0]
-                        corps.append({'CORP_NUM':row[0],})
-                    row = cur.fetchone()
-                cur.close()
-                cur = None
             LOGGER.info("Loaded corps: " + str(len(corps)))
         except (Exception, psycopg2.DatabaseError) as error:
             LOGGER.error(error)
@@ -333,72 +340,15 @@ class BCReg_Lear(BCReg_Core):
             if cur is not None:
                 cur.close()
 
-        # since the event may affect more than one corp, check corp_state to see if there are any other corps to bring into scope
-        """
-        # TODO need to see how this applies in the new LEAR database
-        sql = " " "SELECT corp_num from " " " + self.DB_TABLE_PREFIX + " " "corp_state
-                where start_event_id = %s or end_event_id = %s" " "
-        i = 0
-        for event_id in event_ids:
-            i = i + 1
-            if (i % 1000 == 0):
-                LOGGER.info("Processing %s of %s", i, len(event_ids))
-            cur = None
-            try:
-                cur = self.conn.cursor()
-                cur.execute(sql, (event_id, event_id,))
-                row = cur.fetchone()
-                while row is not None:
-                    if not row[0] in corp_set:
-                        corp_set[row[0]] = row[0]
-                        corps.append({'CORP_NUM':row[0],})
-                    row = cur.fetchone()
-                cur.close()
-                cur = None
-            except (Exception, psycopg2.DatabaseError) as error:
-                LOGGER.error(error)
-                LOGGER.error(traceback.print_exc())
-                log_error("BCRegistries exception reading DB: " + str(error))
-                raise
-            finally:
-                if cur is not None:
-                    cur.close()
-        LOGGER.info("Loaded corps: " + str(len(corps)))
-        """
-
-        # since a related corp may be impacted by a corp change, check for related corps via corp_party table
-        sql1 = """SELECT parties.identifier corp_num
-                  FROM businesses businesses,
-                       parties_version parties, 
-                       party_roles_version roles
-                  WHERE businesses.id = roles.business_id
-                    AND roles.party_id = parties.id 
-                    AND parties.party_type = 'organization' and roles.role in ('proprietor')
-                    AND (parties.identifier = %s
-                         OR roles.business_id = (select id from businesses where identifier = %s))"""
+        # TODO need to see how corp_state (other corps affected by an event) applies in the new LEAR database
+
+        # add the related corps after the changed businesses
         new_corps = []
         for corp in corps:
-            cur = None
-            try:
-                # LOGGER.info("Executing: " + sql1 + " with" + str(corp['CORP_NUM']))
-                cur = self.conn.cursor()
-                cur.execute(sql1, (corp['CORP_NUM'],corp['CORP_NUM'],))
-                row = cur.fetchone()
-                while row is not None and row[0] is not None:
-                    if not row[0] in corp_set:
-                        corp_set[row[0]] = row[0]
-                        new_corps.append({'CORP_NUM':row[0],})
-                    row = cur.fetchone()
-                cur.close()
-                cur = None
-            except (Exception, psycopg2.DatabaseError) as error:
-                LOGGER.error(error)
-                LOGGER.error(traceback.print_exc())
-                log_error("BCRegistries exception reading DB: " + str(error))
-                raise
-            finally:
-                if cur is not None:
-                    cur.close()
+            for corp_num in related_corps.get(corp['CORP_NUM'], []):
+                if not corp_num in corp_set:
+                    corp_set[corp_num] = corp_num
+                    new_corps.append({'CORP_NUM':corp_num,})
         LOGGER.info("Loaded corps: " + str(len(new_corps)))
         corps.extend(new_corps)
 
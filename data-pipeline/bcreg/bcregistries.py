@@ -8,6 +8,7 @@ import string
 import decimal
 import random
 import types
+import copy
 import traceback
 import logging
 
@@ -37,6 +38,12 @@ MIN_START_DATE_TZ = timezone.localize(MIN_START_DATE)
 MAX_END_DATE_TZ   = timezone.localize(MAX_END_DATE)
 DATA_CONVERSION_DATE_TZ = timezone.localize(DATA_CONVERSION_DATE)
 
+# column types that need to be converted back when reading data returned from postgres as json
+JSON_TIMESTAMP_TYPES = ['timestamp without time zone', 'timestamp with time zone']
+JSON_DATE_TYPES = ['date']
+JSON_NUMERIC_TYPES = ['numeric']
+JSON_FLOAT_TYPES = ['double precision', 'real']
+
 CORP_TYPES_IN_SCOPE = {
     "A":   "EXTRA PRO",
     "B":   "EXTRA PRO",
@@ -127,14 +134,19 @@ def is_data_conversion_event(event):
 # data is returned as dictionaries, using the sql column name as identifier
 class BCRegistries(BCReg_Core):
 
-    def __init__(self, cache=False):
+    def __init__(self, cache=False, shared_with=None):
         self.sql_local_cache = cache
         self.DB_TABLE_PREFIX = BC_REGISTRIES_TABLE_PREFIX
         self.PG_DATABASE_NAME = BC_REGISTRIES_DATABASE_NAME
         self.source_system_type = system_type
         self.SEC_DB_TABLE_PREFIX = ""
         self.SEC_PG_DATABASE_NAME = BC_REG_LEAR_DATABASE_NAME
-        super().__init__(cache)
+        # events pre-loaded for a batch of corps, as {event_id: event}
+        self.preloaded_events = {}
+        # corp data pre-loaded (as json) for a batch of corps, as {corp_num: {table: rows}}
+        self.preloaded_corps = {}
+        self.json_column_types = None
+        super().__init__(cache, shared_with=shared_with)
 
 
     ###########################################################################
@@ -182,12 +194,15 @@ class BCRegistries(BCReg_Core):
             specific_corps = list({s_corp for s_corp in specific_corps})
             specific_corps_lists = self.split_list(specific_corps, MAX_WHERE_IN)
 
-            addr_id_list = []
+            # (queries that don't depend on each other are run concurrently, see get_bcreg_tables())
+            party_wheres = []
             for corp_nums_list in specific_corps_lists:
                 corp_list = self.id_where_in(corp_nums_list, True)
                 corp_party_where = 'bus_company_num in (' + corp_list + ') or corp_num in (' + corp_list + ')'
-                party_rows = self.get_bcreg_table(self.colin_other_tables[0], corp_party_where, '', True, generate_individual_sql)
+                party_wheres.append((self.colin_other_tables[0], corp_party_where))
+            party_rows_list = self.get_bcreg_tables(party_wheres, True, generate_individual_sql)
 
+            for party_rows in party_rows_list:
                 # include all corp_num from the parties just returned (dba related companies)
                 for party in party_rows:
                     specific_corps.append(party['corp_num'])
@@ -198,48 +213,47 @@ class BCRegistries(BCReg_Core):
             specific_corps = list({s_corp for s_corp in specific_corps})
             specific_corps_lists = self.split_list(specific_corps, MAX_WHERE_IN)
 
-            event_ids = []
+            LOGGER.info('Caching data for corporations ...')
+            corp_wheres = []
             for corp_nums_list in specific_corps_lists:
                 corp_nums_list = self.id_where_in(corp_nums_list, True)
-                event_where = 'corp_num in (' + corp_nums_list + ')'
-                event_rows = self.get_bcreg_table(self.colin_other_tables[1], event_where, '', True, generate_individual_sql)
+                corp_num_where = 'corp_num in (' + corp_nums_list + ')'
+                corp_wheres.append((self.colin_other_tables[1], corp_num_where))
+                for corp_table in self.colin_corp_tables:
+                    corp_wheres.append((corp_table, corp_num_where))
+                corp_wheres.append((self.colin_other_tables[4], corp_num_where))
+            corp_rows_list = self.get_bcreg_tables(corp_wheres, True, generate_individual_sql)
 
-                for event in event_rows:
-                    event_ids.append(str(event['event_id']))
+            event_ids = []
+            addr_id_list = []
+            for (table, _where), rows in zip(corp_wheres, corp_rows_list):
+                if table == self.colin_other_tables[1]:
+                    for event in rows:
+                        event_ids.append(str(event['event_id']))
+                elif table == self.colin_other_tables[4]:
+                    for office in rows:
+                        if office['mailing_addr_id'] is not None:
+                            addr_id_list.append(str(office['mailing_addr_id']))
+                        if office['delivery_addr_id'] is not None:
+                            addr_id_list.append(str(office['delivery_addr_id']))
 
             # ensure we have a unique list
             event_ids = list({event_id for event_id in event_ids})
             event_ids_lists = self.split_list(event_ids, MAX_WHERE_IN)
+            addr_id_list = list({addr_id for addr_id in addr_id_list})
+            addr_ids_lists = self.split_list(addr_id_list, MAX_WHERE_IN)
 
+            id_wheres = []
             for ids_list in event_ids_lists:
                 event_list = self.id_where_in(ids_list)
                 filing_where = 'event_id in (' + event_list + ')'
-                _rows = self.get_bcreg_table(self.colin_other_tables[2], filing_where, '', True, generate_individual_sql)
-                _rows = self.get_bcreg_table(self.colin_other_tables[3], filing_where, '', True, generate_individual_sql)
-
-            LOGGER.info('Caching data for corporations ...')
-            for corp_nums_list in specific_corps_lists:
-                corp_nums_list = self.id_where_in(corp_nums_list, True)
-                corp_num_where = 'corp_num in (' + corp_nums_list + ')'
-                for corp_table in self.colin_corp_tables:
-                    _rows = self.get_bcreg_table(corp_table, corp_num_where, '', True, generate_individual_sql)
-
-                office_where = 'corp_num in (' + corp_nums_list + ')'
-                office_rows = self.get_bcreg_table(self.colin_other_tables[4], office_where, '', True, generate_individual_sql)
-
-                for office in office_rows:
-                    if office['mailing_addr_id'] is not None:
-                        addr_id_list.append(str(office['mailing_addr_id']))
-                    if office['delivery_addr_id'] is not None:
-                        addr_id_list.append(str(office['delivery_addr_id']))
-
-            # ensure we have a unique list
-            addr_id_list = list({addr_id for addr_id in addr_id_list})
-            addr_ids_lists = self.split_list(addr_id_list, MAX_WHERE_IN)
+                id_wheres.append((self.colin_other_tables[2], filing_where))
+                id_wheres.append((self.colin_other_tables[3], filing_where))
             for ids_list in addr_ids_lists:
                 addr_list = self.id_where_in(ids_list)
                 address_where = 'addr_id in (' + addr_list + ')'
-                _rows = self.get_bcreg_table(self.colin_other_tables[5], address_where, '', True, generate_individual_sql)
+                id_wheres.append((self.colin_other_tables[5], address_where))
+            _rows = self.get_bcreg_tables(id_wheres, True, generate_individual_sql)
 
     # load all bc registries data for the specified corps into our in-mem cache
     def cache_bcreg_code_tables(self, generate_individual_sql=False):
@@ -247,8 +261,14 @@ class BCRegistries(BCReg_Core):
             LOGGER.info('Caching data for code tables ...')
             self.generated_sqls = []
             self.generated_corp_nums = {}
-            for code_table in self.colin_code_tables:
-                _rows = self.get_bcreg_table(code_table, '', '', True, generate_individual_sql)
+            if generate_individual_sql:
+                for code_table in self.colin_code_tables:
+                    _rows = self.get_bcreg_table(code_table, '', '', True, generate_individual_sql)
+            else:
+                # code tables are shared across batches, see get_code_tables()
+                code_tables = self.get_code_tables(self.colin_code_tables)
+                for code_table in self.colin_code_tables:
+                    self.cache_bcreg_chunks(code_table, [(code_tables[code_table]['desc'], code_tables[code_table]['rows'])])
 
     # clear in-mem cache - delete all existing data
     def cache_cleanup(self):
@@ -422,102 +442,93 @@ class BCRegistries(BCReg_Core):
 
     # return unprocessed corporations, based on an event range
     def get_unprocessed_corps(self, last_event_id, last_event_dt):
-        sqls = []
-
         # select *all* corps - we will filter in the next stage
-        sqls.append("""SELECT corp_num, event_id from """ + self.DB_TABLE_PREFIX + """event
-                        where event_timestmp >= %s""")
+        sql = """SELECT corp_num, event_id from """ + self.DB_TABLE_PREFIX + """event
+                        where event_timestmp >= %s"""
+
+        # since the event may affect more than one corp, check corp_state to see if there are any other corps to bring into scope
+        sql_state = """SELECT event.event_id, state.corp_num from """ + self.DB_TABLE_PREFIX + """event event, """ + self.DB_TABLE_PREFIX + """corp_state state
+                        where event.event_timestmp >= %s and state.start_event_id = event.event_id
+                       UNION ALL
+                       SELECT event.event_id, state.corp_num from """ + self.DB_TABLE_PREFIX + """event event, """ + self.DB_TABLE_PREFIX + """corp_state state
+                        where event.event_timestmp >= %s and state.end_event_id = event.event_id"""
 
         corps = []
         event_ids = []
         corp_set = {}
-        for sql in sqls:
+        state_corps = {}
+        cur = None
+        try:
+            LOGGER.info("Executing: " + sql + " with " + str(last_event_dt))
+            # use server-side cursors, the event list can be large
+            cur = self.conn.cursor('unprocessed_events')
+            cur.execute(sql, (last_event_dt,))
+            for row in cur:
+                if not row[0] in corp_set:
+                    corp_set[row[0]] = row[0]
+                    corps.append({'CORP_NUM':row[0],})
+                event_ids.append(row[1])
+            cur.close()
             cur = None
-            try:
-                LOGGER.info("Executing: " + sql + " with " + str(last_event_dt))
-                cur = self.conn.cursor()
-                cur.execute(sql, (last_event_dt,))
-                row = cur.fetchone()
-                while row is not None:
-                    if not row[0] in corp_set:
-                        corp_set[row[0]] = row[0]
-                        corps.append({'CORP_NUM':row[0],})
-                    event_ids.append(row[1])
-                    row = cur.fetchone()
-                cur.close()
-                cur = None
-                LOGGER.info("Loaded corps: " + str(len(corps)))
-            except (Exception, psycopg2.DatabaseError) as error:
-                LOGGER.error(error)
-                LOGGER.error(traceback.print_exc())
-                log_error("BCRegistries exception reading DB: " + str(error))
-                raise
-            finally:
-                if cur is not None:
-                    cur.close()
+            LOGGER.info("Loaded corps: " + str(len(corps)))
 
-        # since the event may affect more than one corp, check corp_state to see if there are any other corps to bring into scope
-        sql = """SELECT corp_num from """ + self.DB_TABLE_PREFIX + """corp_state
-                where start_event_id = %s or end_event_id = %s"""
-        i = 0
-        for event_id in event_ids:
-            i = i + 1
-            if (i % 1000 == 0):
-                LOGGER.info("Processing %s of %s", i, len(event_ids))
+            cur = self.conn.cursor('unprocessed_event_states')
+            cur.execute(sql_state, (last_event_dt, last_event_dt,))
+            for row in cur:
+                state_corps.setdefault(row[0], []).append(row[1])
+            cur.close()
             cur = None
-            try:
-                cur = self.conn.cursor()
-                cur.execute(sql, (event_id, event_id,))
-                row = cur.fetchone()
-                while row is not None:
-                    if not row[0] in corp_set:
-                        corp_set[row[0]] = row[0]
-                        corps.append({'CORP_NUM':row[0],})
-                    row = cur.fetchone()
+        except (Exception, psycopg2.DatabaseError) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("BCRegistries exception reading DB: " + str(error))
+            raise
+        finally:
+            if cur is not None:
                 cur.close()
-                cur = None
-            except (Exception, psycopg2.DatabaseError) as error:
-                LOGGER.error(error)
-                LOGGER.error(traceback.print_exc())
-                log_error("BCRegistries exception reading DB: " + str(error))
-                raise
-            finally:
-                if cur is not None:
-                    cur.close()
+
+        # add the corp_state corps in event order
+        for event_id in event_ids:
+            for corp_num in state_corps.pop(event_id, []):
+                if not corp_num in corp_set:
+                    corp_set[corp_num] = corp_num
+                    corps.append({'CORP_NUM':corp_num,})
         LOGGER.info("Loaded corps: " + str(len(corps)))
 
         # since a related corp may be impacted by a corp change, check for related corps via corp_party table
-        sql1 = """SELECT businesses.identifier corp_num
+        sql1 = """SELECT parties.identifier, businesses.identifier corp_num
                   FROM businesses businesses,
                        parties_version parties, 
                        party_roles_version roles
                   WHERE businesses.id = roles.business_id
                     AND roles.party_id = parties.id 
                     AND parties.party_type = 'organization' and roles.role in ('proprietor')
-                    AND (parties.identifier = %s)"""
-        new_corps = []
-        for corp in corps:
+                    AND parties.identifier = ANY(%s)"""
+        related_corps = {}
+        cur = None
+        try:
+            cur = self.sec_conn.cursor('unprocessed_related_corps')
+            cur.execute(sql1, (self.bc_ifiy([corp['CORP_NUM'] for corp in corps]),))
+            for row in cur:
+                if row[1] is not None:
+                    related_corps.setdefault(row[0], []).append(row[1])
+            cur.close()
             cur = None
-            try:
-                cur = self.sec_conn.cursor()
-                corp_num = self.bc_ifiy_one(corp['CORP_NUM'])
-                cur.execute(sql1, (corp_num,))
-                row = cur.fetchone()
-                while row is not None and row[0] is not None:
-                    if not row[0] in corp_set:
-                        corp_set[row[0]] = row[0]
-                        new_corps.append({'CORP_NUM':row[0],})
-                    row = cur.fetchone()
+        except (Exception, psycopg2.DatabaseError) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("BCRegistries exception reading DB: " + str(error))
+            raise
+        finally:
+            if cur is not None:
                 cur.close()
-                cur = None
-            except (Exception, psycopg2.DatabaseError) as error:
-                LOGGER.error(error)
-                LOGGER.error(traceback.print_exc())
-                log_error("BCRegistries exception reading DB: " + str(error))
-                raise
-            finally:
-                if cur is not None:
-                    cur.close()
+
+        new_corps = []
+        for corp in corps:
+            for corp_num in related_corps.pop(self.bc_ifiy_one(corp['CORP_NUM']), []):
+                if not corp_num in corp_set:
+                    corp_set[corp_num] = corp_num
+                    new_corps.append({'CORP_NUM':corp_num,})
         LOGGER.info("Loaded corps: " + str(len(new_corps)))
         corps.extend(new_corps)
 
@@ -584,43 +595,188 @@ class BCRegistries(BCReg_Core):
     # find a specific event, 
     # return None if not found
     def get_event(self, corp_num, event_id, corp_type_cd=None, force_query_remote=False):
-        sql = """SELECT event_id, corp_num, event.event_typ_cd, event_timestmp, trigger_dts, event_class, short_desc, full_desc
-                    FROM """ + self.get_table_prefix(force_query_remote) + """event event, """ + self.get_table_prefix(force_query_remote) + """event_type event_type
-                    WHERE event_id = """ + self.get_db_sql_param(force_query_remote) + """ and event.event_typ_cd = event_type.event_typ_cd"""
-                    # WHERE corp_num = """ + self.get_db_sql_param(force_query_remote) + """ and event_id = """ + self.get_db_sql_param(force_query_remote)
-        ret_event = None
+        events = self.get_events(corp_num, [event_id], corp_type_cd=corp_type_cd, force_query_remote=force_query_remote)
+        return self.copy_event(events, event_id)
+
+    # find a set of events, including their filing and conv_event, using one query per table
+    # returns a dict of {event_id: event}, events that are not found are not included
+    def get_events(self, corp_num, event_ids, corp_type_cd=None, force_query_remote=False):
+        raw_events = self.get_raw_events(corp_num, event_ids, force_query_remote)
+        ret_events = {}
+        for event_id, raw_event in raw_events.items():
+            ret_event = copy.deepcopy(raw_event)
+            ret_event['effective_date'] = self.get_event_filing_effective_date(ret_event, corp_type_cd)
+            ret_events[event_id] = ret_event
+        return ret_events
+
+    # return a copy of an event returned from get_events(), or {} if not found
+    # (events may be updated by the caller, so each record gets its own copy)
+    def copy_event(self, events, event_id):
+        if event_id in events:
+            return copy.deepcopy(events[event_id])
+        return {}
+
+    # load all events referenced by the name, office, state and jurisdiction records of a batch of corps
+    # (used when running without the in-mem cache, to avoid a round trip per event)
+    def preload_corp_events(self, specific_corps):
+        sql_ids = """SELECT start_event_id as event_id FROM """ + self.DB_TABLE_PREFIX + """corp_name WHERE corp_num in ({0})
+                     UNION SELECT end_event_id FROM """ + self.DB_TABLE_PREFIX + """corp_name WHERE corp_num in ({0})
+                     UNION SELECT start_event_id FROM """ + self.DB_TABLE_PREFIX + """office WHERE corp_num in ({0})
+                     UNION SELECT end_event_id FROM """ + self.DB_TABLE_PREFIX + """office WHERE corp_num in ({0})
+                     UNION SELECT start_event_id FROM """ + self.DB_TABLE_PREFIX + """corp_state WHERE corp_num in ({0})
+                     UNION SELECT end_event_id FROM """ + self.DB_TABLE_PREFIX + """corp_state WHERE corp_num in ({0})
+                     UNION SELECT start_event_id FROM """ + self.DB_TABLE_PREFIX + """jurisdiction WHERE corp_num in ({0})
+                     UNION SELECT end_event_id FROM """ + self.DB_TABLE_PREFIX + """jurisdiction WHERE corp_num in ({0})"""
+        specific_corps = list({s_corp for s_corp in specific_corps})
+        event_ids = []
+        for corp_nums_list in self.split_list(specific_corps, MAX_WHERE_IN):
+            rows = self.get_bcreg_sql('event', sql_ids.format(self.id_where_in(corp_nums_list, True)))
+            for row in rows:
+                if row['event_id'] is not None:
+                    event_ids.append(row['event_id'])
+        self.preloaded_events.update(self.get_raw_events(None, event_ids, force_query_remote=True))
+        LOGGER.info("Pre-loaded events: " + str(len(self.preloaded_events)))
+
+    # load all the data for a batch of corps using a single (json aggregate) query per MAX_WHERE_IN corps,
+    # the corp data is then read by get_bc_reg_corp_info() without any further queries
+    # (only runs against the bc registries database, not the in-mem cache - code tables come from the code table cache)
+    def preload_corp_info(self, specific_corps):
+        p = self.DB_TABLE_PREFIX
+        event_ids_sql = " UNION ".join(["SELECT " + col + " FROM " + p + table + " WHERE corp_num = c.corp_num"
+                                        for table in ['corp_name', 'office', 'corp_state', 'jurisdiction']
+                                        for col in ['start_event_id', 'end_event_id']])
+        addr_ids_sql = """SELECT delivery_addr_id FROM """ + p + """office WHERE corp_num = c.corp_num and office_typ_cd in ('RG','HD','FO')
+                          UNION SELECT mailing_addr_id FROM """ + p + """office WHERE corp_num = c.corp_num and office_typ_cd in ('RG','HD','FO')"""
+        sql = """SELECT c.corp_num, json_build_object(
+                    'corporation', json_build_object('corp_num', c.corp_num, 'corp_typ_cd', c.corp_typ_cd, 'recognition_dts', c.recognition_dts, 
+                                        'last_ar_filed_dt', c.last_ar_filed_dt, 'bn_9', c.bn_9, 'bn_15', c.bn_15, 'admin_email', c.admin_email, 
+                                        'last_ledger_dt', c.last_ledger_dt),
+                    'jurisdiction', (SELECT json_agg(json_build_object('corp_num', j.corp_num, 'start_event_id', j.start_event_id, 'end_event_id', j.end_event_id, 
+                                        'can_jur_typ_cd', j.can_jur_typ_cd, 'home_recogn_dt', j.home_recogn_dt, 'othr_juris_desc', j.othr_juris_desc, 
+                                        'home_juris_num', j.home_juris_num, 'home_company_nme', j.home_company_nme, 
+                                        'short_desc', jt.short_desc, 'full_desc', jt.full_desc))
+                                    FROM """ + p + """jurisdiction j, """ + p + """jurisdiction_type jt 
+                                    WHERE j.corp_num = c.corp_num AND j.can_jur_typ_cd = jt.can_jur_typ_cd),
+                    'corp_name', (SELECT json_agg(json_build_object('corp_num', n.corp_num, 'corp_name_typ_cd', n.corp_name_typ_cd, 
+                                        'start_event_id', n.start_event_id, 'end_event_id', n.end_event_id, 'corp_name_seq_num', n.corp_name_seq_num, 
+                                        'srch_nme', n.srch_nme, 'corp_nme', n.corp_nme, 'dd_corp_num', n.dd_corp_num))
+                                    FROM """ + p + """corp_name n WHERE n.corp_num = c.corp_num),
+                    'office', (SELECT json_agg(row_to_json(o)) 
+                                    FROM """ + p + """office o WHERE o.corp_num = c.corp_num and o.office_typ_cd in ('RG','HD','FO')),
+                    'address', (SELECT json_agg(json_build_object('addr_id', a.addr_id, 'province', a.province, 'country_typ_cd', a.country_typ_cd, 
+                                        'postal_cd', a.postal_cd, 'addr_line_1', a.addr_line_1, 'addr_line_2', a.addr_line_2, 'addr_line_3', a.addr_line_3, 
+                                        'city', a.city, 'address_format_type', a.address_format_type, 'address_desc', a.address_desc, 
+                                        'address_desc_short', a.address_desc_short, 'unit_no', a.unit_no, 'unit_type', a.unit_type, 
+                                        'province_state_name', a.province_state_name))
+                                    FROM """ + p + """address a WHERE a.addr_id in (""" + addr_ids_sql + """)),
+                    'corp_state', (SELECT json_agg(json_build_object('corp_num', state.corp_num, 'start_event_id', state.start_event_id, 
+                                        'end_event_id', state.end_event_id, 'state_typ_cd', state.state_typ_cd, 'dd_corp_num', state.dd_corp_num, 
+                                        'op_state_typ_cd', op_state.op_state_typ_cd, 'short_desc', op_state.short_desc, 'full_desc', op_state.full_desc))
+                                    FROM """ + p + """corp_state state, """ + p + """corp_op_state op_state
+                                    WHERE state.corp_num = c.corp_num and op_state.state_typ_cd = state.state_typ_cd),
+                    'event', (SELECT json_agg(json_build_object(
+                                        'event', json_build_object('event_id', e.event_id, 'corp_num', e.corp_num, 'event_typ_cd', e.event_typ_cd, 
+                                            'event_timestmp', e.event_timestmp, 'trigger_dts', e.trigger_dts, 'event_class', et.event_class, 
+                                            'short_desc', et.short_desc, 'full_desc', et.full_desc),
+                                        'filing', (SELECT json_agg(json_build_object('event_id', f.event_id, 'filing_typ_cd', f.filing_typ_cd, 
+                                                        'effective_dt', f.effective_dt, 'new_corp_num', f.new_corp_num, 'filing_typ_class', ft.filing_typ_class, 
+                                                        'short_desc', ft.short_desc, 'full_desc', ft.full_desc))
+                                                    FROM """ + p + """filing f, """ + p + """filing_type ft 
+                                                    WHERE f.event_id = e.event_id and f.filing_typ_cd = ft.filing_typ_cd),
+                                        'conv_event', (SELECT json_agg(row_to_json(ce)) FROM """ + p + """conv_event ce WHERE ce.event_id = e.event_id)))
+                                    FROM """ + p + """event e, """ + p + """event_type et
+                                    WHERE e.event_id in (""" + event_ids_sql + """) and e.event_typ_cd = et.event_typ_cd)
+                 )::text as corp_json
+                 FROM """ + p + """corporation c
+                 WHERE c.corp_num in ({})"""
+        # (the table columns used to convert each json element back to the types returned by a regular query)
+        doc_tables = {
+            'corporation': ['corporation'],
+            'jurisdiction': ['jurisdiction', 'jurisdiction_type'],
+            'corp_name': ['corp_name'],
+            'office': ['office'],
+            'address': ['address'],
+            'corp_state': ['corp_state', 'corp_op_state'],
+        }
+        specific_corps = list({s_corp for s_corp in specific_corps})
+        rows = self.get_id_list_rows(sql, specific_corps, force_query_remote=True)
+        for row in rows:
+            corp_doc = json.loads(row['corp_json'], parse_float=decimal.Decimal)
+            corp_data = {}
+            for key, tables in doc_tables.items():
+                recs = corp_doc[key] if isinstance(corp_doc[key], list) else ([corp_doc[key]] if corp_doc[key] is not None else [])
+                corp_data[key] = [self.from_json_row(rec, tables) for rec in recs]
+            corp_data['corporation'] = corp_data['corporation'][0]
+            corp_data['address'] = {address['addr_id']: address for address in corp_data['address']}
+            for ev_rec in (corp_doc['event'] or []):
+                event = self.from_json_row(ev_rec['event'], ['event', 'event_type'])
+                filings = [self.from_json_row(rec, ['filing', 'filing_type']) for rec in (ev_rec['filing'] or [])]
+                conv_events = [self.from_json_row(rec, ['conv_event']) for rec in (ev_rec['conv_event'] or [])]
+                event['filing'] = filings[0] if event['event_typ_cd'] == 'FILE' and 0 < len(filings) else {}
+                event['conv_event'] = conv_events[0] if event['event_typ_cd'].startswith('CONV') and 0 < len(conv_events) else {}
+                self.preloaded_events[event['event_id']] = event
+            self.preloaded_corps[row['corp_num']] = corp_data
+        LOGGER.info("Pre-loaded corps: " + str(len(rows)))
+
+    # rows for the given pre-loaded corp and table, or None if the corp was not pre-loaded
+    def get_preloaded_rows(self, corp_num, table):
+        if corp_num in self.preloaded_corps:
+            return copy.deepcopy(self.preloaded_corps[corp_num][table])
+        return None
+
+    # convert a row read as json back to the data types returned by a regular query
+    def from_json_row(self, rec, tables):
+        if self.json_column_types is None:
+            self.json_column_types = self.get_json_column_types()
+        for col, value in rec.items():
+            if value is None:
+                continue
+            data_type = None
+            for table in tables:
+                if col in self.json_column_types.get(table, {}):
+                    data_type = self.json_column_types[table][col]
+                    break
+            if data_type in JSON_TIMESTAMP_TYPES:
+                rec[col] = self.from_json_timestamp(value)
+            elif data_type in JSON_DATE_TYPES:
+                rec[col] = datetime.date.fromisoformat(value)
+            elif data_type in JSON_NUMERIC_TYPES:
+                rec[col] = decimal.Decimal(value)
+            elif data_type in JSON_FLOAT_TYPES:
+                rec[col] = float(value)
+        return rec
+
+    # postgres json timestamps are iso format, with the fractional seconds trimmed (e.g. 2004-03-26T12:30:00.5)
+    def from_json_timestamp(self, value):
+        ts_format = '%Y-%m-%dT%H:%M:%S'
+        tz_idx = max(value.rfind('+'), value.rfind('-', 19))
+        if 19 <= tz_idx:
+            ts_value, tz_value = value[:tz_idx], value[tz_idx:]
+            if len(tz_value) == 3:
+                tz_value = tz_value + ':00'
+            ts_format = ts_format + '%z'
+        else:
+            ts_value, tz_value = value, ''
+        if 0 <= ts_value.find('.'):
+            (ts_value, fraction) = ts_value.split('.')
+            ts_value = ts_value + '.' + fraction.ljust(6, '0')
+            ts_format = ts_format.replace('%S', '%S.%f')
+        return datetime.datetime.strptime(ts_value + tz_value, ts_format)
+
+    # column data types of the bc registries tables, as {table: {column: data_type}}
+    def get_json_column_types(self):
+        schema = self.DB_TABLE_PREFIX.rstrip('.') if self.DB_TABLE_PREFIX else 'public'
+        sql = """SELECT table_name, column_name, data_type FROM information_schema.columns WHERE table_schema = %s"""
         cursor = None
         try:
-            cursor = self.get_db_connection(force_query_remote).cursor()
-            cursor.execute(sql, (event_id,))
-            desc = cursor.description
-            column_names = [col[0] for col in desc]
-            event = [dict(zip(column_names, row))  
-                for row in cursor]
+            column_types = {}
+            cursor = self.conn.cursor()
+            cursor.execute(sql, (schema,))
+            for row in cursor:
+                column_types.setdefault(row[0], {})[row[1]] = row[2]
             cursor.close()
             cursor = None
-            if len(event) > 0:
-                ret_event = event[0]
-            else:
-                # check for a cache miss
-                if self.use_local_cache() and (not force_query_remote):
-                    event = self.get_event(corp_num, event_id, corp_type_cd=corp_type_cd, force_query_remote=True)
-                    self.add_cache_miss('event', corp_num, event_id, event)
-                    ret_event = event
-            if ret_event is None:
-                return {}
-
-            # don't use data conversion date as a timestamp
-            #if is_data_conversion_event(ret_event):
-            #    ret_event['event_timestmp'] = ''
-
-            # fill in filing and conv_event
-            if 'filing' not in ret_event:
-                ret_event['filing'] = self.get_filing_event(corp_num, event_id, ret_event['event_typ_cd'], force_query_remote)
-            if 'conv_event' not in ret_event:
-                ret_event['conv_event'] = self.get_conv_event(corp_num, event_id, ret_event['event_typ_cd'], force_query_remote)
-            ret_event['effective_date'] = self.get_event_filing_effective_date(ret_event, corp_type_cd)
-            return ret_event
+            return column_types
         except (Exception, psycopg2.DatabaseError) as error:
             LOGGER.error(error)
             LOGGER.error(traceback.print_exc())
@@ -630,30 +786,23 @@ class BCRegistries(BCReg_Core):
             if cursor is not None:
                 cursor.close()
 
-    def get_conv_event(self, corp_num, event_id, event_type, force_query_remote=False):
-        if not event_type.startswith('CONV'):
-            return {}
-        sql_conv = """SELECT * from """ + self.get_table_prefix(force_query_remote) + """conv_event 
-                        WHERE event_id = """ + self.get_db_sql_param(force_query_remote)
+    # run a query with a "where in" list of ids, splitting into chunks of MAX_WHERE_IN
+    # the sql must contain a single "{}" placeholder for the list of ids
+    def get_id_list_rows(self, sql, ids, force_query_remote=False):
+        rows = []
         cursor = None
         try:
-            cursor = self.get_db_connection(force_query_remote).cursor()
-            cursor.execute(sql_conv, (event_id,))
-            desc = cursor.description
-            column_names = [col[0] for col in desc]
-            conv_event = [dict(zip(column_names, row))  
-                for row in cursor]
-            cursor.close()
-            cursor = None
-            if len(conv_event) > 0:
-                return conv_event[0]
-            # don't check for a cache miss - assume conv_event are all there (most CONV data in dev is missing)
-            #if self.use_local_cache() and (not force_query_remote):
-            #   LOGGER.error('Cache miss for conv_event ', event_type)
-            #    conv_event = self.get_conv_event(corp_num, event_id, event_type, True)
-            #    self.add_cache_miss('conv_event', corp_num, event_id, conv_event)
-            #    return conv_event
-            return {}
+            for ids_list in self.split_list(ids, MAX_WHERE_IN):
+                placeholders = ', '.join([self.get_db_sql_param(force_query_remote)]*len(ids_list))
+                cursor = self.get_db_connection(force_query_remote).cursor()
+                cursor.execute(sql.format(placeholders), tuple(ids_list))
+                desc = cursor.description
+                column_names = [col[0] for col in desc]
+                rows.extend([dict(zip(column_names, row))  
+                    for row in cursor])
+                cursor.close()
+                cursor = None
+            return rows
         except (Exception, psycopg2.DatabaseError) as error:
             LOGGER.error(error)
             LOGGER.error(traceback.print_exc())
@@ -663,38 +812,99 @@ class BCRegistries(BCReg_Core):
             if cursor is not None:
                 cursor.close()
 
-    def get_filing_event(self, corp_num, event_id, event_type, force_query_remote=False):
-        if event_type != 'FILE':
-            return {}
+    # find a set of events and fill in the filing and conv_event (effective date is not set)
+    # returns a dict of {event_id: event}, events that are not found are not included
+    def get_raw_events(self, corp_num, event_ids, force_query_remote=False):
+        sql = """SELECT event_id, corp_num, event.event_typ_cd, event_timestmp, trigger_dts, event_class, short_desc, full_desc
+                    FROM """ + self.get_table_prefix(force_query_remote) + """event event, """ + self.get_table_prefix(force_query_remote) + """event_type event_type
+                    WHERE event_id in ({}) and event.event_typ_cd = event_type.event_typ_cd"""
+        ret_events = {}
+        query_ids = []
+        for event_id in {event_id for event_id in event_ids if event_id is not None}:
+            if event_id in self.preloaded_events:
+                ret_events[event_id] = self.preloaded_events[event_id]
+            else:
+                query_ids.append(event_id)
+        if 0 == len(query_ids):
+            return ret_events
+
+        events = {}
+        for event in self.get_id_list_rows(sql, query_ids, force_query_remote):
+            if event['event_id'] not in events:
+                events[event['event_id']] = event
+
+        # check for cache misses
+        if self.use_local_cache() and (not force_query_remote):
+            missed_ids = [event_id for event_id in query_ids if event_id not in events]
+            if 0 < len(missed_ids):
+                missed_events = self.get_raw_events(corp_num, missed_ids, force_query_remote=True)
+                for event_id in missed_ids:
+                    missed_event = missed_events.get(event_id, {})
+                    self.add_cache_miss('event', corp_num, event_id, missed_event)
+                    if event_id in missed_events:
+                        ret_events[event_id] = missed_event
+
+        # fill in filing and conv_event
+        filing_ids = [event_id for event_id, event in events.items() if event['event_typ_cd'] == 'FILE']
+        conv_ids = [event_id for event_id, event in events.items() if event['event_typ_cd'].startswith('CONV')]
+        filings = self.get_filings(filing_ids, force_query_remote)
+        # check for cache misses
+        if self.use_local_cache() and (not force_query_remote):
+            missed_ids = [event_id for event_id in filing_ids if event_id not in filings]
+            if 0 < len(missed_ids):
+                filings.update(self.get_filings(missed_ids, force_query_remote=True))
+                for event_id in missed_ids:
+                    self.add_cache_miss('filing', corp_num, event_id, filings.get(event_id, {}))
+        # don't check for a cache miss - assume conv_event are all there (most CONV data in dev is missing)
+        conv_events = self.get_conv_events(conv_ids, force_query_remote)
+
+        for event_id, event in events.items():
+            # don't use data conversion date as a timestamp
+            #if is_data_conversion_event(event):
+            #    event['event_timestmp'] = ''
+            event['filing'] = filings.get(event_id, {})
+            event['conv_event'] = conv_events.get(event_id, {})
+            ret_events[event_id] = event
+
+        return ret_events
+
+    # returns a dict of {event_id: filing} for the given (FILE) events
+    def get_filings(self, event_ids, force_query_remote=False):
         sql_filing = """SELECT event_id, filing.filing_typ_cd, effective_dt, new_corp_num, filing_typ_class, short_desc, full_desc 
                         from """ + self.get_table_prefix(force_query_remote) + """filing filing, """ + self.get_table_prefix(force_query_remote) + """filing_type filing_type 
-                        WHERE event_id = """ + self.get_db_sql_param(force_query_remote) + """ and filing.filing_typ_cd = filing_type.filing_typ_cd """
-        cursor = None
-        try:
-            cursor = self.get_db_connection(force_query_remote).cursor()
-            cursor.execute(sql_filing, (event_id,))
-            desc = cursor.description
-            column_names = [col[0] for col in desc]
-            filing_event = [dict(zip(column_names, row))  
-                for row in cursor]
-            cursor.close()
-            cursor = None
-            if len(filing_event) > 0:
-                return filing_event[0]
-            # check for a cache miss
-            if self.use_local_cache() and (not force_query_remote):
-                filing_event = self.get_filing_event(corp_num, event_id, event_type, True)
-                self.add_cache_miss('filing', corp_num, event_id, filing_event)
-                return filing_event
+                        WHERE event_id in ({}) and filing.filing_typ_cd = filing_type.filing_typ_cd """
+        filings = {}
+        if 0 < len(event_ids):
+            for filing in self.get_id_list_rows(sql_filing, event_ids, force_query_remote):
+                if filing['event_id'] not in filings:
+                    filings[filing['event_id']] = filing
+        return filings
+
+    # returns a dict of {event_id: conv_event} for the given (CONV*) events
+    def get_conv_events(self, event_ids, force_query_remote=False):
+        sql_conv = """SELECT * from """ + self.get_table_prefix(force_query_remote) + """conv_event 
+                        WHERE event_id in ({})"""
+        conv_events = {}
+        if 0 < len(event_ids):
+            for conv_event in self.get_id_list_rows(sql_conv, event_ids, force_query_remote):
+                if conv_event['event_id'] not in conv_events:
+                    conv_events[conv_event['event_id']] = conv_event
+        return conv_events
+
+    def get_conv_event(self, corp_num, event_id, event_type, force_query_remote=False):
+        if not event_type.startswith('CONV'):
             return {}
-        except (Exception, psycopg2.DatabaseError) as error:
-            LOGGER.error(error)
-            LOGGER.error(traceback.print_exc())
-            log_error("BCRegistries exception reading DB: " + str(error))
-            raise 
-        finally:
-            if cursor is not None:
-                cursor.close()
+        return self.get_conv_events([event_id], force_query_remote).get(event_id, {})
+
+    def get_filing_event(self, corp_num, event_id, event_type, force_query_remote=False):
+        if event_type != 'FILE':
+            return {}
+        filing_event = self.get_filings([event_id], force_query_remote).get(event_id, {})
+        # check for a cache miss
+        if 0 == len(filing_event) and self.use_local_cache() and (not force_query_remote):
+            filing_event = self.get_filing_event(corp_num, event_id, event_type, True)
+            self.add_cache_miss('filing', corp_num, event_id, filing_event)
+        return filing_event
 
     def check_same_start_date(self, corp_num, record_type, records, date_key):
         sorted_records = sorted(records, key=lambda k: k[date_key])
@@ -732,24 +942,27 @@ class BCRegistries(BCReg_Core):
                         WHERE corp_num = """ + self.get_db_sql_param() + """ and office_typ_cd in ('RG','HD','FO')"""
         cursor = None
         try:
-            cursor = self.get_db_connection().cursor()
-            cursor.execute(sql_office, (corp_num,))
-            desc = cursor.description
-            column_names = [col[0] for col in desc]
-            offices = [dict(zip(column_names, row))  
-                for row in cursor]
-            cursor.close()
-            cursor = None
+            offices = self.get_preloaded_rows(corp_num, 'office')
+            if offices is None:
+                cursor = self.get_db_connection().cursor()
+                cursor.execute(sql_office, (corp_num,))
+                desc = cursor.description
+                column_names = [col[0] for col in desc]
+                offices = [dict(zip(column_names, row))  
+                    for row in cursor]
+                cursor.close()
+                cursor = None
 
+            events = self.get_events(corp_num, [office['start_event_id'] for office in offices] + [office['end_event_id'] for office in offices])
             for office in offices:
                 office['office_type'] = self.get_office_type(office['office_typ_cd'])
                 office['delivery_addr'] = self.get_address(corp_num, office['delivery_addr_id'])
                 if 'mailing_addr_id' in office and office['mailing_addr_id'] != office['delivery_addr_id']:
                     office['mailing_addr'] = self.get_address(corp_num, office['mailing_addr_id'])
-                office['start_event'] = self.get_event(corp_num, office['start_event_id'])
+                office['start_event'] = self.copy_event(events, office['start_event_id'])
                 office['effective_start_date'] = office['start_event']['effective_date']
                 if office['end_event_id'] is not None:
-                    office['end_event'] = self.get_event(corp_num, office['end_event_id'])
+                    office['end_event'] = self.copy_event(events, office['end_event_id'])
                     office['effective_end_date'] = office['end_event']['effective_date']
                 else:
                     office['effective_end_date'] = MAX_END_DATE
@@ -778,14 +991,18 @@ class BCRegistries(BCReg_Core):
                   WHERE addr_id = """ + self.get_db_sql_param(force_query_remote)
         cursor = None
         try:
-            cursor = self.get_db_connection(force_query_remote).cursor()
-            cursor.execute(sql_addr, (address_id,))
-            desc = cursor.description
-            column_names = [col[0] for col in desc]
-            addresses = [dict(zip(column_names, row))  
-                for row in cursor]
-            cursor.close()
-            cursor = None
+            preloaded = self.get_preloaded_rows(corp_num, 'address')
+            if preloaded is not None:
+                addresses = [preloaded[address_id]] if address_id in preloaded else []
+            else:
+                cursor = self.get_db_connection(force_query_remote).cursor()
+                cursor.execute(sql_addr, (address_id,))
+                desc = cursor.description
+                column_names = [col[0] for col in desc]
+                addresses = [dict(zip(column_names, row))  
+                    for row in cursor]
+                cursor.close()
+                cursor = None
             if len(addresses) >  0:
                 address = addresses[0]
                 if 'addr_line_1' in address and address['addr_line_1'] is not None:
@@ -802,7 +1019,7 @@ class BCRegistries(BCReg_Core):
                     address['local_addr'] = ""
                 return address
             # check for a cache miss
-            if self.use_local_cache() and (not force_query_remote):
+            if self.use_local_cache() and (not force_query_remote) and preloaded is None:
                 address = self.get_address(corp_num, address_id, True)
                 self.add_cache_miss('address', corp_num, address_id, address)
                 return address
@@ -824,21 +1041,29 @@ class BCRegistries(BCReg_Core):
         cur = None
         try:
             names = []
-            cur = self.get_db_connection().cursor()
-            placeholders= ', '.join([self.get_db_sql_param()]*len(name_typ_cds))  # "%s, %s, %s, ... %s"
-            sql_name = sql_name.format(placeholders)
-            cur.execute(sql_name, (corp_num,) + tuple(name_typ_cds))
-            row = cur.fetchone()
-            while row is not None:
+            preloaded = self.get_preloaded_rows(corp_num, 'corp_name')
+            if preloaded is not None:
+                rows = [tuple(name.values()) for name in preloaded if name['corp_name_typ_cd'] in name_typ_cds]
+            else:
+                cur = self.get_db_connection().cursor()
+                placeholders= ', '.join([self.get_db_sql_param()]*len(name_typ_cds))  # "%s, %s, %s, ... %s"
+                sql_name = sql_name.format(placeholders)
+                cur.execute(sql_name, (corp_num,) + tuple(name_typ_cds))
+                rows = cur.fetchall()
+                cur.close()
+                cur = None
+
+            events = self.get_events(corp_num, [row[2] for row in rows] + [row[3] for row in rows])
+            for row in rows:
                 corp_name = {}
                 corp_name['corp_num'] = row[0]
                 corp_name['corp_name_typ_cd'] = row[1]
                 corp_name['start_event_id'] = row[2]
-                corp_name['start_event'] = self.get_event(row[0], row[2])
+                corp_name['start_event'] = self.copy_event(events, row[2])
                 corp_name['effective_start_date'] = corp_name['start_event']['effective_date']
                 corp_name['end_event_id'] = row[3]
                 if corp_name['end_event_id'] is not None:
-                    corp_name['end_event'] = self.get_event(corp_num, corp_name['end_event_id'])
+                    corp_name['end_event'] = self.copy_event(events, corp_name['end_event_id'])
                     corp_name['effective_end_date'] = corp_name['end_event']['effective_date']
                 else:
                     corp_name['effective_end_date'] = MAX_END_DATE
@@ -854,10 +1079,6 @@ class BCRegistries(BCReg_Core):
                         corp_name['effective_start_date'] = registration_date
 
                 names.append(corp_name)
-                row = cur.fetchone()
-
-            cur.close()
-            cur = None
 
             if len(names) == 1 and registration_date is not None and (names[0]['effective_start_date'] is None or names[0]['effective_start_date'] == '' or is_data_conversion_event(corp_name['start_event'])):
                 names[0]['start_event']['effective_date'] = registration_date
@@ -884,6 +1105,9 @@ class BCRegistries(BCReg_Core):
                         WHERE corp_num = """ + self.get_db_sql_param() + """ and op_state.state_typ_cd = state.state_typ_cd"""
         cursor = None
         try:
+            corp_states = self.get_preloaded_rows(corp_num, 'corp_state')
+            if corp_states is not None:
+                return corp_states
             cursor = self.get_db_connection().cursor()
             cursor.execute(sql_state, (corp_num,))
             desc = cursor.description
@@ -910,20 +1134,23 @@ class BCRegistries(BCReg_Core):
                         WHERE j.corp_num = """ + self.get_db_sql_param() + """ AND j.can_jur_typ_cd = jt.can_jur_typ_cd"""
         cursor = None
         try:
-            cursor = self.get_db_connection().cursor()
-            cursor.execute(sql_juris, (corp_num,))
-            desc = cursor.description
-            column_names = [col[0] for col in desc]
-            jurisdictions = [dict(zip(column_names, row))  
-                for row in cursor]
-            cursor.close()
-            cursor = None
+            jurisdictions = self.get_preloaded_rows(corp_num, 'jurisdiction')
+            if jurisdictions is None:
+                cursor = self.get_db_connection().cursor()
+                cursor.execute(sql_juris, (corp_num,))
+                desc = cursor.description
+                column_names = [col[0] for col in desc]
+                jurisdictions = [dict(zip(column_names, row))  
+                    for row in cursor]
+                cursor.close()
+                cursor = None
             if len(jurisdictions) > 0:
+                events = self.get_events(corp_num, [jurisdiction['start_event_id'] for jurisdiction in jurisdictions] + [jurisdiction['end_event_id'] for jurisdiction in jurisdictions])
                 for jurisdiction in jurisdictions:
-                    jurisdiction['start_event'] = self.get_event(corp_num, jurisdiction['start_event_id'])
+                    jurisdiction['start_event'] = self.copy_event(events, jurisdiction['start_event_id'])
                     jurisdiction['effective_start_date'] = jurisdiction['start_event']['effective_date']
                     if jurisdiction['end_event_id'] is not None:
-                        jurisdiction['end_event'] = self.get_event(corp_num, jurisdiction['end_event_id'])
+                        jurisdiction['end_event'] = self.copy_event(events, jurisdiction['end_event_id'])
                         jurisdiction['effective_end_date'] = jurisdiction['end_event']['effective_date']
                     else:
                         jurisdiction['effective_end_date'] = MAX_END_DATE
@@ -946,6 +1173,8 @@ class BCRegistries(BCReg_Core):
                 cursor.close()
 
     def get_office_type(self, office_typ_cd):
+        if self.use_code_table_cache('office_type'):
+            return self.get_code_table_row('office_type', 'office_typ_cd', office_typ_cd, ['office_typ_cd', 'short_desc', 'full_desc'])
         sql_type = """SELECT office_typ_cd, short_desc, full_desc
                         FROM """ + self.get_table_prefix() + """office_type
                         WHERE office_typ_cd = """ + self.get_db_sql_param()
@@ -972,6 +1201,8 @@ class BCRegistries(BCReg_Core):
                 cursor.close()
 
     def get_corp_type(self, corp_typ_cd):
+        if self.use_code_table_cache('corp_type'):
+            return self.get_code_table_row('corp_type', 'corp_typ_cd', corp_typ_cd, ['corp_typ_cd', 'colin_ind', 'corp_class', 'short_desc', 'full_desc'])
         sql_type = """SELECT corp_typ_cd, colin_ind, corp_class, short_desc, full_desc
                         FROM """ + self.get_table_prefix() + """corp_type
                         WHERE corp_typ_cd = """ + self.get_db_sql_param()
@@ -1094,9 +1325,15 @@ class BCRegistries(BCReg_Core):
             corp = {}
 
             # assume there is just one corp record
-            cur = self.get_db_connection().cursor()
-            cur.execute(sql_corp, (corp_num,))
-            row = cur.fetchone()
+            preloaded = self.get_preloaded_rows(corp_num, 'corporation')
+            if preloaded is not None:
+                row = tuple(preloaded.values())
+            else:
+                cur = self.get_db_connection().cursor()
+                cur.execute(sql_corp, (corp_num,))
+                row = cur.fetchone()
+                cur.close()
+                cur = None
             if row is None:
                 LOGGER.debug("No corp rec found for " + str(corp_num))
                 corp['corp_num'] = ''
@@ -1115,8 +1352,6 @@ class BCRegistries(BCReg_Core):
                 corp['bn_15'] = row[5]
                 corp['admin_email'] = row[6]
                 corp['last_ledger_dt'] = row[7]
-                cur.close()
-                cur = None
          
                 if deep_copy and corp['corp_typ_cd'] in CORP_TYPES_IN_SCOPE:
                     # get corp names
@@ -1137,11 +1372,12 @@ class BCRegistries(BCReg_Core):
 
                     # get corp state (active, historical), and get the start/end date of each state change
                     corp_states = self.get_corp_states(corp_num)
+                    events = self.get_events(corp['corp_num'], [corp_state['start_event_id'] for corp_state in corp_states] + [corp_state['end_event_id'] for corp_state in corp_states], corp_type_cd=corp['corp_typ_cd'])
                     for corp_state in corp_states:
-                        corp_state['start_event'] = self.get_event(corp['corp_num'], corp_state['start_event_id'], corp_type_cd=corp['corp_typ_cd'])
+                        corp_state['start_event'] = self.copy_event(events, corp_state['start_event_id'])
                         corp_state['event_date'] = corp_state['start_event']['effective_date']
                         if corp_state['end_event_id'] is not None:
-                            corp_state['end_event'] = self.get_event(corp['corp_num'], corp_state['end_event_id'], corp_type_cd=corp['corp_typ_cd'])
+                            corp_state['end_event'] = self.copy_event(events, corp_state['end_event_id'])
                             corp_state['effective_end_date'] = corp_state['end_event']['effective_date']
                         else:
                             corp_state['effective_end_date'] = MAX_END_DATE
@@ -28,11 +28,14 @@ import aiohttp
 import time
 import traceback
 import logging
+import queue
+import threading
 import backoff
 
 from bcreg.config import config
 from bcreg.bcregistries import system_type
 from bcreg.bcreg_lear import lear_system_type
+from bcreg.eventprocessor import update_process_status, StageTimings
 from bcreg.rocketchat_hooks import log_error, log_warning, log_info
 
 
@@ -50,9 +53,14 @@ MAX_CREDS_REQUESTS = int(os.getenv('MAX_CREDS_REQUESTS', '32'))
 MAX_PROCESSING_MINS = int(os.getenv('MAX_PROCESSING_MINS', '10'))
 # how often to report status (# credentials)
 PROCESS_LOOP_REPORT_CT = int(os.getenv('PROCESS_LOOP_REPORT_CT', '100'))
+# max number of credential statuses saved in one statement (statuses are saved in the background)
+CREDS_STATUS_WRITE_SIZE = int(os.getenv('CREDS_STATUS_WRITE_SIZE', '500'))
 
 # seconds to wait for a credential response (prevents blocking forever)
 MAX_CRED_POSTING_TIMEOUT = int(os.getenv('MAX_CRED_POSTING_TIMEOUT', '240'))
+# seconds to wait to connect to the controller, and to keep an idle connection to the controller open
+CREDS_HTTP_CONNECT_TIMEOUT = int(os.getenv('CREDS_HTTP_CONNECT_TIMEOUT', '30'))
+CREDS_HTTP_KEEPALIVE_TIMEOUT = int(os.getenv('CREDS_HTTP_KEEPALIVE_TIMEOUT', '60'))
 
 # url for controller health check (returns 200 status if ok)
 CONTROLLER_HEALTH_URL = os.environ.get('CONTROLLER_HEALTH_URL', CONTROLLER_URL + '/readiness')
@@ -78,37 +86,64 @@ FAILURE_REDUCTION_FACTOR = int(os.getenv('FAILURE_REDUCTION_FACTOR', '70'))
 # number of loops with no errors to allow increasing threads back up to initial setting
 SUCCESS_INCREASE_FACTOR = int(os.getenv('SUCCESS_INCREASE_FACTOR', '10'))
 
+# controller used to limit the number of concurrent posts (see CONCURRENCY_CONTROLLERS):
+#   'errors' - reduce on bursts of errors, increase after a run of successful posts (the original throttling)
+#   'aimd' - additive increase, multiplicative decrease on errors or when the post latency grows
+#   'gradient' - scale the limit by the ratio of the baseline to the current post latency
+CREDS_CONCURRENCY_CONTROLLER = os.getenv('CREDS_CONCURRENCY_CONTROLLER', 'errors').lower()
+# post latency (relative to the lowest latency seen) at which the latency-based controllers back off
+CREDS_LATENCY_TOLERANCE = float(os.getenv('CREDS_LATENCY_TOLERANCE', '2.0'))
+# initial limit for the latency-based controllers (they start low, so the baseline latency is measured before the controller is busy)
+CREDS_CONCURRENCY_INITIAL = int(os.getenv('CREDS_CONCURRENCY_INITIAL', str(max(1, MAX_CREDS_REQUESTS // 4))))
+
 LOGGER = logging.getLogger(__name__)
 
 
-async def check_controller_health(wait=False) -> bool:
+def create_http_client():
+    """
+    Create the http session used to post credentials to the controller (must be called from a running event loop).
+    Connections to the controller are kept alive and re-used, up to one per concurrent request (MAX_CREDS_REQUESTS).
+    """
+    connector = aiohttp.TCPConnector(limit=MAX_CREDS_REQUESTS, limit_per_host=MAX_CREDS_REQUESTS, 
+                                     keepalive_timeout=CREDS_HTTP_KEEPALIVE_TIMEOUT)
+    timeout = aiohttp.ClientTimeout(total=MAX_CRED_POSTING_TIMEOUT, connect=CREDS_HTTP_CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def check_controller_health(wait=False, http_client=None) -> bool:
     """
     Ping the controller's health url to make sure the controller is running and 
     able to receive requests.
     If "wait" is True, wait for up to CONTROLLER_HEALTH_TIMEOUT seconds.
+    Uses the provided http session if any (otherwise a session is opened for the check).
     """
-    start_time = time.perf_counter()
-    async with aiohttp.ClientSession() as local_http_client:
-        while True:
-            try:
-                response = await asyncio.wait_for(local_http_client.get(
-                    '{}'.format(CONTROLLER_HEALTH_URL)
-                ), timeout=CONTROLLER_HEALTH_WAIT)
-                if response.status == 200:
-                    return True
-                if not wait:
-                    return False
-            except Exception as exc:
-                if not wait:
-                    return False
+    if http_client is None:
+        async with aiohttp.ClientSession() as local_http_client:
+            return await check_controller_health(wait=wait, http_client=local_http_client)
 
-            processing_time = time.perf_counter() - start_time
-            if processing_time < CONTROLLER_HEALTH_TIMEOUT:
-                print(" ... waiting for Issuer Controller ...")
-                await asyncio.sleep(CONTROLLER_HEALTH_WAIT)
-            else:
+    start_time = time.perf_counter()
+    while True:
+        try:
+            response = await asyncio.wait_for(http_client.get(
+                '{}'.format(CONTROLLER_HEALTH_URL)
+            ), timeout=CONTROLLER_HEALTH_WAIT)
+            # release the connection back to the pool
+            response.release()
+            if response.status == 200:
+                return True
+            if not wait:
+                return False
+        except Exception as exc:
+            if not wait:
                 return False
 
+        processing_time = time.perf_counter() - start_time
+        if processing_time < CONTROLLER_HEALTH_TIMEOUT:
+            print(" ... waiting for Issuer Controller ...")
+            await asyncio.sleep(CONTROLLER_HEALTH_WAIT)
+        else:
+            return False
+
 
 def notify_error(message):
     # Use NOTIFY_OF_CREDENTIAL_POSTING_ERRORS to turn error notification on(true)/off(false); off by default.
@@ -124,13 +159,13 @@ def notify_error(message):
                         aiohttp.ClientError,
                       ),
                       max_tries=5)
-async def submit_cred_batch(creds):
+async def submit_cred_batch(creds, http_client):
+    # (retries re-use the same session)
     try:
-        async with aiohttp.ClientSession() as local_http_client:
-            response = await local_http_client.post(
-                '{}/issue-credential'.format(CONTROLLER_URL),
-                json=creds
-            )
+        async with http_client.post(
+            '{}/issue-credential'.format(CONTROLLER_URL),
+            json=creds
+        ) as response:
             if response.status != 200:
                 raise RuntimeError(
                     'Credentials could not be processed: {}'.format(await response.text())
@@ -147,13 +182,13 @@ async def submit_cred_batch(creds):
                         aiohttp.ClientError,
                       ),
                       max_tries=5)
-async def submit_cred_batch_v20(creds):
+async def submit_cred_batch_v20(creds, http_client):
+    # (retries re-use the same session)
     try:
-        async with aiohttp.ClientSession() as local_http_client:
-            response = await local_http_client.post(
-                '{}/issue-credential-v20'.format(CONTROLLER_URL),
-                json=creds
-            )
+        async with http_client.post(
+            '{}/issue-credential-v20'.format(CONTROLLER_URL),
+            json=creds
+        ) as response:
             if response.status != 200:
                 raise RuntimeError(
                     'Credentials could not be processed: {}'.format(await response.text())
@@ -170,15 +205,243 @@ def inject_reason(attributes, reason):
   attributes['reason_description'] = reason
   return attributes
 
-async def post_credentials(conn, credentials):
-    sql2 = """UPDATE CREDENTIAL_LOG
-              SET PROCESS_DATE = %s, PROCESS_SUCCESS = 'Y', PROCESS_MSG = %s
-              WHERE RECORD_ID = %s"""
+# truncate an error message to fit the credential status
+def status_message(message, default):
+    res = str(message)
+    if 0 == len(res):
+        res = default
+    elif 255 < len(res):
+        res = res[:250] + '...'
+    return res
 
-    sql3 = """UPDATE CREDENTIAL_LOG
-              SET PROCESS_DATE = %s, PROCESS_SUCCESS = 'N', PROCESS_MSG = %s
-              WHERE RECORD_ID = %s"""
 
+class CredentialStatusWriter:
+    """
+    Applies credential posting outcomes to CREDENTIAL_LOG from a background thread, over its own connection,
+    so posting (on the event loop) never waits for the database.
+    Outcomes queued while the thread is writing are applied together (up to CREDS_STATUS_WRITE_SIZE at a time).
+    """
+    def __init__(self):
+        params = config(section='event_processor')
+        self.conn = psycopg2.connect(**params)
+        self.outcomes = queue.Queue()
+        # number of outcomes we couldn't save
+        self.failed = 0
+        self.thread = threading.Thread(target=self.run, name='credential-status-writer', daemon=True)
+        self.thread.start()
+
+    # queue a list of (process date, success flag, process message, record id) outcomes to be saved
+    def write(self, outcomes):
+        if 0 < len(outcomes):
+            self.outcomes.put(outcomes)
+
+    def run(self):
+        done = False
+        while not done:
+            outcomes = self.outcomes.get()
+            if outcomes is None:
+                break
+            while len(outcomes) < CREDS_STATUS_WRITE_SIZE:
+                try:
+                    more_outcomes = self.outcomes.get_nowait()
+                except queue.Empty:
+                    break
+                if more_outcomes is None:
+                    done = True
+                    break
+                outcomes = outcomes + more_outcomes
+            try:
+                self.write_outcomes(outcomes)
+            except (Exception) as error:
+                # keep going, so the rest of the statuses can be saved
+                # (outcomes that couldn't be saved are counted by write_outcomes)
+                print(error)
+                print(traceback.format_exc())
+
+    def write_outcomes(self, outcomes):
+        cur = None
+        try:
+            cur = self.conn.cursor()
+            update_process_status(cur, 'CREDENTIAL_LOG', outcomes)
+            self.conn.commit()
+            cur.close()
+            cur = None
+        except (Exception, psycopg2.DatabaseError) as error:
+            # failed saving status to database :-( is the database available?
+            print(error)
+            print(traceback.format_exc())
+            print("log exception to database", str(error))
+            res = status_message(error, "Unspecified error storing credential status")
+            if cur is not None:
+                cur.close()
+                cur = None
+            try:
+                self.conn.rollback()
+                cur = self.conn.cursor()
+                update_process_status(cur, 'CREDENTIAL_LOG', [(datetime.datetime.now(), 'N', res, outcome[3],) for outcome in outcomes])
+                self.conn.commit()
+            except (Exception, psycopg2.DatabaseError) as error:
+                print(error)
+                print(traceback.format_exc())
+                # the statuses couldn't be saved at all
+                self.failed = self.failed + len(outcomes)
+                log_error('An exception was encountered while storing credential status:\n{}'.format(str(error)))
+                try:
+                    self.conn.rollback()
+                except (Exception, psycopg2.DatabaseError) as error:
+                    print(error)
+                    print(traceback.format_exc())
+            notify_error('An exception was encountered while posting credentials:\n{}'.format(res))
+        finally:
+            if cur is not None:
+                cur.close()
+
+    # save any outstanding outcomes and stop the thread (blocks until the outcomes are saved)
+    def close(self):
+        self.outcomes.put(None)
+        self.thread.join()
+        self.conn.close()
+
+
+class ErrorCountController:
+    """
+    Limits concurrent posts based on errors only: the limit is reduced by FAILURE_REDUCTION_FACTOR when the
+    progressive error count passes PROGRESSIVE_FAIL_THRESHOLD, and increased again after SUCCESS_INCREASE_FACTOR
+    posts are submitted without errors.
+    """
+    name = 'errors'
+
+    def __init__(self, max_limit=MAX_CREDS_REQUESTS):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.progressive_error_factor = 0
+        self.success_seq = 0
+        self.increases = 0
+        self.decreases = 0
+        self.last_decision = None
+        self.latency_count = 0
+        self.latency_total = 0.0
+
+    def set_limit(self, limit, decision):
+        if limit > self.limit:
+            self.increases = self.increases + 1
+        elif limit < self.limit:
+            self.decreases = self.decreases + 1
+        self.limit = limit
+        self.last_decision = decision
+        print(">>> " + decision + ", concurrent threads:", self.limit)
+
+    # record the outcome of a completed post
+    def record(self, success, failed, latency):
+        self.progressive_error_factor = max(0, self.progressive_error_factor + (failed * PROGRESSIVE_FAIL_FACTOR) - success)
+        self.latency_count = self.latency_count + 1
+        self.latency_total = self.latency_total + latency
+
+    # called before each post is submitted, returns the current limit
+    def update(self):
+        # If we start getting too many errors, drop down our concurrent request count.
+        # This will introduce a delay in posting any new credentials, because we need
+        # to wait for many of the active threads to complete.
+        if self.limit > 1 and self.progressive_error_factor > PROGRESSIVE_FAIL_THRESHOLD:
+            self.progressive_error_factor = 0
+            self.success_seq = 0
+            self.set_limit(int(0.5 + self.limit * FAILURE_REDUCTION_FACTOR / 100), "Too many errors, reducing")
+        elif self.progressive_error_factor == 0:
+            # if we have a long run of successful posts then bump our throughput back up
+            self.success_seq = self.success_seq + 1
+            if self.success_seq > SUCCESS_INCREASE_FACTOR and self.limit < self.max_limit:
+                self.success_seq = 0
+                self.set_limit(min(self.max_limit, int(0.5 + 1.6 * self.limit)), "Stable success, increasing")
+        else:
+            self.success_seq = 0
+        return self.limit
+
+    def metrics(self):
+        return {'controller': self.name, 
+                'limit': self.limit, 
+                'increases': self.increases, 
+                'decreases': self.decreases, 
+                'last_decision': self.last_decision, 
+                'mean_latency': round(self.latency_total / self.latency_count, 3) if 0 < self.latency_count else None}
+
+
+class AIMDController(ErrorCountController):
+    """
+    Additive increase / multiplicative decrease: the limit grows by about one per round trip while posts succeed
+    with a latency within CREDS_LATENCY_TOLERANCE of the baseline (the lowest latency seen), and is cut by
+    FAILURE_REDUCTION_FACTOR on an error or when the smoothed latency grows past the tolerance (i.e. the controller
+    is queueing our requests). The limit is cut at most once per round trip.
+    """
+    name = 'aimd'
+
+    def __init__(self, max_limit=MAX_CREDS_REQUESTS, initial_limit=CREDS_CONCURRENCY_INITIAL):
+        super().__init__(max_limit=max_limit)
+        self.limit = max(1, min(initial_limit, max_limit))
+        self.window = float(self.limit)
+        self.min_latency = None
+        self.smoothed_latency = None
+        self.last_decrease_time = 0
+
+    def decrease(self, decision):
+        now = time.perf_counter()
+        if self.smoothed_latency is not None and now - self.last_decrease_time < self.smoothed_latency:
+            return
+        self.last_decrease_time = now
+        self.window = max(1.0, self.window * FAILURE_REDUCTION_FACTOR / 100)
+        if int(self.window) != self.limit:
+            self.set_limit(int(self.window), decision)
+
+    def record(self, success, failed, latency):
+        super().record(success, failed, latency)
+        if 0 < failed:
+            self.decrease("Posting errors, reducing")
+            return
+        self.smoothed_latency = latency if self.smoothed_latency is None else 0.8 * self.smoothed_latency + 0.2 * latency
+        self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        if self.smoothed_latency > CREDS_LATENCY_TOLERANCE * self.min_latency:
+            self.decrease("Latency " + str(round(self.smoothed_latency, 2)) + "s, reducing")
+        elif self.window < self.max_limit:
+            self.window = min(float(self.max_limit), self.window + 1.0 / self.window)
+            if int(self.window) != self.limit:
+                self.set_limit(int(self.window), "Latency " + str(round(self.smoothed_latency, 2)) + "s, increasing")
+
+    def update(self):
+        return self.limit
+
+
+class GradientController(AIMDController):
+    """
+    Sets the limit from the ratio of the baseline latency to the current (smoothed) latency, plus a small allowance
+    for queueing (the square root of the limit), so the limit settles where latency stops growing.
+    Errors cut the limit as for AIMD.
+    """
+    name = 'gradient'
+
+    def record(self, success, failed, latency):
+        ErrorCountController.record(self, success, failed, latency)
+        if 0 < failed:
+            self.decrease("Posting errors, reducing")
+            return
+        self.smoothed_latency = latency if self.smoothed_latency is None else 0.8 * self.smoothed_latency + 0.2 * latency
+        self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        gradient = max(0.5, min(1.0, CREDS_LATENCY_TOLERANCE * self.min_latency / self.smoothed_latency))
+        self.window = max(1.0, min(float(self.max_limit), 0.9 * self.window + 0.1 * (self.window * gradient + self.window ** 0.5)))
+        if int(self.window) != self.limit:
+            decision = "increasing" if int(self.window) > self.limit else "reducing"
+            self.set_limit(int(self.window), "Latency " + str(round(self.smoothed_latency, 2)) + "s, " + decision)
+
+
+CONCURRENCY_CONTROLLERS = {controller.name: controller for controller in [ErrorCountController, AIMDController, GradientController]}
+
+
+def create_concurrency_controller(name=CREDS_CONCURRENCY_CONTROLLER):
+    if name not in CONCURRENCY_CONTROLLERS:
+        raise Exception(f"Unsupported concurrency controller: {name}")
+    return CONCURRENCY_CONTROLLERS[name]()
+
+
+async def post_credentials(status_writer, credentials, http_client):
+    # credential status updates are queued to the status writer, which applies them to CREDENTIAL_LOG in bulk
     success = 0
     failed = 0
     post_creds = []
@@ -188,102 +451,74 @@ async def post_credentials(conn, credentials):
       post_creds.append({"schema":credential['SCHEMA_NAME'], "version":credential['SCHEMA_VERSION'], "attributes":credential['CREDENTIAL_JSON']})
 
     # post credential
-    cur2 = None
+    post_start_time = time.perf_counter()
     try:
         results = None
         if ISSUE_CRED_VERSION == "V20":
-            results = await submit_cred_batch_v20(post_creds)
+            results = await submit_cred_batch_v20(post_creds, http_client)
         else:
-            results = await submit_cred_batch(post_creds)
+            results = await submit_cred_batch(post_creds, http_client)
+        latency = time.perf_counter() - post_start_time
 
     except (Exception) as error:
         # posting to the controller failed :-(
         # log error only if Issuer Controller is available (otherwise we will retry posting later)
-        if await check_controller_health():
+        if await check_controller_health(http_client=http_client):
             print(error)
             print(traceback.format_exc())
             print("log exception to database:", str(error))
-            res = str(error)
-            if 0 == len(res):
-                res = "Unspecified error posting to OrgBook"
-            elif 255 < len(res):
-                res = res[:250] + '...'
-            if cur2 is not None:
-                cur2.close()
-                cur2 = None
-            cur2 = conn.cursor()
+            res = status_message(error, "Unspecified error posting to OrgBook")
+            outcomes = []
             for i in range(len(credentials)):
                 credential = credentials[i]
-                cur2.execute(sql3, (datetime.datetime.now(), res, credential['RECORD_ID'],))
+                outcomes.append((datetime.datetime.now(), 'N', res, credential['RECORD_ID'],))
                 failed = failed + 1
-            conn.commit()
-            cur2.close()
-            cur2 = None
+            status_writer.write(outcomes)
             notify_error('An exception was encountered while posting credentials:\n{}'.format(res))
         else:
             failed = len(credentials)
 
-        return { 'success': success, 'failed': failed }
-    finally:
-        if cur2 is not None:
-            cur2.close()
+        return { 'success': success, 'failed': failed, 'latency': time.perf_counter() - post_start_time }
 
-    cur2 = None
     try:
+        outcomes = []
         for i in range(len(credentials)):
             credential = credentials[i]
             result = results[i]
 
             if result['success']:
-                cur2 = conn.cursor()
-                cur2.execute(sql2, (datetime.datetime.now(), result['result'], credential['RECORD_ID'],))
-                conn.commit()
-                cur2.close()
-                cur2 = None
+                outcomes.append((datetime.datetime.now(), 'Y', result['result'], credential['RECORD_ID'],))
                 success = success + 1
             else:
                 # the controller reported an error from the aca-py agent or aries-vcr
                 print("log aca-py error to database: ", result)
-                cur2 = conn.cursor()
                 if 255 < len(result['result']):
                     res = result['result'][:250] + '...'
                 else:
                     res = result['result']
-                cur2.execute(sql3, (datetime.datetime.now(), res, credential['RECORD_ID'],))
-                conn.commit()
-                cur2.close()
-                cur2 = None
+                outcomes.append((datetime.datetime.now(), 'N', res, credential['RECORD_ID'],))
                 failed = failed + 1
                 notify_error('An error was encountered while posting a credential:\n{}'.format(res))
+        status_writer.write(outcomes)
 
     except (Exception) as error:
-        # failed saving status to database :-( is the database available?
+        # failed processing the controller's response :-(
         print(error)
         print(traceback.format_exc())
         print("log exception to database", str(error))
-        res = str(error)
-        if 0 == len(res):
-            res = "Unspecified error storing credential status"
-        elif 255 < len(res):
-            res = res[:250] + '...'
-        if cur2 is not None:
-            cur2.close()
-            cur2 = None
-        cur2 = conn.cursor()
+        res = status_message(error, "Unspecified error storing credential status")
+        outcomes = []
+        success = 0
+        failed = 0
         for i in range(len(credentials)):
             credential = credentials[i]
-            cur2.execute(sql3, (datetime.datetime.now(), res, credential['RECORD_ID'],))
+            outcomes.append((datetime.datetime.now(), 'N', res, credential['RECORD_ID'],))
             failed = failed + 1
-        conn.commit()
-        cur2.close()
-        cur2 = None
+        status_writer.write(outcomes)
 
         notify_error('An exception was encountered while posting credentials:\n{}'.format(res))
-    finally:
-        if cur2 is not None:
-            cur2.close()
 
-    return { 'success': success, 'failed': failed }
+    return { 'success': success, 'failed': failed, 'latency': latency }
 
 
 class CredsSubmitter:
@@ -307,6 +542,26 @@ class CredsSubmitter:
     def __exit__(self, exc_type, exc_value, traceback):
         pass
  
+    # estimate the number of rows a query will return from the planner's statistics (avoids a count over the whole table)
+    def estimate_row_count(self, sql, args):
+        cur = None
+        try:
+            cur = self.conn.cursor()
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, args)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            cur.close()
+            cur = None
+            return int(plan[0]['Plan']['Plan Rows'])
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(error)
+            print(traceback.format_exc())
+            raise
+        finally:
+            if cur is not None:
+                cur.close()
+
     async def process_credential_queue(self, single_thread=False, system_type_cd=system_type):
         sql1 = """SELECT RECORD_ID, 
                       SYSTEM_TYPE_CD, 
@@ -323,58 +578,52 @@ class CredsSubmitter:
                       ENTRY_DATE
                   FROM CREDENTIAL_LOG 
                   WHERE SYSTEM_TYPE_CD = %s
-                  AND RECORD_ID IN
-                  (
-                      SELECT RECORD_ID
-                      FROM CREDENTIAL_LOG 
-                      WHERE SYSTEM_TYPE_CD = %s
-                      AND PROCESS_DATE is null
-                      AND RECORD_ID > %s
-                      AND (CREDENTIAL_JSON->>'expiry_date' = '' or CREDENTIAL_JSON->>'expiry_date' is null or CREDENTIAL_JSON->>'expiry_date' <= %s)
-                      ORDER BY RECORD_ID
-                      LIMIT """ + str(CREDS_BATCH_SIZE) + """
-                  )
-                  ORDER BY RECORD_ID;"""
-
-        sql1a = """SELECT count(*) cnt
-                   FROM CREDENTIAL_LOG 
-                   WHERE SYSTEM_TYPE_CD = %s
-                   AND PROCESS_DATE is null
-                   AND RECORD_ID > %s
-                   AND (CREDENTIAL_JSON->>'expiry_date' = '' or CREDENTIAL_JSON->>'expiry_date' is null or CREDENTIAL_JSON->>'expiry_date' <= %s)
-                   """
+                  AND PROCESS_DATE is null
+                  AND RECORD_ID > %s
+                  AND (EXPIRY_DATE is null or EXPIRY_DATE <= %s)
+                  ORDER BY RECORD_ID"""
 
         """ Connect to the PostgreSQL database server """
         #conn = None
-        cur = None
+        http_client = None
+        status_writer = None
         # Track the current set of tasks.
         # When gathering tasks at the end we don't want to include these in the list.
         external_tasks = asyncio.Task.all_tasks()
-        cutoff_time = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
-        cutoff_time_str = cutoff_time.strftime("%Y-%m-%dT%H:%M:%S")
+        cutoff_time = datetime.datetime.utcnow().replace(tzinfo=pytz.utc, microsecond=0)
         try:
             params = config(section='event_processor')
             pool = mpool.ThreadPool(MAX_CREDS_REQUESTS)
             loop = asyncio.get_event_loop()
             tasks = []
             max_rec_id = 0
+            # one http session (and pool of connections to the controller) for all the posts in this run
+            http_client = create_http_client()
+            # credential statuses are saved in the background
+            status_writer = CredentialStatusWriter()
 
             # ensure controller is available
-            if not await check_controller_health(wait=True):
+            if not await check_controller_health(wait=True, http_client=http_client):
                 raise Excecption("Error Issuer Controller is not available")
 
-            # create a cursor
-            cred_count = 0
-            cur = self.conn.cursor()
-            cur.execute(sql1a, (system_type_cd, max_rec_id, cutoff_time_str,))
-            row = cur.fetchone()
-            if row is not None:
-                cred_count = row[0]
-            cur.close()
-            cur = None
+            # the queue is read in pages of CREDS_BATCH_SIZE rows, keyed on the last RECORD_ID read
+            # (each page is read in its own short transaction, and the number of credentials is estimated by the planner rather than counted)
+            cred_count = self.estimate_row_count(sql1, (system_type_cd, max_rec_id, cutoff_time,))
+            sql1_page = sql1 + " LIMIT " + str(CREDS_BATCH_SIZE)
+
+            def read_page(after_rec_id):
+                page_cur = self.conn.cursor()
+                try:
+                    page_cur.execute(sql1_page, (system_type_cd, after_rec_id, cutoff_time,))
+                    page_rows = page_cur.fetchall()
+                finally:
+                    page_cur.close()
+                # end the read transaction
+                self.conn.commit()
+                return page_rows
 
             i = 0
-            cred_count_remaining = cred_count
+            rows = await loop.run_in_executor(None, read_page, max_rec_id)
             start_time = time.perf_counter()
             processing_time = 0
             processed_count = 0
@@ -382,25 +631,31 @@ class CredsSubmitter:
             max_processing_time = 60 * MAX_PROCESSING_MINS
             success_count = 0
             failed_count = 0
-            progressive_error_count = 0
-            progressive_success_count = 0
-            progressive_error_factor = 0
-            success_seq = 0
-            current_max_creds_requests = MAX_CREDS_REQUESTS
-
-            while 0 < cred_count_remaining and processing_time < max_processing_time and failed_count <= CONTROLLER_MAX_ERRORS:
-                # create a cursor
-                cur = self.conn.cursor()
-                cur.execute(sql1, (system_type_cd, system_type_cd, max_rec_id, cutoff_time_str,))
-                row = cur.fetchone()
+            # limits the number of concurrent posts, based on the outcome (and latency) of each post
+            controller = create_concurrency_controller()
+            current_max_creds_requests = controller.limit
+            # post latencies, and the controller's limit and decisions, are written with the stage timings
+            timings = StageTimings('process_credential_queue', system_type_cd=system_type_cd)
+
+            def post_done(task):
+                if task.cancelled():
+                    return
+                if task.exception() is not None:
+                    controller.record(0, 1, 0)
+                    return
+                result = task.result()
+                controller.record(result['success'], result['failed'], result['latency'])
+                timings.record_seconds('post_credentials', result['latency'])
+
+            while 0 < len(rows) and processing_time < max_processing_time and failed_count <= CONTROLLER_MAX_ERRORS:
                 credentials = []
                 cred_owner_id = ''
-                while row is not None:
+                for row in rows:
                     i = i + 1
                     processed_count = processed_count + 1
                     perf_proc_count = perf_proc_count + 1
                     if processed_count >= PROCESS_LOOP_REPORT_CT:
-                        print('>>> Processing {} of {} credentials.'.format(i, cred_count))
+                        print('>>> Processing {} of ~{} credentials.'.format(i, max(i, cred_count)))
                         processing_time = time.perf_counter() - start_time
                         print('Processing: ' + str(processing_time))
                         processed_count = 0
@@ -414,74 +669,50 @@ class CredsSubmitter:
                     # but also - limit batch size to avoid timeouts
                     if (CREDS_REQUEST_SIZE <= len(credentials) and credential['CORP_NUM'] != cred_owner_id) or (len(credentials) >= 2*CREDS_REQUEST_SIZE):
                         post_creds = credentials.copy()
-                        creds_task = loop.create_task(post_credentials(self.conn, post_creds))
+                        creds_task = loop.create_task(post_credentials(status_writer, post_creds, http_client))
+                        creds_task.add_done_callback(post_done)
                         tasks.append(creds_task)
                         #await asyncio.sleep(1)
                         if single_thread:
                             # running single threaded - wait for each task to complete
                             await creds_task
                         else:
-                            # If we start getting too many errors, drop down our concurrent request count.
-                            # This will introduce a delay in posting any new credentials, because we need
-                            # to wait for many of the active threads to complete.
-                            if current_max_creds_requests > 1 and progressive_error_factor > PROGRESSIVE_FAIL_THRESHOLD:
-                                current_max_creds_requests = int(0.5 + current_max_creds_requests * FAILURE_REDUCTION_FACTOR / 100)
-                                progressive_error_count = 0
-                                progressive_success_count = 0
-                                progressive_error_factor = 0
-                                success_seq = 0
-                                print(">>> Too many errors, reducing concurrent threads to:", current_max_creds_requests)
-                            elif progressive_error_factor == 0:
-                                # if we have a long run of successful posts then bump our throughput back up
-                                success_seq = success_seq + 1
-                                if success_seq > SUCCESS_INCREASE_FACTOR and current_max_creds_requests < MAX_CREDS_REQUESTS:
-                                    current_max_creds_requests = min(MAX_CREDS_REQUESTS, int(0.5 + 1.6 * current_max_creds_requests))
-                                    success_seq = 0
-                                    print(">>> Stable success, increasing concurrent threads to:", current_max_creds_requests)
-                            else:
-                                success_seq = 0
-
-                            # multi-threaded, check if we are within MAX_CREDS_REQUESTS active requests
+                            # the controller drops our concurrent request count if we start getting errors (or slow responses),
+                            # and bumps it back up when posting is going well
+                            current_max_creds_requests = controller.update()
+
+                            # multi-threaded, check if we are within the current limit of active requests
                             active_tasks = len([task for task in tasks if not task.done()])
                             while active_tasks >= current_max_creds_requests:
                                 # done is cumulative, includes the full set of "done" tasks
                                 done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
                                 active_tasks = len(pending)
+                                current_max_creds_requests = controller.limit
 
                                 # reset counters since we are counting *all* done tasks
-                                prev_failed_count = failed_count
                                 failed_count = 0
-                                prev_success_count = success_count
                                 success_count = 0
-                                prev_progressive_error_factor = progressive_error_factor
                                 for finished in done:
                                     done_result = finished.result()
                                     failed_count = failed_count + done_result['failed']
                                     success_count = success_count + done_result['success']
-                                progressive_error_count = failed_count - prev_failed_count
-                                progressive_success_count = success_count - prev_success_count
-                                progressive_error_factor = max(0, prev_progressive_error_factor + (
-                                    progressive_error_count * PROGRESSIVE_FAIL_FACTOR) - progressive_success_count)
 
                         credentials = []
                         cred_owner_id = ''
 
                     credentials.append(credential)
                     cred_owner_id = credential['CORP_NUM']
-                    
-                    row = cur.fetchone()
-
-                cur.close()
-                cur = None
 
                 if 0 < len(credentials):
                     post_creds = credentials.copy()
-                    tasks.append(loop.create_task(post_credentials(self.conn, post_creds)))
+                    creds_task = loop.create_task(post_credentials(status_writer, post_creds, http_client))
+                    creds_task.add_done_callback(post_done)
+                    tasks.append(creds_task)
                     credentials = []
                     cred_owner_id = ''
 
                 # wait for the current batch of credential posts to complete
-                print('>>> Processing {} of {} credentials.'.format(i, cred_count))
+                print('>>> Processing {} of ~{} credentials.'.format(i, max(i, cred_count)))
                 processing_time = time.perf_counter() - start_time
                 print('*** Processing: ' + str(processing_time))
                 if perf_proc_count > 2*(CREDS_REQUEST_SIZE*MAX_CREDS_REQUESTS):
@@ -489,16 +720,13 @@ class CredsSubmitter:
                     print(cpm, "credentials per minute")
 
                 # ensure controller is (still) available
-                if 0 < failed_count and not await check_controller_health(wait=True):
+                if 0 < failed_count and not await check_controller_health(wait=True, http_client=http_client):
                     raise Excecption("Error Issuer Controller is not available")
 
-                cur = self.conn.cursor()
-                cur.execute(sql1a, (system_type_cd, max_rec_id, cutoff_time_str,))
-                row = cur.fetchone()
-                if row is not None:
-                    cred_count_remaining = row[0]
-                cur.close()
-                cur = None
+                # read the next batch (off the event loop, while the posts are in progress)
+                rows = await loop.run_in_executor(None, read_page, max_rec_id)
+                print('>>> Approximately {} credentials remaining.'.format(max(0, cred_count - i) if 0 < len(rows) else 0))
+                timings.write(**controller.metrics())
 
             # wait for the current batch of credential posts to complete
             print(">>> Waiting for all outstanding tasks to complete ...")
@@ -506,6 +734,7 @@ class CredsSubmitter:
                 pass
             tasks = []
 
+            timings.write(**controller.metrics())
             print('>>> Completed.')
             processing_time = time.perf_counter() - start_time
             print('Processing: ' + str(processing_time))
@@ -524,5 +753,10 @@ class CredsSubmitter:
             if len(remaining_tasks) > 0:
                 await asyncio.gather(*remaining_tasks)
 
-            if cur is not None:
-                cur.close()
+            if http_client is not None:
+                await http_client.close()
+            if status_writer is not None:
+                # wait (off the event loop) for the last of the statuses to be saved
+                await asyncio.get_event_loop().run_in_executor(None, status_writer.close)
+                if 0 < status_writer.failed:
+                    log_error('Unable to save the status of {} posted credentials'.format(status_writer.failed))
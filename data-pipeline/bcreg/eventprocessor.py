@@ -1,6 +1,7 @@
 #!/usr/bin/python
  
 import psycopg2
+import psycopg2.extras
 import datetime
 import pytz
 import json
@@ -11,6 +12,17 @@ import logging
 import random
 import os
 import csv
+import re
+import resource
+import socket
+import bisect
+import functools
+import operator
+import threading
+from collections import deque
+import multiprocessing
+import gc
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from bcreg.config import config
 from bcreg.bcregistries import BCRegistries, CustomJsonEncoder, event_dict, is_data_conversion_event, system_type, CORP_TYPES_IN_SCOPE
@@ -66,7 +78,32 @@ org_rel_schema = 'demo.org_relationship.registries.ca'
 org_rel_version = '1.0.42'
 
 CORP_BATCH_SIZE = int(os.environ.get('CORP_BATCH_SIZE', 3000))
-FALLBACK_CORP_BATCH_SIZE = CORP_BATCH_SIZE % 10
+# the batch size is adapted (see CorpBatchSizer) between MIN_CORP_BATCH_SIZE and CORP_BATCH_SIZE
+MIN_CORP_BATCH_SIZE = int(os.environ.get('MIN_CORP_BATCH_SIZE', 100))
+CORP_BATCH_TARGET_CACHE_SECONDS = float(os.environ.get('CORP_BATCH_TARGET_CACHE_SECONDS', 120))
+CORP_BATCH_TARGET_SECONDS = float(os.environ.get('CORP_BATCH_TARGET_SECONDS', 300))
+CORP_BATCH_MAX_RSS_MB = int(os.environ.get('CORP_BATCH_MAX_RSS_MB', 0))
+CORP_BATCH_SHRINK_FACTOR = 4
+CORP_BATCH_GROWTH_FACTOR = 1.5
+# number of worker processes used to generate credentials (0 to generate them in this process)
+CORP_CREDS_WORKERS = int(os.environ.get('CORP_CREDS_WORKERS', 0))
+# number of corps loaded (and submitted for credential generation) ahead of the corp being stored
+CORP_CREDS_LOOKAHEAD = int(os.environ.get('CORP_CREDS_LOOKAHEAD', 4 * max(CORP_CREDS_WORKERS, 1)))
+# per-stage timings for each batch are appended to this file as JSON lines (not written if not set)
+STAGE_TIMINGS_LOG = os.environ.get('STAGE_TIMINGS_LOG')
+# upper bounds (in ms) of the stage timing histogram buckets (plus an overflow bucket)
+STAGE_TIMING_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+# when not caching, load each batch of COLIN corps using a single json aggregate query
+COLIN_CORP_JSON_AGG = os.environ.get('COLIN_CORP_JSON_AGG', 'false').lower() == 'true'
+# when set, batches of EVENT_BY_CORP_FILING are claimed with a lease so multiple workers can process the queue
+CORP_QUEUE_CLAIM = os.environ.get('CORP_QUEUE_CLAIM', 'false').lower() == 'true'
+CORP_QUEUE_LEASE_SECONDS = int(os.environ.get('CORP_QUEUE_LEASE_SECONDS', 30 * 60))
+# number of batches to read and cache in the background while the current batch is processed (0 = serial)
+CORP_BATCH_PREFETCH = int(os.environ.get('CORP_BATCH_PREFETCH', 0))
+# number of corps whose status writes are committed together (each corp's writes are isolated by a savepoint)
+CORP_STATUS_COMMIT_SIZE = int(os.environ.get('CORP_STATUS_COMMIT_SIZE', 1))
+# skip credential generation for re-queued corps whose data hasn't changed since it was last processed
+SKIP_UNCHANGED_CORPS = os.environ.get('SKIP_UNCHANGED_CORPS', 'false').lower() == 'true'
 
 MIN_START_DATE = datetime.datetime(datetime.MINYEAR+1, 1, 1)
 MIN_VALID_DATE = datetime.datetime(datetime.MINYEAR+10, 1, 1)
@@ -79,6 +116,15 @@ MIN_START_DATE_TZ = timezone.localize(MIN_START_DATE)
 MIN_VALID_DATE_TZ = timezone.localize(MIN_VALID_DATE)
 MAX_END_DATE_TZ   = timezone.localize(MAX_END_DATE)
 
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_TZ = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+DATE_COMPARE_OPS = {'==': operator.eq, '=': operator.eq, '<=': operator.le, '<': operator.lt, '>': operator.gt, '>=': operator.ge}
+
+# credential dates stored in CREDENTIAL_JSON start with the ISO date
+ISO_DATE_PREFIX = re.compile('^[0-9]{4}-[0-9]{2}-[0-9]{2}')
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -103,13 +149,185 @@ def event_json(event):
 def event_dict_from_json(event_json):
     return json.loads(event_json)
 
+def is_naive_datetime(d):
+    return (d.tzinfo is None or d.tzinfo.utcoffset(d) is None)
+
+# normalise a datetime to microseconds since the epoch, so dates can be compared with plain operators
+# naive datetimes are kept as wall-clock times (naive epoch) unless localize is set, in which case they 
+# are treated as local time and put on the UTC timeline with the aware ones (the same as compare_dates() 
+# does for a naive/aware pair)
+@functools.lru_cache(maxsize=4096)
+def timeline_ts(d, localize=True):
+    if not isinstance(d, datetime.datetime):
+        return None
+    if is_naive_datetime(d):
+        if not localize:
+            return (d - EPOCH) // ONE_MICROSECOND
+        d = timezone.localize(d)
+    return (d - EPOCH_TZ) // ONE_MICROSECOND
+
+# the credential's expiry date as stored in CREDENTIAL_JSON (an ISO date string), or None if it doesn't expire
+# (or if the date isn't valid, so it can't stop the credential from being stored)
+def credential_expiry_date(credential):
+    expiry_date = credential.get('expiry_date')
+    if expiry_date is None or expiry_date == '':
+        return None
+    if not isinstance(expiry_date, str):
+        expiry_date = json.loads(json.dumps(expiry_date, cls=CustomJsonEncoder))
+    if isinstance(expiry_date, str) and ISO_DATE_PREFIX.match(expiry_date):
+        try:
+            datetime.date.fromisoformat(expiry_date[:10])
+        except ValueError:
+            return None
+        return expiry_date
+    return None
+
+# apply many (process_date, process_success, process_msg, record_id) outcomes to a queue table in one statement
+def update_process_status(cur, table_name, outcomes):
+    sql = """UPDATE !TABLE!
+             SET PROCESS_DATE = outcome.process_date, PROCESS_SUCCESS = outcome.process_success, PROCESS_MSG = outcome.process_msg
+             FROM (VALUES %s) AS outcome (process_date, process_success, process_msg, record_id)
+             WHERE !TABLE!.RECORD_ID = outcome.record_id"""
+    if 0 < len(outcomes):
+        psycopg2.extras.execute_values(cur, sql.replace("!TABLE!", table_name), outcomes, 
+                                       template="(%s::timestamp, %s::char, %s::varchar, %s::integer)", page_size=1000)
+
+
+class CorpBatchSizer:
+    """
+    Adapts the event processor's batch size (between MIN_CORP_BATCH_SIZE and CORP_BATCH_SIZE).
+    Shrinks on a caching error, or when a batch's cache load is too slow or raises the memory high-water mark past CORP_BATCH_MAX_RSS_MB,
+    and grows back after full batches (up to what fits in CORP_BATCH_TARGET_SECONDS at the observed per-corp processing time).
+    """
+    def __init__(self, max_batch_size=CORP_BATCH_SIZE, min_batch_size=MIN_CORP_BATCH_SIZE):
+        self.max_batch_size = max_batch_size
+        self.min_batch_size = min(min_batch_size, max_batch_size)
+        self.batch_size = max_batch_size
+        self.max_rss_kb = self.get_max_rss_kb()
+
+    # memory high-water mark of this process (KB on linux)
+    def get_max_rss_kb(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def set_batch_size(self, batch_size, reason):
+        batch_size = max(self.min_batch_size, min(self.max_batch_size, int(batch_size)))
+        if batch_size != self.batch_size:
+            LOGGER.info("Corp batch size " + str(self.batch_size) + " -> " + str(batch_size) + ": " + reason)
+        else:
+            LOGGER.debug("Corp batch size " + str(batch_size) + " unchanged: " + reason)
+        self.batch_size = batch_size
+
+    # returns False if caching failed at the smallest batch size (i.e. switch to non-cached mode)
+    def cache_failed(self):
+        if self.batch_size <= self.min_batch_size:
+            LOGGER.info("Corp batch size " + str(self.batch_size) + ": caching error at the minimum batch size")
+            return False
+        self.set_batch_size(self.batch_size // CORP_BATCH_SHRINK_FACTOR, "caching error")
+        return True
+
+    def batch_processed(self, corp_count, cache_seconds, processing_seconds):
+        max_rss_kb = self.get_max_rss_kb()
+        rss_growth_kb = max_rss_kb - self.max_rss_kb
+        self.max_rss_kb = max_rss_kb
+        per_corp_seconds = processing_seconds / corp_count if 0 < corp_count else 0
+        if 0 < CORP_BATCH_MAX_RSS_MB and CORP_BATCH_MAX_RSS_MB * 1024 < max_rss_kb and 0 < rss_growth_kb:
+            self.set_batch_size(self.batch_size // 2, "memory high-water mark " + str(max_rss_kb // 1024) + " MB")
+        elif CORP_BATCH_TARGET_CACHE_SECONDS < cache_seconds:
+            self.set_batch_size(self.batch_size * CORP_BATCH_TARGET_CACHE_SECONDS / cache_seconds, "cache load took " + str(round(cache_seconds, 1)) + "s")
+        elif corp_count < self.batch_size:
+            # a partial batch (end of the queue) says nothing about larger batches
+            LOGGER.debug("Corp batch size " + str(self.batch_size) + " unchanged: partial batch of " + str(corp_count))
+        else:
+            batch_size = self.batch_size * CORP_BATCH_GROWTH_FACTOR
+            if 0 < per_corp_seconds:
+                batch_size = min(batch_size, CORP_BATCH_TARGET_SECONDS / per_corp_seconds)
+            self.set_batch_size(batch_size, "cache load took " + str(round(cache_seconds, 1)) + "s, " + str(round(per_corp_seconds, 3)) + "s per corp")
+
+
+class StageTimings:
+    """
+    Aggregates the time spent in each stage of processing a batch as a histogram per stage
+    (count, total, max and counts per STAGE_TIMING_BUCKETS_MS bucket), and writes them to STAGE_TIMINGS_LOG.
+    """
+    def __init__(self, source, **labels):
+        self.source = source
+        self.labels = labels
+        self.stages = {}
+
+    # record a stage that started at start_time (a time.perf_counter() value), returns the end time
+    # (so the next stage can be timed from it)
+    def record(self, name, start_time):
+        end_time = time.perf_counter()
+        self.record_seconds(name, end_time - start_time)
+        return end_time
+
+    def record_seconds(self, name, seconds):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'buckets': [0] * (len(STAGE_TIMING_BUCKETS_MS) + 1)}
+            self.stages[name] = stage
+        ms = seconds * 1000
+        stage['count'] = stage['count'] + 1
+        stage['total_ms'] = stage['total_ms'] + ms
+        stage['max_ms'] = max(stage['max_ms'], ms)
+        stage['buckets'][bisect.bisect_left(STAGE_TIMING_BUCKETS_MS, ms)] += 1
+
+    # estimate a percentile as the upper bound of the bucket it falls in
+    def stage_percentile(self, stage, pct):
+        rank = pct * stage['count']
+        seen = 0
+        for i, count in enumerate(stage['buckets']):
+            seen = seen + count
+            if rank <= seen and 0 < count:
+                return min(STAGE_TIMING_BUCKETS_MS[i], stage['max_ms']) if i < len(STAGE_TIMING_BUCKETS_MS) else stage['max_ms']
+        return stage['max_ms']
+
+    def summary(self):
+        summary = {}
+        for name, stage in self.stages.items():
+            summary[name] = {'count': stage['count'], 
+                             'total_ms': round(stage['total_ms'], 3), 
+                             'mean_ms': round(stage['total_ms'] / stage['count'], 3), 
+                             'p50_ms': round(self.stage_percentile(stage, 0.5), 3), 
+                             'p90_ms': round(self.stage_percentile(stage, 0.9), 3), 
+                             'p99_ms': round(self.stage_percentile(stage, 0.99), 3), 
+                             'max_ms': round(stage['max_ms'], 3), 
+                             'buckets': {('le_' + str(le) if i < len(STAGE_TIMING_BUCKETS_MS) else 'inf'): stage['buckets'][i] 
+                                            for i, le in enumerate(STAGE_TIMING_BUCKETS_MS + [None]) if 0 < stage['buckets'][i]}}
+        return summary
+
+    # write the timings (along with any batch-level fields) and reset
+    def write(self, **fields):
+        if 0 < len(self.stages):
+            record = {'timestamp': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(), 'source': self.source}
+            record.update(self.labels)
+            record.update(fields)
+            record['stages'] = self.summary()
+            if STAGE_TIMINGS_LOG:
+                try:
+                    with open(STAGE_TIMINGS_LOG, 'a') as f:
+                        f.write(json.dumps(record) + "\n")
+                except (Exception) as error:
+                    # timings are informational only, don't stop processing
+                    LOGGER.warning("Unable to write stage timings: " + str(error))
+            elif LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug("Stage timings: " + json.dumps(record))
+        self.stages = {}
+
 
 # interface to Event Processor database
 class EventProcessor:
-    def __init__(self):
+    # (a processor created with connect=False can only be used to generate credentials)
+    def __init__(self, connect=True):
+        self.conn = None
+        self.worker_id = None
+        if not connect:
+            return
         try:
             params = config(section='event_processor')
             self.conn = psycopg2.connect(**params)
+            # identifies this worker's claims on the event queue (a restarted worker with the same id picks up its own claims)
+            self.worker_id = os.environ.get('CORP_QUEUE_WORKER_ID') or (socket.gethostname() + '-' + str(os.getpid()))
         except (Exception) as error:
             LOGGER.error(error)
             LOGGER.error(traceback.print_exc())
@@ -212,6 +430,19 @@ class EventProcessor:
             ALTER TABLE EVENT_BY_CORP_FILING  
             SET (autovacuum_analyze_threshold = 5000);
             """,
+            """
+            ALTER TABLE EVENT_BY_CORP_FILING
+            ADD COLUMN IF NOT EXISTS CLAIM_ID VARCHAR(255);
+            """,
+            """
+            ALTER TABLE EVENT_BY_CORP_FILING
+            ADD COLUMN IF NOT EXISTS CLAIM_EXPIRY TIMESTAMP;
+            """,
+            """
+            -- Hit for claiming (check for other workers' claims on the same corp)
+            CREATE INDEX IF NOT EXISTS ebcf_stc_cn_pd_null ON EVENT_BY_CORP_FILING 
+            (SYSTEM_TYPE_CD, CORP_NUM) WHERE PROCESS_DATE IS NULL;
+            """,
             """ 
             REINDEX TABLE EVENT_BY_CORP_FILING;
             """,
@@ -256,6 +487,15 @@ class EventProcessor:
             ALTER TABLE CORP_HISTORY_LOG  
             SET (autovacuum_analyze_threshold = 5000);
             """,
+            """
+            ALTER TABLE CORP_HISTORY_LOG
+            ADD COLUMN IF NOT EXISTS CORP_JSON_HASH VARCHAR(64);
+            """,
+            """
+            -- Hit for the latest history of a corp
+            CREATE INDEX IF NOT EXISTS chl_stc_cn_ri_desc ON CORP_HISTORY_LOG 
+            (SYSTEM_TYPE_CD, CORP_NUM, RECORD_ID DESC);
+            """,
             """ 
             REINDEX TABLE CORP_HISTORY_LOG;
             """,
@@ -357,6 +597,37 @@ class EventProcessor:
             ALTER TABLE CREDENTIAL_LOG  
             SET (autovacuum_analyze_threshold = 5000);
             """,
+            """
+            -- typed copy of the credential's expiry date, so that future-dated credentials can be held back using an index
+            -- (unposted credentials are back-filled when the column is added, an expiry date that isn't a valid date is left null)
+            DO $$
+            DECLARE
+                cred RECORD;
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
+                               WHERE table_name = 'credential_log' AND column_name = 'expiry_date') THEN
+                    ALTER TABLE CREDENTIAL_LOG ADD COLUMN EXPIRY_DATE TIMESTAMP WITH TIME ZONE;
+                    FOR cred IN SELECT RECORD_ID, CREDENTIAL_JSON->>'expiry_date' EXPIRY_DATE FROM CREDENTIAL_LOG
+                                WHERE PROCESS_DATE IS NULL AND CREDENTIAL_JSON->>'expiry_date' ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' LOOP
+                        BEGIN
+                            UPDATE CREDENTIAL_LOG SET EXPIRY_DATE = cred.EXPIRY_DATE::timestamptz WHERE RECORD_ID = cred.RECORD_ID;
+                        EXCEPTION WHEN data_exception THEN
+                            NULL;
+                        END;
+                    END LOOP;
+                END IF;
+            END $$;
+            """,
+            """
+            -- Hit for queries (credentials ready to post)
+            CREATE INDEX IF NOT EXISTS cl_stc_ri_exp_pd_null_asc ON CREDENTIAL_LOG 
+            (SYSTEM_TYPE_CD, RECORD_ID ASC, EXPIRY_DATE) WHERE PROCESS_DATE IS NULL;
+            """,
+            """
+            -- Hit for counts (future-dated credentials)
+            CREATE INDEX IF NOT EXISTS cl_exp_pd_null ON CREDENTIAL_LOG 
+            (EXPIRY_DATE) WHERE PROCESS_DATE IS NULL AND EXPIRY_DATE IS NOT NULL;
+            """,
             """ 
             REINDEX TABLE CREDENTIAL_LOG;
             """,
@@ -715,47 +986,47 @@ class EventProcessor:
 
     # insert a generated JSON credential into our log
     def insert_json_credential(self, cur, system_cd, prev_event, last_event, corp_num, corp_state, cred_type, cred_id, schema_name, schema_version, credential, credential_reason):
-        sql = """INSERT INTO CREDENTIAL_LOG (SYSTEM_TYPE_CD, PREV_EVENT, LAST_EVENT, CORP_NUM, CORP_STATE, CREDENTIAL_TYPE_CD, CREDENTIAL_ID, 
-                SCHEMA_NAME, SCHEMA_VERSION, CREDENTIAL_JSON, CREDENTIAL_HASH, CREDENTIAL_REASON, ENTRY_DATE)
-                VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING RECORD_ID;"""
-        sql_addr = """INSERT INTO CREDENTIAL_LOG (SYSTEM_TYPE_CD, PREV_EVENT, LAST_EVENT, CORP_NUM, CORP_STATE, CREDENTIAL_TYPE_CD, CREDENTIAL_ID, 
-                SCHEMA_NAME, SCHEMA_VERSION, CREDENTIAL_JSON, CREDENTIAL_HASH, CREDENTIAL_REASON, ENTRY_DATE, PROCESS_DATE, PROCESS_SUCCESS)
-                VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING RECORD_ID;"""
+        return self.insert_json_credentials(cur, [self.credential_log_row(system_cd, prev_event, last_event, corp_num, corp_state, cred_type, cred_id, 
+                                                                          schema_name, schema_version, credential, credential_reason)])
+
+    # build the CREDENTIAL_LOG row for a credential
+    def credential_log_row(self, system_cd, prev_event, last_event, corp_num, corp_state, cred_type, cred_id, schema_name, schema_version, credential, credential_reason):
         # create row(s) for corp creds json info
         cred_json = json.dumps(credential, cls=CustomJsonEncoder, sort_keys=True)
         cred_hash = hashlib.sha256(cred_json.encode('utf-8')).hexdigest()
+        # store address creds with a special status, because we don't want to post them yet
+        if (cred_type == addr_credential) and (not GENERATE_EXTRA_DEMO_CREDS):
+            process_date = datetime.datetime.now()
+            process_success = 'A'
+        else:
+            process_date = None
+            process_success = None
+            # release credentials with no effective date (for now)
+            if self.is_min_date(credential['effective_date']) or credential['effective_date'] is None or credential['effective_date'] == '':
+                credential['effective_date'] = ''
+        return (system_cd, event_json(prev_event), event_json(last_event), corp_num, corp_state, cred_type, cred_id, 
+                schema_name, schema_version, cred_json, cred_hash, credential_reason, datetime.datetime.now(), process_date, process_success, 
+                credential_expiry_date(credential),)
+
+    # insert credential rows with a single statement, returns the number of (non-duplicate) credentials saved
+    def insert_json_credentials(self, cur, cred_rows):
+        sql = """INSERT INTO CREDENTIAL_LOG (SYSTEM_TYPE_CD, PREV_EVENT, LAST_EVENT, CORP_NUM, CORP_STATE, CREDENTIAL_TYPE_CD, CREDENTIAL_ID, 
+                SCHEMA_NAME, SCHEMA_VERSION, CREDENTIAL_JSON, CREDENTIAL_HASH, CREDENTIAL_REASON, ENTRY_DATE, PROCESS_DATE, PROCESS_SUCCESS, EXPIRY_DATE)
+                VALUES %s
+                ON CONFLICT (CREDENTIAL_HASH) DO NOTHING
+                RETURNING RECORD_ID;"""
+        if 0 == len(cred_rows):
+            return 0
         try:
-            cur.execute("savepoint save_" + cred_type)
-            # store address creds with a special status, because we don't want to post them yet
-            if (cred_type == addr_credential) and (not GENERATE_EXTRA_DEMO_CREDS):
-                cur.execute(sql_addr, (system_cd, event_json(prev_event), event_json(last_event), corp_num, corp_state, cred_type, cred_id, 
-                            schema_name, schema_version, cred_json, cred_hash, credential_reason, datetime.datetime.now(), datetime.datetime.now(), 'A',))
-                # release credentials with no effective date (for now)
-                #elif self.is_min_date(credential['effective_date']) or credential['effective_date'] is None or credential['effective_date'] == '':
-                #    # create and store credential but don't post it
-                #    cur.execute(sql_addr, (system_cd, event_json(prev_event), event_json(last_event), corp_num, corp_state, cred_type, cred_id, 
-                #                schema_name, schema_version, cred_json, cred_hash, credential_reason, datetime.datetime.now(), datetime.datetime.now(), 'X',))
-            else:
-                # release credentials with no effective date (for now)
-                if self.is_min_date(credential['effective_date']) or credential['effective_date'] is None or credential['effective_date'] == '':
-                    credential['effective_date'] = ''
-                cur.execute(sql, (system_cd, event_json(prev_event), event_json(last_event), corp_num, corp_state, cred_type, cred_id, 
-                            schema_name, schema_version, cred_json, cred_hash, credential_reason, datetime.datetime.now(),))
-            return 1
-        except Exception as e:
-            # ignore duplicate hash ("duplicate key value violates unique constraint "cl_hash_index"")
-            # re-raise all others
-            stre = str(e)
-            if "duplicate key value violates unique constraint" in stre and "cl_hash_index" in stre:
-                #LOGGER.info("Hash exception, skipping duplicate credential for corp: " + corp_num + " " + cred_type + " " + cred_id + " " + str(e))
-                cur.execute("rollback to savepoint save_" + cred_type)
-                #LOGGER.info(cred_json)
-                return 0
-            else:
-                LOGGER.error(stre)
-                LOGGER.error(traceback.print_exc())
-                log_error("EventProcessor exception updating DB: " + str(error))
-                raise
+            # duplicate hashes (cl_hash_index) are skipped, and aren't returned
+            record_ids = psycopg2.extras.execute_values(cur, sql, cred_rows, fetch=True, 
+                                                        template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::timestamptz)")
+            return len(record_ids)
+        except (Exception, psycopg2.DatabaseError) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("EventProcessor exception updating DB: " + str(error))
+            raise
 
     # determine jurisdiction for corp
     def get_corp_jurisdiction(self, corp, jurisdiction):
@@ -826,12 +1097,27 @@ class EventProcessor:
     def is_timezone_aware(self, d):
         return (d.tzinfo is not None and d.tzinfo.utcoffset(d) is not None)
 
+    # msg can be a string, or anything that converts to one (e.g. the record) or a function that builds one,
+    # it is only converted if we log something
+    def date_msg(self, msg):
+        return msg() if callable(msg) else str(msg)
+
     def compare_dates(self, first_date, op, second_date, msg):
         # check for empty or null strings
         if first_date is None or (isinstance(first_date, str) and 0 == len(first_date)):
-            LOGGER.info(msg + " first date is None or empty string")
+            if LOGGER.isEnabledFor(logging.INFO):
+                LOGGER.info(self.date_msg(msg) + " first date is None or empty string")
         if second_date is None or (isinstance(second_date, str) and 0 == len(second_date)):
-            LOGGER.info(msg + " second date is None or empty string")
+            if LOGGER.isEnabledFor(logging.INFO):
+                LOGGER.info(self.date_msg(msg) + " second date is None or empty string")
+        compare_op = DATE_COMPARE_OPS.get(op)
+        if compare_op is None:
+            LOGGER.error(self.date_msg(msg) + "invalid date op" + op)
+            return False
+        # datetimes are compared on the normalised timeline (naive pairs as wall-clock times, otherwise UTC)
+        if isinstance(first_date, datetime.datetime) and isinstance(second_date, datetime.datetime):
+            localize = not (is_naive_datetime(first_date) and is_naive_datetime(second_date))
+            return compare_op(timeline_ts(first_date, localize), timeline_ts(second_date, localize))
         # make sure the two variables are the same data type
         if isinstance(first_date, str) and not isinstance(second_date, str):
             second_date = str(second_date)
@@ -845,25 +1131,14 @@ class EventProcessor:
             if not self.is_timezone_aware(second_date):
                 second_date = timezone.localize(second_date)
         # now do the comparison
-        if op == "==" or op == '=':
-            return first_date == second_date
-        elif op == "<=":
-            return first_date <= second_date
-        elif op == "<":
-            return first_date < second_date
-        elif op == ">":
-            return first_date > second_date
-        elif op == ">=":
-            return first_date >= second_date
-        LOGGER.error(msg + "invalid date op" + op)
-        return False
+        return compare_op(first_date, second_date)
 
     # generate address credential
-    def generate_address_credential(self, corp_num, corp_info, office, address, dba_corp_num, dba_name):
+    def generate_address_credential(self, corp_num, corp_info, office, address, dba_corp_num, dba_name, org_names_index=None):
         addr_cred = {}
         addr_cred['registration_id'] = self.corp_num_with_prefix(corp_info['corp_typ_cd'], corp_num)
         if 0 < len(corp_info['org_names']):
-            org_name = self.corp_rec_at_effective_date(corp_info['org_names'], office['start_event'])
+            org_name = self.corp_rec_at_effective_date(corp_info['org_names'], office['start_event'], org_names_index)
             if org_name is not None:
                 addr_cred['addressee'] = org_name['corp_nme'] if org_name['corp_nme'] else ''
             else:
@@ -899,15 +1174,16 @@ class EventProcessor:
 
     # store credentials for the provided corp
     def store_credentials(self, cur, system_type_cd, prev_event, last_event, corp_num, corp_state, corp_info, corp_creds):
-        cred_count = 0
+        cred_rows = []
         for corp_cred in corp_creds:
             if corp_cred['credential']['effective_date'] is not None and corp_cred['credential']['effective_date'] != '':
-                cred_count = cred_count + self.insert_json_credential(cur, system_type_cd, prev_event, last_event, corp_num, corp_state, 
-                                                                corp_cred['cred_type'], corp_cred['id'], corp_cred['schema'], corp_cred['version'], 
-                                                                corp_cred['credential'], corp_cred['credential_reason'])
+                cred_rows.append(self.credential_log_row(system_type_cd, prev_event, last_event, corp_num, corp_state, 
+                                                         corp_cred['cred_type'], corp_cred['id'], corp_cred['schema'], corp_cred['version'], 
+                                                         corp_cred['credential'], corp_cred['credential_reason']))
             else:
                 LOGGER.error("Error can't issue a credential with no effective date! " + corp_num + " " + corp_cred['cred_type'] + " " + str(corp_cred))
-        return cred_count
+        # all of the corp's credentials are written in one statement (duplicates are skipped)
+        return self.insert_json_credentials(cur, cred_rows)
 
     def build_credential_dict(self, cred_type, schema, version, cred_id, credential, credential_reason, effective_date):
         cred = {}
@@ -926,10 +1202,10 @@ class EventProcessor:
         if 'entity_status_effective' in corp_cred and str(corp_cred['entity_status_effective']) != '' and corp_cred['entity_status_effective'] is not None:
             effective_date = corp_cred['entity_status_effective']
         if 'entity_name_effective' in corp_cred and str(corp_cred['entity_name_effective']) != '' and corp_cred['entity_name_effective'] is not None:
-            if effective_date is None or self.compare_dates(effective_date, "<", corp_cred['entity_name_effective'], 'cred:' + str(corp_cred)):
+            if effective_date is None or self.compare_dates(effective_date, "<", corp_cred['entity_name_effective'], lambda: 'cred:' + str(corp_cred)):
                 effective_date = corp_cred['entity_name_effective']
         if 'entity_name_assumed_effective' in corp_cred and str(corp_cred['entity_name_assumed_effective']) != '' and corp_cred['entity_name_assumed_effective'] is not None:
-            if effective_date is None or self.compare_dates(effective_date, "<", corp_cred['entity_name_assumed_effective'], 'cred:' + str(corp_cred)):
+            if effective_date is None or self.compare_dates(effective_date, "<", corp_cred['entity_name_assumed_effective'], lambda: 'cred:' + str(corp_cred)):
                 effective_date = corp_cred['entity_name_assumed_effective']
         return effective_date
 
@@ -970,22 +1246,74 @@ class EventProcessor:
             prev_effective_event = effective_event
         return ret_effective_events
 
+    # sorted interval index for org_names etc., built once per corp
+    def corp_rec_interval_index(self, corp_recs):
+        """
+        Index for corp_rec_at_effective_date(): the active records (no end event), plus the ended records 
+        sorted by (start date, end date, -position) so a point-in-time lookup can bisect on the start date.
+        Dates are held on the normalised timeline (see timeline_ts()), as wall-clock times if they are all naive.
+        Returns None (lookups fall back to a scan) unless all the dates are datetimes of the same kind.
+        """
+        dates = [corp_rec[k] for corp_rec in corp_recs for k in ('effective_start_date', 'effective_end_date')]
+        if not all(isinstance(d, datetime.datetime) for d in dates):
+            return None
+        naive = all(is_naive_datetime(d) for d in dates)
+        if not naive and any(is_naive_datetime(d) for d in dates):
+            return None
+        active_recs = []
+        intervals = []
+        for idx, corp_rec in enumerate(corp_recs):
+            start_ts = timeline_ts(corp_rec['effective_start_date'], not naive)
+            end_ts = timeline_ts(corp_rec['effective_end_date'], not naive)
+            # ignore the record if start_date > end_date
+            if start_ts > end_ts:
+                continue
+            if 'end_event_id' not in corp_rec or corp_rec['end_event_id'] is None:
+                active_recs.append((start_ts, end_ts, corp_rec))
+            else:
+                intervals.append((start_ts, end_ts, -idx, corp_rec))
+        intervals = sorted(intervals, key=lambda k: k[:3])
+        return {'naive': naive, 'active': active_recs, 'starts': [k[0] for k in intervals], 'intervals': intervals}
+
     # org_names etc. active at effective date
-    def corp_rec_at_effective_date(self, corp_recs, loop_start_event):
+    def corp_rec_at_effective_date(self, corp_recs, loop_start_event, index=None):
         # pick the lowest effective date where the passed in start date is in range
         loop_start_date = loop_start_event['effective_date']
         loop_start_id = loop_start_event['event_id']
         ret_corp_rec = None
 
+        # (the index can only be used if the date is the same kind as the indexed ones)
+        loop_start_ts = None
+        if (index is not None and isinstance(loop_start_date, datetime.datetime) and 
+            is_naive_datetime(loop_start_date) == index['naive']):
+            loop_start_ts = timeline_ts(loop_start_date, not index['naive'])
+        if loop_start_ts is not None:
+            # if we hit an active record, use it (ignore anything dated after the start date of the currently active record)
+            for (start_ts, end_ts, corp_rec) in index['active']:
+                if start_ts <= loop_start_ts and loop_start_ts < end_ts:
+                    ret_corp_rec = corp_rec
+                    break
+            if ret_corp_rec is None:
+                # otherwise the latest record (by start date, then end date) that started on or before the date and is still in range
+                i = bisect.bisect_right(index['starts'], loop_start_ts)
+                while 0 < i:
+                    i = i - 1
+                    if loop_start_ts < index['intervals'][i][1]:
+                        ret_corp_rec = index['intervals'][i][3]
+                        break
+            corp_recs_scan = []
+        else:
+            corp_recs_scan = corp_recs
+
         # find record matching the provided event
-        for corp_rec in corp_recs:
+        for corp_rec in corp_recs_scan:
             # ignore the record if start_date > end_date
-            if self.compare_dates(corp_rec['effective_start_date'], "<=", corp_rec['effective_end_date'], str(corp_rec)):
+            if self.compare_dates(corp_rec['effective_start_date'], "<=", corp_rec['effective_end_date'], corp_rec):
                 #if corp_rec['start_event_id'] == loop_start_id:
                 #    # if the start event id matches then we have a match
                 #    return corp_rec
-                if (self.compare_dates(corp_rec['effective_start_date'], "<=", loop_start_date, str(corp_rec)) and
-                    (self.compare_dates(corp_rec['effective_end_date'], ">", loop_start_date, str(corp_rec)))):
+                if (self.compare_dates(corp_rec['effective_start_date'], "<=", loop_start_date, corp_rec) and
+                    (self.compare_dates(corp_rec['effective_end_date'], ">", loop_start_date, corp_rec))):
                     # if the record date is earlier than the event effective date, it is potential match
                     if 'end_event_id' not in corp_rec or corp_rec['end_event_id'] is None:
                         # if we hit the active record, use it (ignore anything dated after the start date of the currently active record)
@@ -993,11 +1321,11 @@ class EventProcessor:
                         break
                     elif ret_corp_rec is None:
                         ret_corp_rec = corp_rec
-                    elif self.compare_dates(corp_rec['effective_start_date'], ">", ret_corp_rec['effective_start_date'], str(corp_rec)):
+                    elif self.compare_dates(corp_rec['effective_start_date'], ">", ret_corp_rec['effective_start_date'], corp_rec):
                         # pick the latest record based on effective date
                         ret_corp_rec = corp_rec
-                    elif self.compare_dates(corp_rec['effective_start_date'], "==", ret_corp_rec['effective_start_date'], str(corp_rec)):
-                        if self.compare_dates(corp_rec['effective_end_date'], ">", ret_corp_rec['effective_end_date'], str(corp_rec)):
+                    elif self.compare_dates(corp_rec['effective_start_date'], "==", ret_corp_rec['effective_start_date'], corp_rec):
+                        if self.compare_dates(corp_rec['effective_end_date'], ">", ret_corp_rec['effective_end_date'], corp_rec):
                             # if the start dates are the same, select the latest end date
                             ret_corp_rec = corp_rec
 
@@ -1346,6 +1674,11 @@ class EventProcessor:
         (effective_events, future_events) = self.current_and_future_corp_events(system_type_cd, corp_num, corp_info)
         # print(corp_num, len(effective_events), len(future_events))
 
+        # index the corp records once, for the point-in-time lookups below
+        corp_rec_indexes = {}
+        for rec_type in ['org_names', 'org_name_assumed', 'corp_state', 'jurisdiction']:
+            corp_rec_indexes[rec_type] = self.corp_rec_interval_index(corp_info[rec_type]) if rec_type in corp_info else None
+
         if 0 < len(effective_events):
             #LOGGER.info('effective_events', effective_events)
             # build a standard dict for the first and last events in the effective range
@@ -1389,7 +1722,7 @@ class EventProcessor:
                     corp_cred['entity_type'] = corp_info['corp_type']['corp_typ_cd']
 
                     # org_names active at effective date
-                    org_name = self.corp_rec_at_effective_date(corp_info['org_names'], loop_start_event)
+                    org_name = self.corp_rec_at_effective_date(corp_info['org_names'], loop_start_event, corp_rec_indexes['org_names'])
                     if org_name is not None:
                         #LOGGER.info('org_name', org_name)
                         corp_cred['entity_name'] = org_name['corp_nme']
@@ -1405,7 +1738,7 @@ class EventProcessor:
                         corp_cred['entity_name_effective'] = ''
 
                     # org_name_assumed active at effective date
-                    org_name_assumed = self.corp_rec_at_effective_date(corp_info['org_name_assumed'], loop_start_event)
+                    org_name_assumed = self.corp_rec_at_effective_date(corp_info['org_name_assumed'], loop_start_event, corp_rec_indexes['org_name_assumed'])
                     #LOGGER.info("org_name_assumed", org_name_assumed)
                     if org_name_assumed is not None:
                         #LOGGER.info('org_name_assumed', org_name_assumed)
@@ -1419,7 +1752,7 @@ class EventProcessor:
                         corp_cred['entity_name_assumed_effective'] = ''
 
                     # corp_state active at effective date
-                    corp_state = self.corp_rec_at_effective_date(corp_info['corp_state'], loop_start_event)
+                    corp_state = self.corp_rec_at_effective_date(corp_info['corp_state'], loop_start_event, corp_rec_indexes['corp_state'])
                     if corp_state is not None:
                         #LOGGER.info('corp_state', corp_state)
                         corp_cred['entity_status'] = corp_state['op_state_typ_cd']
@@ -1432,7 +1765,7 @@ class EventProcessor:
                         corp_cred['entity_status_effective'] = ''
 
                     # jurisdiction active at effective date
-                    jurisdiction = self.corp_rec_at_effective_date(corp_info['jurisdiction'], loop_start_event)
+                    jurisdiction = self.corp_rec_at_effective_date(corp_info['jurisdiction'], loop_start_event, corp_rec_indexes['jurisdiction'])
                     corp_cred['home_jurisdiction'] = self.get_corp_jurisdiction(corp_info, jurisdiction)
                     if corp_cred['home_jurisdiction'] and 0 < len(corp_cred['home_jurisdiction']) and corp_cred['home_jurisdiction'] != 'BC':
                         corp_cred['registered_jurisdiction'] = 'BC' 
@@ -1508,7 +1841,7 @@ class EventProcessor:
                 # ensure address history is generated correctly
                 if 'office_typ_cd' in office:
                     if 'delivery_addr' in office and 'local_addr' in office['delivery_addr']:
-                        addr_cred = self.generate_address_credential(corp_num, corp_info, office, office['delivery_addr'], "", "")
+                        addr_cred = self.generate_address_credential(corp_num, corp_info, office, office['delivery_addr'], "", "", corp_rec_indexes['org_names'])
                         reason_description = self.build_corp_reason_code(office['start_event'])
                         corp_creds.append(self.build_credential_dict(addr_credential, addr_schema, addr_version, 
                                                                     corp_num + ',' + office['office_typ_cd'], 
@@ -1685,11 +2018,11 @@ class EventProcessor:
         else:
             raise Exception(f"Unknown system type: {system_type_cd}")
 
-    def bc_reg_processor(self, system_type_cd, use_cache=False):
+    def bc_reg_processor(self, system_type_cd, use_cache=False, shared_with=None):
         if system_type_cd == system_type:
-            return BCRegistries(use_cache)
+            return BCRegistries(use_cache, shared_with=shared_with)
         elif system_type_cd == lear_system_type:
-            return BCReg_Lear(use_cache)
+            return BCReg_Lear(use_cache, shared_with=shared_with)
         else:
             raise Exception(f"Unknown system type: {system_type_cd}")
 
@@ -1714,19 +2047,75 @@ class EventProcessor:
         else:
             raise Exception(f"Unknown system type: {system_type_cd}")
 
-    # process corps that have been queued - update data from bc_registries
-    def process_corp_event_queue_internal(self, system_type_cd, load_regs=True, generate_creds=False, use_cache=False, corp_types=CORP_TYPES_IN_SCOPE):
+    # claim a batch of unprocessed events for this worker
+    def claim_corp_event_queue(self, system_type_cd, batch_size, after_record_id=0, conn=None):
         """
-        The main process for loading BC Reg data and producing credentials.
-        This process takes unprocessed events from the EVENT_BY_CORP_FILING table, and for each corp_num:
-           - if load_regs: loads data from BC Reg for that corp (stores in CORP_HISTORY_LOG)
-           - if generate_creds: produces credentials (stores in CREDENTIAL_LOG)
-        Credentials are submitted to TOB via the agent using a separate process.
-        If use_cache is True, BC Reg data is cached into a local in-memory sqlite database prior to generating credentials.
+        Claims up to batch_size unprocessed rows (after after_record_id) from EVENT_BY_CORP_FILING for this worker and returns them in RECORD_ID order.
+        A row can be claimed if it is unclaimed, already claimed by this worker, or its lease has expired (crashed worker).
+        Rows for a corp that another worker holds an unexpired claim on are skipped, so each corp's events stay in order.
+        Claims are serialized with an advisory lock (the claim is a short update, the processing is not).
         """
+        sql_lock = """SELECT pg_advisory_xact_lock(hashtext('EVENT_BY_CORP_FILING'), hashtext(%s));"""
+        sql_claim = """WITH claimable AS (
+                         SELECT RECORD_ID
+                         FROM EVENT_BY_CORP_FILING ebcf
+                         WHERE SYSTEM_TYPE_CD = %s
+                         AND PROCESS_DATE is null
+                         AND RECORD_ID > %s
+                         AND (CLAIM_ID is null OR CLAIM_ID = %s OR CLAIM_EXPIRY < LOCALTIMESTAMP)
+                         AND NOT EXISTS (
+                           SELECT 1
+                           FROM EVENT_BY_CORP_FILING other
+                           WHERE other.SYSTEM_TYPE_CD = ebcf.SYSTEM_TYPE_CD
+                           AND other.CORP_NUM = ebcf.CORP_NUM
+                           AND other.PROCESS_DATE is null
+                           AND other.CLAIM_ID <> %s
+                           AND other.CLAIM_EXPIRY >= LOCALTIMESTAMP
+                         )
+                         ORDER BY RECORD_ID
+                         LIMIT !BS!
+                         FOR UPDATE SKIP LOCKED
+                       )
+                       UPDATE EVENT_BY_CORP_FILING
+                       SET CLAIM_ID = %s, CLAIM_EXPIRY = LOCALTIMESTAMP + %s * interval '1 second'
+                       FROM claimable
+                       WHERE EVENT_BY_CORP_FILING.RECORD_ID = claimable.RECORD_ID
+                       RETURNING EVENT_BY_CORP_FILING.RECORD_ID, 
+                                 EVENT_BY_CORP_FILING.SYSTEM_TYPE_CD, 
+                                 EVENT_BY_CORP_FILING.PREV_EVENT_ID, 
+                                 EVENT_BY_CORP_FILING.PREV_EVENT_DATE, 
+                                 EVENT_BY_CORP_FILING.LAST_EVENT_ID, 
+                                 EVENT_BY_CORP_FILING.LAST_EVENT_DATE, 
+                                 EVENT_BY_CORP_FILING.CORP_NUM, 
+                                 EVENT_BY_CORP_FILING.ENTRY_DATE;"""
+        conn = conn if conn is not None else self.conn
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(sql_lock, (system_type_cd,))
+            cur.execute(sql_claim.replace("!BS!", str(batch_size)), 
+                        (system_type_cd, after_record_id, self.worker_id, self.worker_id, self.worker_id, CORP_QUEUE_LEASE_SECONDS,))
+            rows = cur.fetchall()
+            conn.commit()
+            cur.close()
+            cur = None
+            return sorted(rows, key=lambda row: row[0])
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("EventProcessor exception updating DB: " + str(error))
+            raise
+        finally:
+            if cur is not None:
+                cur.close()
 
-        print(">>> in scope corp types:", corp_types)
-
+    # read the next batch of unprocessed events
+    def get_corp_event_batch(self, system_type_cd, batch_size, after_record_id=0, conn=None):
+        """
+        Returns (corps, specific_corps) for up to batch_size unprocessed rows (after after_record_id) from EVENT_BY_CORP_FILING.
+        In claim mode, rows are claimed with a lease so other workers skip them.
+        """
         sql1 = """SELECT RECORD_ID, 
                          SYSTEM_TYPE_CD, 
                          PREV_EVENT_ID, 
@@ -1743,11 +2132,314 @@ class EventProcessor:
                     FROM EVENT_BY_CORP_FILING 
                     WHERE SYSTEM_TYPE_CD = %s
                     AND PROCESS_DATE is null
+                    AND RECORD_ID > %s
                     ORDER BY RECORD_ID
                     LIMIT !BS!
                   )
                   ORDER BY RECORD_ID;"""
 
+        conn = conn if conn is not None else self.conn
+        corps = []
+        specific_corps = []
+        cur = None
+        try:
+            # sql1 = find unprocessed events from our local table EVENT_BY_CORP_FILING
+            if CORP_QUEUE_CLAIM:
+                rows = self.claim_corp_event_queue(system_type_cd, batch_size, after_record_id=after_record_id, conn=conn)
+            else:
+                cur = conn.cursor()
+                sql1e = sql1.replace("!BS!", str(batch_size))
+                cur.execute(sql1e, (system_type_cd,system_type_cd,after_record_id,))
+                rows = cur.fetchall()
+                cur.close()
+                cur = None
+            for row in rows:
+                # include the date(s) for the start and end events
+                corps.append({'RECORD_ID':row[0], 'SYSTEM_TYPE_CD':row[1], 'PREV_EVENT': event_dict(row[2], row[3]), 'LAST_EVENT': event_dict(row[4], row[5]), 
+                                'CORP_NUM':row[6], 'ENTRY_DATE':row[7]})
+                specific_corps.append(row[6])
+        except (Exception, psycopg2.DatabaseError) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("EventProcessor exception updating DB: " + str(error))
+            raise
+        finally:
+            if cur is not None:
+                cur.close()
+        return (corps, specific_corps)
+
+    # start a background worker to read and cache upcoming batches
+    def start_corp_batch_pipeline(self, system_type_cd, start_time, max_processing_time):
+        """
+        Batches are prefetched (read from the event queue and cached from BC Reg) on a single background thread, 
+        so each batch starts after the previous one's last RECORD_ID and the batches never overlap.
+        The prefetch uses its own connection to the event processor database.
+        """
+        params = config(section='event_processor')
+        return {
+            'system_type_cd': system_type_cd,
+            'conn': psycopg2.connect(**params),
+            'executor': ThreadPoolExecutor(max_workers=1),
+            'futures': deque(),
+            'after_record_id': 0,
+            'cancel': threading.Event(),
+            'deadline': start_time + max_processing_time,
+        }
+
+    # read and cache the next batch (runs on the pipeline's worker thread)
+    def prefetch_corp_batch(self, pipeline, batch_size):
+        batch = {'corps': [], 'specific_corps': [], 'bc_registries': None, 'error': None, 'read_time': 0, 'cache_time': 0}
+        if pipeline['cancel'].is_set():
+            return batch
+        read_start_time = time.perf_counter()
+        (batch['corps'], batch['specific_corps']) = self.get_corp_event_batch(pipeline['system_type_cd'], batch_size, 
+                                                        after_record_id=pipeline['after_record_id'], conn=pipeline['conn'])
+        # end the read transaction, so the connection isn't left idle in a transaction until the next batch
+        # (claims are already committed, and autocommit can't be used because the claim takes a transaction-level lock)
+        pipeline['conn'].commit()
+        batch['read_time'] = time.perf_counter() - read_start_time
+        if 0 == len(batch['corps']) or pipeline['cancel'].is_set():
+            return batch
+        pipeline['after_record_id'] = batch['corps'][-1]['RECORD_ID']
+        try:
+            cache_start_time = time.perf_counter()
+            batch['bc_registries'] = self.bc_reg_processor(pipeline['system_type_cd'], use_cache=True)
+            batch['bc_registries'].cache_bcreg_corps(batch['specific_corps'])
+            batch['cache_time'] = time.perf_counter() - cache_start_time
+        except (Exception, psycopg2.DatabaseError, psycopg2.DataError) as error:
+            # the error is handled when the batch is processed
+            batch['error'] = error
+        return batch
+
+    # keep up to CORP_BATCH_PREFETCH batches queued (unless we are out of time)
+    def fill_corp_batch_pipeline(self, pipeline, batch_size):
+        while len(pipeline['futures']) < CORP_BATCH_PREFETCH and time.perf_counter() < pipeline['deadline']:
+            pipeline['futures'].append(pipeline['executor'].submit(self.prefetch_corp_batch, pipeline, batch_size))
+
+    # wait for the next prefetched batch and queue up the one after it
+    def next_corp_batch(self, pipeline, batch_size):
+        self.fill_corp_batch_pipeline(pipeline, batch_size)
+        if 0 == len(pipeline['futures']):
+            return None
+        # (if reading the batch failed, the pipeline is stopped by the caller)
+        batch = pipeline['futures'].popleft().result()
+        if 0 < len(batch['corps']) and batch['error'] is None:
+            self.fill_corp_batch_pipeline(pipeline, batch_size)
+        return batch
+
+    # cancel any queued batches and wait for the worker to finish
+    def stop_corp_batch_pipeline(self, pipeline):
+        """
+        Prefetched batches that haven't been processed are dropped (their events are still unprocessed, 
+        so they are picked up by the next read of the queue), and their connections and caches are closed.
+        """
+        pipeline['cancel'].set()
+        for future in pipeline['futures']:
+            future.cancel()
+        pipeline['executor'].shutdown(wait=True)
+        for future in pipeline['futures']:
+            if future.cancelled() or future.exception() is not None:
+                continue
+            batch = future.result()
+            if batch['bc_registries'] is not None:
+                batch['bc_registries'].close()
+                batch['bc_registries'] = None
+        pipeline['futures'].clear()
+        pipeline['conn'].close()
+
+    # extend (or release) this worker's claims on events it hasn't processed yet
+    # (conn is the connection to use, so the update can be committed without committing any other work in progress)
+    def update_corp_event_claims(self, system_type_cd, release=False, conn=None):
+        if release:
+            sql = """UPDATE EVENT_BY_CORP_FILING
+                     SET CLAIM_ID = null, CLAIM_EXPIRY = null
+                     WHERE SYSTEM_TYPE_CD = %s AND CLAIM_ID = %s AND PROCESS_DATE is null"""
+            params = (system_type_cd, self.worker_id,)
+        else:
+            sql = """UPDATE EVENT_BY_CORP_FILING
+                     SET CLAIM_EXPIRY = LOCALTIMESTAMP + %s * interval '1 second'
+                     WHERE SYSTEM_TYPE_CD = %s AND CLAIM_ID = %s AND PROCESS_DATE is null"""
+            params = (CORP_QUEUE_LEASE_SECONDS, system_type_cd, self.worker_id,)
+        conn = conn if conn is not None else self.conn
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            conn.commit()
+            cur.close()
+            cur = None
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("EventProcessor exception updating DB: " + str(error))
+            raise
+        finally:
+            if cur is not None:
+                cur.close()
+
+    # content hash of a corp's data (ignores when the data was loaded, includes the credential versions we generate)
+    # the number of effective (past) events is included, so the hash changes when a deferred future event becomes effective
+    # (for the same data the events are in the same order, so the count determines which events are effective)
+    def corp_info_hash(self, corp_info, effective_event_count):
+        corp_doc = {key: value for key, value in corp_info.items() if key != 'current_date'}
+        corp_doc_json = json.dumps([corp_version, addr_version, dba_version, effective_event_count, corp_doc], cls=CustomJsonEncoder, sort_keys=True)
+        return hashlib.sha256(corp_doc_json.encode('utf-8')).hexdigest()
+
+    # content hash and status of the latest history record for each corp, as {corp_num: (hash, process_success)}
+    def get_last_corp_hashes(self, system_type_cd, corp_nums):
+        sql = """SELECT DISTINCT ON (CORP_NUM) CORP_NUM, CORP_JSON_HASH, PROCESS_SUCCESS
+                 FROM CORP_HISTORY_LOG
+                 WHERE SYSTEM_TYPE_CD = %s
+                 AND CORP_NUM = ANY(%s)
+                 ORDER BY CORP_NUM, RECORD_ID DESC"""
+        corp_hashes = {}
+        cur = None
+        try:
+            cur = self.conn.cursor()
+            cur.execute(sql, (system_type_cd, list(corp_nums),))
+            for row in cur.fetchall():
+                corp_hashes[row[0]] = (row[1], row[2])
+            cur.close()
+            cur = None
+        except (Exception, psycopg2.DatabaseError) as error:
+            LOGGER.error(error)
+            LOGGER.error(traceback.print_exc())
+            log_error("EventProcessor exception reading DB: " + str(error))
+            raise
+        finally:
+            if cur is not None:
+                cur.close()
+        return corp_hashes
+
+    # load a corp's data for processing, and work out which of its events we can generate credentials for
+    # returns a dict of the corp's data and processing state (process_success is False if the data couldn't be loaded)
+    def load_corp_for_processing(self, corp, bc_registries, lear_processor, system_type_cd, load_regs, generate_creds, 
+                                 corp_types, other_in_scope_corps, last_corp_hashes, timings):
+        loaded = {'process_success': True, 'process_msg': None, 'corp_info': None, 'corp_info_json': None, 'corp_json_hash': None, 
+                  'corp_in_scope': False, 'corp_in_scope_other': False, 'prev_event_json': None, 'last_event_json': None, 
+                  'effective_events': [], 'future_events': [], 'corp_active_state': None, 'withdrawn_corp': False, 
+                  'unchanged_corp': False, 'corp_creds_future': None}
+
+        # check if we need to load BC Reg data (we need to do this if we are running from the event list)
+        if load_regs:
+            try:
+                # fetch corp info from bc_registries
+                stage_start = time.perf_counter()
+                corp_info = bc_registries.get_bc_reg_corp_info(corp['CORP_NUM'])
+                stage_start = timings.record('get_bc_reg_corp_info', stage_start)
+
+                # for BC_REG, lookup all relationships in LEAR
+                if system_type_cd == system_type:
+                    corp_info = lear_processor.get_lear_relationship_info(corp_info)
+                    stage_start = timings.record('get_lear_relationship_info', stage_start)
+                loaded['corp_info'] = corp_info
+
+                if corp_info['corp_typ_cd'] in corp_types:
+                    # the following is COLIN-specific processing
+                    if system_type_cd == system_type:
+                        # get event summary
+                        effective_recs = self.corp_unique_record_list(corp['CORP_NUM'], corp_info)
+                        corp_info['reg_summary'] = effective_recs
+                        timings.record('corp_unique_record_list', stage_start)
+
+                    loaded['corp_info_json'] = bc_registries.to_json(corp_info)
+                    loaded['corp_in_scope'] = True
+                elif corp_info['corp_typ_cd'] in other_in_scope_corps:
+                    loaded['corp_in_scope_other'] = True
+
+                loaded['prev_event_json'] = event_json(corp['PREV_EVENT'])
+                loaded['last_event_json'] = event_json(corp['LAST_EVENT'])
+            except (Exception, psycopg2.DatabaseError) as error:
+                LOGGER.error(error)
+                LOGGER.error(traceback.print_exc())
+                loaded['process_success'] = False
+                loaded['process_msg'] = str(error)
+                #raise
+        else:
+            # json blob is cached in event processor database
+            corp_info = corp['CORP_JSON']
+            loaded['corp_info'] = corp_info
+            loaded['corp_info_json'] = bc_registries.to_json(corp_info)
+            loaded['prev_event_json'] = corp['PREV_EVENT']
+            loaded['last_event_json'] = corp['LAST_EVENT']
+            if corp_info['corp_typ_cd'] is None or corp_info['corp_typ_cd'] == '':
+                LOGGER.error(f"Error no corp_type: {loaded['corp_info_json']}")
+            elif corp_info['corp_typ_cd'] in corp_types:
+                loaded['corp_in_scope'] = True
+            elif corp_info['corp_typ_cd'] in other_in_scope_corps:
+                loaded['corp_in_scope_other'] = True
+
+        if loaded['corp_in_scope'] and loaded['process_success']:
+            # get events - only generate credentials for events in the past
+            # for future-effective events (if any) we defer to the next processing cycle
+            (effective_events, future_events) = self.current_and_future_corp_events(corp['SYSTEM_TYPE_CD'], corp['CORP_NUM'], corp_info)
+
+            corp_active_state = self.get_corp_active_state(corp['SYSTEM_TYPE_CD'], corp_info)
+
+            # if corporation is "withdrawn" then don't create any events
+            withdrawn_corp = (corp_active_state is not None) and ('state_typ_cd' in corp_active_state) and (corp_active_state['state_typ_cd'] == CORP_WITHDRAWN_STATE)
+            if withdrawn_corp:
+                # setting these to empty arrays will force a status update with no creds generated
+                effective_events = []
+                future_events = []
+
+            loaded['effective_events'] = effective_events
+            loaded['future_events'] = future_events
+            loaded['corp_active_state'] = corp_active_state
+            loaded['withdrawn_corp'] = withdrawn_corp
+
+            if load_regs:
+                loaded['corp_json_hash'] = self.corp_info_hash(corp_info, len(effective_events))
+
+            if generate_creds:
+                # no need to re-generate if the corp data is the same as the last time we successfully processed it
+                # (unless there are future events, which depend on when the data was loaded - once they are effective the 
+                # hash changes, so the corp is re-generated when it is re-queued for them)
+                loaded['unchanged_corp'] = (loaded['corp_json_hash'] is not None and 0 == len(future_events) and 
+                                            last_corp_hashes.get(corp['CORP_NUM']) == (loaded['corp_json_hash'], 'Y'))
+        return loaded
+
+    # load each corp for processing, returns (corp, loaded corp data) in the order of the list of corps
+    # with a generation pool, corps are loaded up to CORP_CREDS_LOOKAHEAD ahead of the one returned, and their credentials
+    # generated in the pool in the meantime (the future is returned in loaded['corp_creds_future'])
+    def load_corps_for_processing(self, corps, bc_registries, lear_processor, system_type_cd, load_regs, generate_creds, 
+                                  corp_types, other_in_scope_corps, last_corp_hashes, generation_pool, timings):
+        loaded_corps = deque()
+        try:
+            for corp in corps:
+                loaded = self.load_corp_for_processing(corp, bc_registries, lear_processor, system_type_cd, load_regs, generate_creds, 
+                                                       corp_types, other_in_scope_corps, last_corp_hashes, timings)
+                if generation_pool is None:
+                    yield (corp, loaded)
+                    continue
+                if generate_creds and loaded['corp_in_scope'] and loaded['process_success'] and 0 < len(loaded['effective_events']) and not loaded['unchanged_corp']:
+                    loaded['corp_creds_future'] = generation_pool.submit(generate_corp_credentials, corp['SYSTEM_TYPE_CD'], 
+                                                                         corp['PREV_EVENT'], corp['LAST_EVENT'], corp['CORP_NUM'], loaded['corp_info'])
+                loaded_corps.append((corp, loaded))
+                if CORP_CREDS_LOOKAHEAD <= len(loaded_corps):
+                    yield loaded_corps.popleft()
+            while 0 < len(loaded_corps):
+                yield loaded_corps.popleft()
+        finally:
+            # if processing stopped part way through the batch, we don't need the rest of the credentials
+            for (corp, loaded) in loaded_corps:
+                if loaded['corp_creds_future'] is not None:
+                    loaded['corp_creds_future'].cancel()
+
+    # process corps that have been queued - update data from bc_registries
+    def process_corp_event_queue_internal(self, system_type_cd, load_regs=True, generate_creds=False, use_cache=False, corp_types=CORP_TYPES_IN_SCOPE):
+        """
+        The main process for loading BC Reg data and producing credentials.
+        This process takes unprocessed events from the EVENT_BY_CORP_FILING table, and for each corp_num:
+           - if load_regs: loads data from BC Reg for that corp (stores in CORP_HISTORY_LOG)
+           - if generate_creds: produces credentials (stores in CREDENTIAL_LOG)
+        Credentials are submitted to TOB via the agent using a separate process.
+        If use_cache is True, BC Reg data is cached into a local in-memory sqlite database prior to generating credentials.
+        """
+
+        print(">>> in scope corp types:", corp_types)
+
         sql1a = """SELECT RECORD_ID, 
                           SYSTEM_TYPE_CD, 
                           PREV_EVENT, 
@@ -1768,20 +2460,13 @@ class EventProcessor:
                    )
                    ORDER BY RECORD_ID;"""
 
-        sql2 = """INSERT INTO CORP_HISTORY_LOG (SYSTEM_TYPE_CD, PREV_EVENT, LAST_EVENT, CORP_NUM, CORP_STATE, CORP_JSON, ENTRY_DATE)
-                  VALUES(%s, %s, %s, %s, %s, %s, %s) RETURNING RECORD_ID;"""
-        sql2a = """INSERT INTO CORP_HISTORY_LOG (SYSTEM_TYPE_CD, PREV_EVENT, LAST_EVENT, CORP_NUM, CORP_STATE, CORP_JSON, ENTRY_DATE, PROCESS_DATE, PROCESS_SUCCESS, PROCESS_MSG)
-                  VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING RECORD_ID;"""
+        sql2 = """INSERT INTO CORP_HISTORY_LOG (SYSTEM_TYPE_CD, PREV_EVENT, LAST_EVENT, CORP_NUM, CORP_STATE, CORP_JSON, CORP_JSON_HASH, ENTRY_DATE)
+                  VALUES(%s, %s, %s, %s, %s, %s, %s, %s) RETURNING RECORD_ID;"""
+        sql2a = """INSERT INTO CORP_HISTORY_LOG (SYSTEM_TYPE_CD, PREV_EVENT, LAST_EVENT, CORP_NUM, CORP_STATE, CORP_JSON, CORP_JSON_HASH, ENTRY_DATE, PROCESS_DATE, PROCESS_SUCCESS, PROCESS_MSG)
+                  VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING RECORD_ID;"""
         sql2b = """INSERT INTO EVENT_BY_CORP_FILING (SYSTEM_TYPE_CD, PREV_EVENT_ID, PREV_EVENT_DATE, LAST_EVENT_ID, LAST_EVENT_DATE, CORP_NUM, ENTRY_DATE)
                  VALUES(%s, %s, %s, %s, %s, %s, %s) RETURNING RECORD_ID;"""
 
-        sql3 = """UPDATE EVENT_BY_CORP_FILING
-                  SET PROCESS_DATE = %s, PROCESS_SUCCESS = %s, PROCESS_MSG = %s
-                  WHERE RECORD_ID = %s"""
-        sql3a = """UPDATE CORP_HISTORY_LOG
-                  SET PROCESS_DATE = %s, PROCESS_SUCCESS = %s, PROCESS_MSG = %s
-                  WHERE RECORD_ID = %s"""
-
         # get max event for "other" system in case we need to re-direct an company for processing
         (other_max_event_date, other_max_event_id) = self.get_max_event_for_other_system_type(system_type_cd)
         other_in_scope_corps = self.get_in_scope_corps_for_other_system_type(system_type_cd)
@@ -1791,305 +2476,414 @@ class EventProcessor:
         processing_time = 0
         max_processing_time = 10 * 60
         continue_loop = True
-        max_batch_size = CORP_BATCH_SIZE
+        batch_sizer = CorpBatchSizer()
+        max_batch_size = batch_sizer.batch_size
+        timings = StageTimings('process_corp_event_queue', system_type_cd=system_type_cd, load_regs=load_regs, generate_creds=generate_creds)
         use_cache_param = use_cache
-        while continue_loop and processing_time < max_processing_time:
-            corps = []
-            specific_corps = []
-
-            # load data from BC Registries for the corporations we need to process (max of 3000 per chunk)
-            # this data may be pulled directly, or pulled from a "cache" in the event processor database
-            if load_regs:
-                try:
+        pipeline = None
+        generation_pool = None
+        claims_conn = None
+        # (the pipeline, generation pool and claims are cleaned up even if processing fails, so no more events are claimed
+        # in the background and our claims can be picked up by other workers)
+        try:
+            if load_regs and CORP_QUEUE_CLAIM:
+                # leases are renewed on their own connection, so renewing them doesn't commit (or roll back) a group part way through
+                claims_conn = psycopg2.connect(**config(section='event_processor'))
+            if generate_creds and 0 < CORP_CREDS_WORKERS:
+                # generate credentials in worker processes, while this process does the database work
+                generation_pool = start_credential_generation_pool()
+            if load_regs and use_cache and 0 < CORP_BATCH_PREFETCH:
+                # read and cache the next batch(es) in the background while we process the current one
+                pipeline = self.start_corp_batch_pipeline(system_type_cd, start_time, max_processing_time)
+            while continue_loop and processing_time < max_processing_time:
+                corps = []
+                specific_corps = []
+                prefetched = None
+                stage_start = time.perf_counter()
+
+                # load data from BC Registries for the corporations we need to process (max of 3000 per chunk)
+                # this data may be pulled directly, or pulled from a "cache" in the event processor database
+                if pipeline is not None:
+                    # the batch has been read and cached by the pipeline worker
+                    prefetched = self.next_corp_batch(pipeline, max_batch_size)
+                    if prefetched is not None:
+                        corps = prefetched['corps']
+                        specific_corps = prefetched['specific_corps']
+                elif load_regs:
                     # we are loading data from BC Registries based on the corp event queue
-                    # sql1 = find unprocessed events from our local table EVENT_BY_CORP_FILING
-                    cur = self.conn.cursor()
-                    sql1e = sql1.replace("!BS!", str(max_batch_size))
-                    cur.execute(sql1e, (system_type_cd,system_type_cd,))
-                    row = cur.fetchone()
-                    while row is not None:
-                        # include the date(s) for the start and end events
-                        corps.append({'RECORD_ID':row[0], 'SYSTEM_TYPE_CD':row[1], 'PREV_EVENT': event_dict(row[2], row[3]), 'LAST_EVENT': event_dict(row[4], row[5]), 
-                                        'CORP_NUM':row[6], 'ENTRY_DATE':row[7]})
-                        specific_corps.append(row[6])
-                        row = cur.fetchone()
-                    cur.close()
-                    cur = None
-                except (Exception, psycopg2.DatabaseError) as error:
-                    LOGGER.error(error)
-                    LOGGER.error(traceback.print_exc())
-                    log_error("EventProcessor exception updating DB: " + str(error))
-                    raise
-                finally:
-                    if cur is not None:
-                        cur.close()
-            else:
-                try:
-                    # not loading from BC Reg, just processing data already loaded in corp_history
-                    # sql1a = load staged corp data from local table CORP_HISTORY_LOG
-                    cur = self.conn.cursor()
-                    sql1ae = sql1a.replace("!BS!", str(max_batch_size))
-                    # print(">>> executing with:", system_type_cd, sql1ae)
-                    cur.execute(sql1ae, (system_type_cd,system_type_cd,))
-                    row = cur.fetchone()
-                    while row is not None:
-                        # includes the date(s) for the start and end events
-                        corps.append({'RECORD_ID':row[0], 'SYSTEM_TYPE_CD':row[1], 'PREV_EVENT':row[2], 'LAST_EVENT':row[3], 
-                                    'CORP_NUM':row[4], 'CORP_JSON':row[5], 'ENTRY_DATE':row[6]})
-                        specific_corps.append(row[4])
+                    (corps, specific_corps) = self.get_corp_event_batch(system_type_cd, max_batch_size)
+                else:
+                    try:
+                        # not loading from BC Reg, just processing data already loaded in corp_history
+                        # sql1a = load staged corp data from local table CORP_HISTORY_LOG
+                        cur = self.conn.cursor()
+                        sql1ae = sql1a.replace("!BS!", str(max_batch_size))
+                        # print(">>> executing with:", system_type_cd, sql1ae)
+                        cur.execute(sql1ae, (system_type_cd,system_type_cd,))
                         row = cur.fetchone()
-                    cur.close()
-                    cur = None
-                except (Exception, psycopg2.DatabaseError) as error:
-                    LOGGER.error(error)
-                    LOGGER.error(traceback.print_exc())
-                    log_error("EventProcessor exception updating DB: " + str(error))
-                    raise
-                finally:
-                    if cur is not None:
+                        while row is not None:
+                            # includes the date(s) for the start and end events
+                            corps.append({'RECORD_ID':row[0], 'SYSTEM_TYPE_CD':row[1], 'PREV_EVENT':row[2], 'LAST_EVENT':row[3], 
+                                        'CORP_NUM':row[4], 'CORP_JSON':row[5], 'ENTRY_DATE':row[6]})
+                            specific_corps.append(row[4])
+                            row = cur.fetchone()
                         cur.close()
+                        cur = None
+                    except (Exception, psycopg2.DatabaseError) as error:
+                        LOGGER.error(error)
+                        LOGGER.error(traceback.print_exc())
+                        log_error("EventProcessor exception updating DB: " + str(error))
+                        raise
+                    finally:
+                        if cur is not None:
+                            cur.close()
 
-            # at this point specific corps will be either:
-            #   - a list of corps from the event table EVENT_BY_CORP_FILING
-            #   - a list of corp data from the corp history table CORP_HISTORY_LOG
-            if len(specific_corps) == 0:
-                continue_loop = False
-            else:
-                saved_creds = 0
-                force_continue = False
-                # now generate credentials from the corporate data
-                # with BCRegistries(use_cache) as bc_registries:
-                with self.bc_reg_processor(system_type_cd, use_cache=use_cache) as bc_registries:
-                    # for BC_REG, we need to do LEAR queries as well
-                    if system_type_cd == system_type:
-                        lear_processor = self.bc_reg_processor(lear_system_type, use_cache=use_cache)
+                if prefetched is not None:
+                    # time spent reading the queue on the pipeline thread, and waiting for the pipeline on this thread
+                    timings.record_seconds('queue_read', prefetched['read_time'])
+                    timings.record('queue_wait', stage_start)
+                else:
+                    timings.record('queue_read', stage_start)
+
+                # at this point specific corps will be either:
+                #   - a list of corps from the event table EVENT_BY_CORP_FILING
+                #   - a list of corp data from the corp history table CORP_HISTORY_LOG
+                if len(specific_corps) == 0:
+                    continue_loop = False
+                else:
+                    saved_creds = 0
+                    force_continue = False
+                    # now generate credentials from the corporate data
+                    # with BCRegistries(use_cache) as bc_registries:
+                    batch_start_time = time.perf_counter()
+                    cache_time = 0
+                    if prefetched is not None and prefetched['bc_registries'] is not None:
+                        bc_processor = prefetched['bc_registries']
                     else:
-                        lear_processor = None
-                    if use_cache:
-                        try:
-                            # cache BC Reg data into local in-memory sqlite database (for performance)
-                            bc_registries.cache_bcreg_corps(specific_corps)
-                            # for BC_REG, cache all the LEAR tables as well (so we can lookup relationships)
-                            if system_type_cd == system_type:
-                                lear_processor.cache_bcreg_corps(specific_corps)
-                        except (Exception, psycopg2.DatabaseError, psycopg2.DataError) as error:
-                            # raises a SQL error if error during caching
-                            LOGGER.error(error)
-                            LOGGER.error(traceback.print_exc())
-                            force_continue = True
-                            if max_batch_size == CORP_BATCH_SIZE:
-                                LOGGER.error("Error during caching operation, switching to smaller cache size")
-                                corps = []
-                                max_batch_size = FALLBACK_CORP_BATCH_SIZE
-                            else:
-                                LOGGER.error("Error during caching operation, switching to non-cached mode")
-                                corps = []
-                                use_cache = False
-
-                    # process each corp in our list
-                    for i,corp in enumerate(corps): 
-                        process_success = True
-                        process_msg = None
-                        corp_in_scope = False
-                        corp_in_scope_other = False
-                        if (i % 100 == 0) or (i+1 == len(corps)):
-                            processing_time = time.perf_counter() - start_time
-                            print('Processing: ' + str(processing_time))
-                            print('>>> Processing ' + str(i+1) + ' of ' + str(len(corps)) + ' corporations. ')
-
-                        # check if we need to load BC Reg data (we need to do this if we are running from the event list)
-                        if load_regs:
+                        bc_processor = self.bc_reg_processor(system_type_cd, use_cache=use_cache)
+                    with bc_processor as bc_registries:
+                        # for BC_REG, we need to do LEAR queries as well
+                        # (using the same connections and cache, bc_registries caches the LEAR data along with the BC Reg data)
+                        if system_type_cd == system_type:
+                            lear_processor = self.bc_reg_processor(lear_system_type, use_cache=use_cache, shared_with=bc_registries)
+                        else:
+                            lear_processor = None
+                        if use_cache:
                             try:
-                                # fetch corp info from bc_registries
-                                corp_info = bc_registries.get_bc_reg_corp_info(corp['CORP_NUM'])
-
-                                # for BC_REG, lookup all relationships in LEAR
-                                if system_type_cd == system_type:
-                                    corp_info = lear_processor.get_lear_relationship_info(corp_info)
-
-                                if corp_info['corp_typ_cd'] in corp_types:
-                                    # the following is COLIN-specific processing
-                                    if system_type_cd == system_type:
-                                        # get event summary
-                                        effective_recs = self.corp_unique_record_list(corp['CORP_NUM'], corp_info)
-                                        corp_info['reg_summary'] = effective_recs
-
-                                    corp_info_json = bc_registries.to_json(corp_info)
-                                    corp_in_scope = True
-                                elif corp_info['corp_typ_cd'] in other_in_scope_corps:
-                                    corp_in_scope_other = True
-
-                                prev_event_json = event_json(corp['PREV_EVENT'])
-                                last_event_json = event_json(corp['LAST_EVENT'])
-                            except (Exception, psycopg2.DatabaseError) as error:
+                                # cache BC Reg data into local in-memory sqlite database (for performance)
+                                # (for BC_REG, this includes all the LEAR tables as well, so we can lookup relationships)
+                                if prefetched is None:
+                                    bc_registries.cache_bcreg_corps(specific_corps)
+                                    cache_time = time.perf_counter() - batch_start_time
+                                elif prefetched['error'] is not None:
+                                    raise prefetched['error']
+                                else:
+                                    cache_time = prefetched['cache_time']
+                                timings.record_seconds('cache_load', cache_time)
+                                for (cache_table, cache_table_time) in bc_registries.cache_load_times.items():
+                                    timings.record_seconds('cache_load.' + cache_table, cache_table_time)
+                                bc_registries.cache_load_times = {}
+                            except (Exception, psycopg2.DatabaseError, psycopg2.DataError) as error:
+                                # raises a SQL error if error during caching
                                 LOGGER.error(error)
                                 LOGGER.error(traceback.print_exc())
-                                process_success = False
-                                process_msg = str(error)
-                                #raise
+                                force_continue = True
+                                if pipeline is not None:
+                                    # drop the prefetched batches, and carry on reading the queue in serial mode
+                                    self.stop_corp_batch_pipeline(pipeline)
+                                    pipeline = None
+                                if batch_sizer.cache_failed():
+                                    LOGGER.error("Error during caching operation, switching to smaller cache size")
+                                    corps = []
+                                    max_batch_size = batch_sizer.batch_size
+                                else:
+                                    LOGGER.error("Error during caching operation, switching to non-cached mode")
+                                    corps = []
+                                    use_cache = False
+                        elif system_type_cd == system_type:
+                            try:
+                                # not caching, so pre-load the data for the batch (avoids a query per event)
+                                stage_start = time.perf_counter()
+                                if COLIN_CORP_JSON_AGG:
+                                    bc_registries.preload_corp_info(specific_corps)
+                                else:
+                                    bc_registries.preload_corp_events(specific_corps)
+                                timings.record('preload', stage_start)
+                            except (Exception, psycopg2.DatabaseError, psycopg2.DataError) as error:
+                                # not fatal, corp data will be queried individually
+                                LOGGER.error(error)
+                                LOGGER.error(traceback.print_exc())
+                                bc_registries.preloaded_events = {}
+                                bc_registries.preloaded_corps = {}
+
+                        # process each corp in our list
+                        # (in group commit mode, each corp's writes are wrapped in a savepoint and committed in chunks)
+                        # (status updates for EVENT_BY_CORP_FILING and CORP_HISTORY_LOG are applied in bulk when we commit)
+                        group_commit = 1 < CORP_STATUS_COMMIT_SIZE
+                        pending_commits = 0
+                        event_outcomes = []
+                        history_outcomes = []
+                        # content hashes of the corps' last processed data, to skip corps that haven't changed
+                        if load_regs and generate_creds and SKIP_UNCHANGED_CORPS:
+                            last_corp_hashes = self.get_last_corp_hashes(system_type_cd, set(specific_corps))
                         else:
-                            # json blob is cached in event processor database
-                            corp_info = corp['CORP_JSON']
-                            corp_info_json = bc_registries.to_json(corp_info)
-                            prev_event_json = corp['PREV_EVENT']
-                            last_event_json = corp['LAST_EVENT']
-                            if corp_info['corp_typ_cd'] is null or corp_info['corp_typ_cd'] == '':
-                                LOGGER.error(f"Error no corp_type: {corp_info_json}")
-                            elif corp_info['corp_typ_cd'] in corp_types:
-                                corp_in_scope = True
-                            elif corp_info['corp_typ_cd'] in other_in_scope_corps:
-                                corp_in_scope_other = True
-
-                        # at this point we have all the corp data, now generate credentials
-                        if corp_in_scope and process_success:
-                            # get events - only generate credentials for events in the past
-                            # for future-effective events (if any) we defer to the next processing cycle
-                            (effective_events, future_events) = self.current_and_future_corp_events(corp['SYSTEM_TYPE_CD'], corp['CORP_NUM'], corp_info)
-
-                            corp_active_state = self.get_corp_active_state(corp['SYSTEM_TYPE_CD'], corp_info)
-
-                            # if corporation is "withdrawn" then don't create any events
-                            withdrawn_corp = (corp_active_state is not None) and ('state_typ_cd' in corp_active_state) and (corp_active_state['state_typ_cd'] == CORP_WITHDRAWN_STATE)
-                            if withdrawn_corp:
-                                # setting these to empty arrays will force a status update with no creds generated
-                                effective_events = []
-                                future_events = []
-
-                            # check if we are generating credentials (vs just pre-loading BC Reg data)
-                            if generate_creds:
-                                corp_creds = []
-                                if 0 < len(effective_events):
-                                    try:
-                                        # generate and store credentials
-                                        #LOGGER.info(" >>> Generate credentials for corp", corp['CORP_NUM'])
-                                        corp_creds = self.generate_credentials(corp['SYSTEM_TYPE_CD'], corp['PREV_EVENT'], corp['LAST_EVENT'], corp['CORP_NUM'], corp_info)
-                                        if len(corp_creds) > 0:
-                                            cur = self.conn.cursor()
-                                            if corp_active_state and 'op_state_typ_cd' in corp_active_state:
-                                                op_state_typ_cd = corp_active_state['op_state_typ_cd']
+                            last_corp_hashes = {}
+                        # corps are loaded (and, with a generation pool, their credentials generated) ahead of the status updates below
+                        corp_loads = self.load_corps_for_processing(corps, bc_registries, lear_processor, system_type_cd, load_regs, generate_creds, 
+                                                                    corp_types, other_in_scope_corps, last_corp_hashes, generation_pool, timings)
+                        for i, (corp, loaded) in enumerate(corp_loads): 
+                            process_success = loaded['process_success']
+                            process_msg = loaded['process_msg']
+                            corp_info = loaded['corp_info']
+                            corp_info_json = loaded['corp_info_json']
+                            corp_json_hash = loaded['corp_json_hash']
+                            corp_in_scope = loaded['corp_in_scope']
+                            corp_in_scope_other = loaded['corp_in_scope_other']
+                            prev_event_json = loaded['prev_event_json']
+                            last_event_json = loaded['last_event_json']
+                            if (i % 100 == 0) or (i+1 == len(corps)):
+                                processing_time = time.perf_counter() - start_time
+                                print('Processing: ' + str(processing_time))
+                                print('>>> Processing ' + str(i+1) + ' of ' + str(len(corps)) + ' corporations. ')
+                                # keep our claims alive while we work through the batch
+                                if claims_conn is not None and 0 < i:
+                                    self.update_corp_event_claims(system_type_cd, conn=claims_conn)
+                            if group_commit:
+                                cur = self.conn.cursor()
+                                cur.execute("savepoint corp_status")
+                                cur.close()
+                                cur = None
+
+                            # (in group commit mode, an error writing this corp's data only undoes this corp's writes, and is recorded as its outcome)
+                            event_outcomes_len = len(event_outcomes)
+                            history_outcomes_len = len(history_outcomes)
+                            try:
+                                # at this point we have all the corp data, now generate credentials
+                                if corp_in_scope and process_success:
+                                    # (only credentials for events in the past are generated, future-effective events are deferred)
+                                    effective_events = loaded['effective_events']
+                                    future_events = loaded['future_events']
+                                    corp_active_state = loaded['corp_active_state']
+                                    withdrawn_corp = loaded['withdrawn_corp']
+
+                                    # check if we are generating credentials (vs just pre-loading BC Reg data)
+                                    if generate_creds:
+                                        corp_creds = []
+                                        unchanged_corp = loaded['unchanged_corp']
+                                        if 0 < len(effective_events) and not unchanged_corp:
+                                            try:
+                                                # generate and store credentials
+                                                #LOGGER.info(" >>> Generate credentials for corp", corp['CORP_NUM'])
+                                                stage_start = time.perf_counter()
+                                                if loaded['corp_creds_future'] is not None:
+                                                    # generated in the pool, returns (credentials, generation time)
+                                                    (corp_creds, generation_time) = loaded['corp_creds_future'].result()
+                                                    timings.record_seconds('generate_credentials', generation_time)
+                                                    stage_start = timings.record('generate_credentials_wait', stage_start)
+                                                else:
+                                                    corp_creds = self.generate_credentials(corp['SYSTEM_TYPE_CD'], corp['PREV_EVENT'], corp['LAST_EVENT'], corp['CORP_NUM'], corp_info)
+                                                    stage_start = timings.record('generate_credentials', stage_start)
+                                                if len(corp_creds) > 0:
+                                                    cur = self.conn.cursor()
+                                                    if corp_active_state and 'op_state_typ_cd' in corp_active_state:
+                                                        op_state_typ_cd = corp_active_state['op_state_typ_cd']
+                                                    else:
+                                                        op_state_typ_cd = 'N/A'
+                                                    saved_creds = saved_creds + self.store_credentials(cur, corp['SYSTEM_TYPE_CD'], corp['PREV_EVENT'], corp['LAST_EVENT'], 
+                                                                            corp['CORP_NUM'], op_state_typ_cd, corp_info, corp_creds)
+                                                    cur.close()
+                                                    cur = None
+                                                    timings.record('store_credentials', stage_start)
+                                            except (Exception, psycopg2.DatabaseError) as error:
+                                                LOGGER.error(error)
+                                                LOGGER.error(traceback.print_exc())
+                                                process_success = False
+                                                process_msg = str(error)
+                                                if group_commit:
+                                                    # undo this corp's writes only, the rest of the group is kept
+                                                    if cur is None:
+                                                        cur = self.conn.cursor()
+                                                    cur.execute("rollback to savepoint corp_status")
+                                                #raise
+                                            finally:
+                                                if cur is not None:
+                                                    cur.close()
+
+                                        # store corporate info 
+                                        if process_success:
+                                            flag = 'Y'
+                                            if withdrawn_corp:
+                                                res = 'Withdrawn'
+                                            elif unchanged_corp:
+                                                res = 'Unchanged'
                                             else:
-                                                op_state_typ_cd = 'N/A'
-                                            saved_creds = saved_creds + self.store_credentials(cur, corp['SYSTEM_TYPE_CD'], corp['PREV_EVENT'], corp['LAST_EVENT'], 
-                                                                    corp['CORP_NUM'], op_state_typ_cd, corp_info, corp_creds)
+                                                res = None
+                                        else:
+                                            flag = 'N'
+                                            if 255 < len(process_msg):
+                                                res = process_msg[:250] + '...'
+                                            else:
+                                                res = process_msg
+                                        if load_regs:
+                                            cur = self.conn.cursor()
+                                            if 0 < len(corp_creds) or 0 == len(future_events):
+                                                if corp_active_state and 'op_state_typ_cd' in corp_active_state:
+                                                    op_state_typ_cd = corp_active_state['op_state_typ_cd']
+                                                else:
+                                                    op_state_typ_cd = 'N/A'
+                                                cur.execute(sql2a, (corp['SYSTEM_TYPE_CD'], prev_event_json, last_event_json, corp['CORP_NUM'], 
+                                                                    op_state_typ_cd, corp_info_json, corp_json_hash, datetime.datetime.now(), datetime.datetime.now(), 
+                                                                    flag, res,))
+                                                if flag == 'N':
+                                                    log_warning('Event processing error:' + res)
                                             cur.close()
                                             cur = None
-                                    except (Exception, psycopg2.DatabaseError) as error:
-                                        LOGGER.error(error)
-                                        LOGGER.error(traceback.print_exc())
-                                        process_success = False
-                                        process_msg = str(error)
-                                        #raise
-                                    finally:
-                                        if cur is not None:
+                                        else:
+                                            # update process date
+                                            if 0 < len(corp_creds) or 0 == len(future_events):
+                                                history_outcomes.append((datetime.datetime.now(), flag, res, corp['RECORD_ID'], ))
+                                                if flag == 'N':
+                                                    log_warning('Event processing error:' + res)
+                                        if (0 < len(future_events)) and (0 < len(corp_creds) or load_regs):
+                                            # create another record to handle future events (will do a re-load)
+                                            future_events = sorted(future_events, key=lambda k: int(k['event_id']))
+                                            future_events = sorted(future_events, key=lambda k: k['effective_date'])
+                                            cur = self.conn.cursor()
+                                            cur.execute(sql2b, (corp['SYSTEM_TYPE_CD'], future_events[0]['event_id'], future_events[0]['event_timestmp'], 
+                                                                future_events[len(future_events)-1]['event_id'], future_events[len(future_events)-1]['effective_date'],  
+                                                                corp['CORP_NUM'], datetime.datetime.now(),))
                                             cur.close()
-
-                                # store corporate info 
+                                            cur = None
+                                    elif load_regs:
+                                        try:
+                                            # store corporate info for future generation of credentials
+                                            cur = self.conn.cursor()
+                                            cur.execute(sql2, (corp['SYSTEM_TYPE_CD'], prev_event_json, last_event_json, corp['CORP_NUM'], 
+                                                                corp_active_state['op_state_typ_cd'], corp_info_json, corp_json_hash, datetime.datetime.now(),))
+                                            cur.close()
+                                            cur = None
+                                        except (Exception, psycopg2.DatabaseError) as error:
+                                            LOGGER.error(error)
+                                            LOGGER.error(traceback.print_exc())
+                                            process_success = False
+                                            process_msg = str(error)
+                                            log_error("EventProcessor exception updating DB: " + str(error))
+                                            raise
+                                        finally:
+                                            if cur is not None:
+                                                cur.close()
+
+                                # update process date
+                                cur = self.conn.cursor()
                                 if process_success:
-                                    flag = 'Y'
-                                    if withdrawn_corp:
-                                        res = 'Withdrawn'
+                                    if corp_in_scope:
+                                        event_outcomes.append((datetime.datetime.now(), 'Y', corp_info['corp_typ_cd'], corp['RECORD_ID'], ))
                                     else:
-                                        res = None
+                                        if not corp_in_scope_other:
+                                            event_outcomes.append((datetime.datetime.now(), 'S', corp_info['corp_typ_cd'] + ": Skipped, not in scope", corp['RECORD_ID'], ))
+                                        else:
+                                            # add a record to trigger this company to process from the "in scope" source DB
+                                            use_system_type_cd = lear_system_type if corp['SYSTEM_TYPE_CD'] == system_type else system_type
+                                            if use_system_type_cd == system_type:
+                                                # for now just drop a "BC" prefx if we are processing from COLIN
+                                                use_corp_num = corp['CORP_NUM'][2:] if corp['CORP_NUM'].startswith("BC") else corp['CORP_NUM']
+                                            else:
+                                                use_corp_num = corp['CORP_NUM']
+                                            cur.execute(sql2b, (use_system_type_cd, 0, "0001-01-01",
+                                                                other_max_event_id, other_max_event_date,
+                                                                use_corp_num, datetime.datetime.now(),))
+                                            event_outcomes.append((datetime.datetime.now(), 'S', corp_info['corp_typ_cd'] + ": Skipped, requeue in " + use_system_type_cd, corp['RECORD_ID'], ))
                                 else:
-                                    flag = 'N'
                                     if 255 < len(process_msg):
                                         res = process_msg[:250] + '...'
                                     else:
                                         res = process_msg
-                                if load_regs:
-                                    cur = self.conn.cursor()
-                                    if 0 < len(corp_creds) or 0 == len(future_events):
-                                        if corp_active_state and 'op_state_typ_cd' in corp_active_state:
-                                            op_state_typ_cd = corp_active_state['op_state_typ_cd']
-                                        else:
-                                            op_state_typ_cd = 'N/A'
-                                        cur.execute(sql2a, (corp['SYSTEM_TYPE_CD'], prev_event_json, last_event_json, corp['CORP_NUM'], 
-                                                            op_state_typ_cd, corp_info_json, datetime.datetime.now(), datetime.datetime.now(), 
-                                                            flag, res,))
-                                        if flag == 'N':
-                                            log_warning('Event processing error:' + res)
+                                    event_outcomes.append((datetime.datetime.now(), 'N', res, corp['RECORD_ID'], ))
+                                cur.close()
+                                cur = None
+                            except (Exception, psycopg2.DatabaseError) as error:
+                                if not group_commit:
+                                    raise
+                                LOGGER.error(error)
+                                LOGGER.error(traceback.print_exc())
+                                log_error("EventProcessor exception updating DB: " + str(error))
+                                if cur is not None:
                                     cur.close()
-                                    cur = None
+                                cur = self.conn.cursor()
+                                cur.execute("rollback to savepoint corp_status")
+                                cur.close()
+                                cur = None
+                                # replace anything recorded for this corp with the error
+                                del event_outcomes[event_outcomes_len:]
+                                del history_outcomes[history_outcomes_len:]
+                                process_msg = str(error)
+                                if 255 < len(process_msg):
+                                    res = process_msg[:250] + '...'
                                 else:
-                                    # update process date
-                                    cur = self.conn.cursor()
-                                    if 0 < len(corp_creds) or 0 == len(future_events):
-                                        cur.execute(sql3a, (datetime.datetime.now(), flag, res, corp['RECORD_ID'], ))
-                                        if flag == 'N':
-                                            log_warning('Event processing error:' + res)
-                                    cur.close()
-                                    cur = None
-                                if (0 < len(future_events)) and (0 < len(corp_creds) or load_regs):
-                                    # create another record to handle future events (will do a re-load)
-                                    future_events = sorted(future_events, key=lambda k: int(k['event_id']))
-                                    future_events = sorted(future_events, key=lambda k: k['effective_date'])
-                                    cur = self.conn.cursor()
-                                    cur.execute(sql2b, (corp['SYSTEM_TYPE_CD'], future_events[0]['event_id'], future_events[0]['event_timestmp'], 
-                                                        future_events[len(future_events)-1]['event_id'], future_events[len(future_events)-1]['effective_date'],  
-                                                        corp['CORP_NUM'], datetime.datetime.now(),))
-                                    cur.close()
-                                    cur = None
-                            elif load_regs:
-                                try:
-                                    # store corporate info for future generation of credentials
-                                    cur = self.conn.cursor()
-                                    cur.execute(sql2, (corp['SYSTEM_TYPE_CD'], prev_event_json, last_event_json, corp['CORP_NUM'], 
-                                                        corp_active_state['op_state_typ_cd'], corp_info_json, datetime.datetime.now(),))
-                                    cur.close()
-                                    cur = None
-                                except (Exception, psycopg2.DatabaseError) as error:
-                                    LOGGER.error(error)
-                                    LOGGER.error(traceback.print_exc())
-                                    process_success = False
-                                    process_msg = str(error)
-                                    log_error("EventProcessor exception updating DB: " + str(error))
-                                    raise
-                                finally:
-                                    if cur is not None:
-                                        cur.close()
+                                    res = process_msg
+                                if not load_regs:
+                                    history_outcomes.append((datetime.datetime.now(), 'N', res, corp['RECORD_ID'], ))
+                                event_outcomes.append((datetime.datetime.now(), 'N', res, corp['RECORD_ID'], ))
+                            cur = self.conn.cursor()
+                            pending_commits = pending_commits + 1
+                            if group_commit:
+                                cur.execute("release savepoint corp_status")
+                            if CORP_STATUS_COMMIT_SIZE <= pending_commits:
+                                stage_start = time.perf_counter()
+                                update_process_status(cur, 'CORP_HISTORY_LOG', history_outcomes)
+                                update_process_status(cur, 'EVENT_BY_CORP_FILING', event_outcomes)
+                                self.conn.commit()
+                                timings.record('commit', stage_start)
+                                pending_commits = 0
+                                event_outcomes = []
+                                history_outcomes = []
+                            cur.close()
+                            cur = None
 
-                        # update process date
-                        cur = self.conn.cursor()
-                        if process_success:
-                            if corp_in_scope:
-                                cur.execute(sql3, (datetime.datetime.now(), 'Y', corp_info['corp_typ_cd'], corp['RECORD_ID'], ))
-                            else:
-                                if not corp_in_scope_other:
-                                    cur.execute(sql3, (datetime.datetime.now(), 'S', corp_info['corp_typ_cd'] + ": Skipped, not in scope", corp['RECORD_ID'], ))
-                                else:
-                                    # add a record to trigger this company to process from the "in scope" source DB
-                                    use_system_type_cd = lear_system_type if corp['SYSTEM_TYPE_CD'] == system_type else system_type
-                                    if use_system_type_cd == system_type:
-                                        # for now just drop a "BC" prefx if we are processing from COLIN
-                                        use_corp_num = corp['CORP_NUM'][2:] if corp['CORP_NUM'].startswith("BC") else corp['CORP_NUM']
-                                    else:
-                                        use_corp_num = corp['CORP_NUM']
-                                    cur.execute(sql2b, (use_system_type_cd, 0, "0001-01-01",
-                                                        other_max_event_id, other_max_event_date,
-                                                        use_corp_num, datetime.datetime.now(),))
-                                    cur.execute(sql3, (datetime.datetime.now(), 'S', corp_info['corp_typ_cd'] + ": Skipped, requeue in " + use_system_type_cd, corp['RECORD_ID'], ))
-                        else:
-                            if 255 < len(process_msg):
-                                res = process_msg[:250] + '...'
-                            else:
-                                res = process_msg
-                            cur.execute(sql3, (datetime.datetime.now(), 'N', res, corp['RECORD_ID'], ))
-                        self.conn.commit()
-                        cur.close()
-                        cur = None
+                        # commit the rest of the group
+                        if 0 < pending_commits:
+                            stage_start = time.perf_counter()
+                            cur = self.conn.cursor()
+                            update_process_status(cur, 'CORP_HISTORY_LOG', history_outcomes)
+                            update_process_status(cur, 'EVENT_BY_CORP_FILING', event_outcomes)
+                            self.conn.commit()
+                            timings.record('commit', stage_start)
+                            cur.close()
+                            cur = None
+                            pending_commits = 0
 
-                processing_time = time.perf_counter() - start_time
-                print('Processing: ' + str(processing_time))
+                    processing_time = time.perf_counter() - start_time
+                    print('Processing: ' + str(processing_time))
 
-                # if we are generating creds but didn't on the last loop, bail
-                if generate_creds and 0 == saved_creds and not force_continue:
-                    LOGGER.info("Didn't complete any activity this loop, so bail")
-                    continue_loop = False
+                    timings.write(corps=len(corps), batch_size=max_batch_size, use_cache=use_cache, 
+                                  batch_seconds=round(time.perf_counter() - batch_start_time, 3))
+
+                    # adjust the batch size based on how this batch went
+                    if len(corps) > 0:
+                        batch_sizer.batch_processed(len(corps), cache_time, time.perf_counter() - batch_start_time - cache_time)
+                        max_batch_size = batch_sizer.batch_size
 
-                # if we processed a set of corps in non-cached mode, try to switch back
-                if len(corps) > 0 and not use_cache:
-                    LOGGER.info("Restoring cache mode")
-                    use_cache = use_cache_param
+                    # if we are generating creds but didn't on the last loop, bail
+                    if generate_creds and 0 == saved_creds and not force_continue:
+                        LOGGER.info("Didn't complete any activity this loop, so bail")
+                        continue_loop = False
+
+                    # if we processed a set of corps in non-cached mode, try to switch back
+                    if len(corps) > 0 and not use_cache:
+                        LOGGER.info("Restoring cache mode")
+                        use_cache = use_cache_param
+        finally:
+            if pipeline is not None:
+                self.stop_corp_batch_pipeline(pipeline)
+            if generation_pool is not None:
+                generation_pool.shutdown()
+
+            # hand back any claims we didn't get to (e.g. if we ran out of time)
+            if claims_conn is not None:
+                try:
+                    self.update_corp_event_claims(system_type_cd, release=True, conn=claims_conn)
+                finally:
+                    claims_conn.close()
 
 
     # process corps that have been queued - update data from bc_registries
@@ -2126,10 +2920,6 @@ class EventProcessor:
                     AND hist.record_id = repo.corp_history_id
                   LIMIT !BS!;"""
 
-        sql3a = """UPDATE corp_cred_reprocess_log
-                  SET PROCESS_DATE = %s, PROCESS_SUCCESS = %s, PROCESS_MSG = %s
-                  WHERE RECORD_ID = %s"""
-
         # print(datetime.datetime.now(), "Generating credentials for", system_type_cd, credential_typ_cd, "...")
         cur = None
         i = 0
@@ -2155,9 +2945,16 @@ class EventProcessor:
 
                 # print(datetime.datetime.now(), "Processing " + str(len(corps)) + " orgs for credential " + system_type_cd + " " + credential_typ_cd)
                 saved_creds = 0
+                # status updates are applied in bulk when we commit
+                outcomes = []
                 for corp in corps:
                     corp_creds = []
                     process_success = True
+                    # each corp's writes are wrapped in a savepoint, so a failure doesn't lose the rest of the group
+                    cur = self.conn.cursor()
+                    cur.execute("savepoint corp_cred")
+                    cur.close()
+                    cur = None
                     try:
                         # generate and store credentials
                         corp_creds = self.generate_credentials_of_type(corp['SYSTEM_TYPE_CD'], corp['CREDENTIAL_TYPE_CD'], corp['CORP_NUM'], corp['CORP_JSON'])
@@ -2173,10 +2970,19 @@ class EventProcessor:
                         LOGGER.error(traceback.print_exc())
                         process_success = False
                         process_msg = str(error)
+                        # undo this corp's writes only, the rest of the group is kept
+                        if cur is None:
+                            cur = self.conn.cursor()
+                        cur.execute("rollback to savepoint corp_cred")
                         #raise
                     finally:
                         if cur is not None:
                             cur.close()
+                            cur = None
+                    cur = self.conn.cursor()
+                    cur.execute("release savepoint corp_cred")
+                    cur.close()
+                    cur = None
 
                     # store corporate info 
                     if process_success:
@@ -2193,18 +2999,28 @@ class EventProcessor:
                             res = process_msg
 
                     # update process date
-                    cur = self.conn.cursor()
-                    cur.execute(sql3a, (datetime.datetime.now(), flag, res, corp['RECORD_ID'], ))
+                    outcomes.append((datetime.datetime.now(), flag, res, corp['RECORD_ID'], ))
                     if flag == 'N':
                         log_warning('Event processing error:' + res)
-                    self.conn.commit()
-                    cur.close()
-                    cur = None
+                    if CORP_STATUS_COMMIT_SIZE <= len(outcomes):
+                        cur = self.conn.cursor()
+                        update_process_status(cur, 'CORP_CRED_REPROCESS_LOG', outcomes)
+                        self.conn.commit()
+                        cur.close()
+                        cur = None
+                        outcomes = []
 
                     i = i + 1
                     if 0 == (i % 10000):
                         print(datetime.datetime.now(), i)
 
+                if 0 < len(outcomes):
+                    cur = self.conn.cursor()
+                    update_process_status(cur, 'CORP_CRED_REPROCESS_LOG', outcomes)
+                    self.conn.commit()
+                    cur.close()
+                    cur = None
+
             except (Exception, psycopg2.DatabaseError) as error:
                 LOGGER.error(error)
                 LOGGER.error(traceback.print_exc())
@@ -2369,9 +3185,8 @@ class EventProcessor:
             cutoff_time = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
             cutoff_time_str = cutoff_time.strftime("%Y-%m-%dT%H:%M:%S")
             sql_corp_ct_processed = sql_corp_ct_processed + " and process_success != 'A'"
-            sql_corp_ct_processed = sql_corp_ct_processed + """ and (CREDENTIAL_JSON->>'expiry_date' = ''
-                or CREDENTIAL_JSON->>'expiry_date' is null
-                or CREDENTIAL_JSON->>'expiry_date' <= '""" + cutoff_time_str + """')"""
+            sql_corp_ct_processed = sql_corp_ct_processed + """ and (EXPIRY_DATE is null
+                or EXPIRY_DATE <= '""" + cutoff_time_str + """+00:00')"""
 
         sql = sql_ct_select + ' ' + table + ' ' + (sql_corp_ct_outstanding if unprocessed else sql_corp_ct_processed)
 
@@ -2426,3 +3241,25 @@ class EventProcessor:
             cursor = None
 
 
+# credential generator used by each worker process of the credential generation pool (doesn't connect to the database)
+CREDENTIAL_GENERATOR = None
+
+def init_credential_generator():
+    global CREDENTIAL_GENERATOR
+    # the worker is forked, so never collect (i.e. close) the parent's database connections it inherited
+    gc.freeze()
+    CREDENTIAL_GENERATOR = EventProcessor(connect=False)
+
+# generate a corp's credentials in a pool worker, returns (credentials, generation time)
+def generate_corp_credentials(system_type_cd, prev_event, last_event, corp_num, corp_info):
+    start_time = time.perf_counter()
+    corp_creds = CREDENTIAL_GENERATOR.generate_credentials(system_type_cd, prev_event, last_event, corp_num, corp_info)
+    return (corp_creds, time.perf_counter() - start_time)
+
+# workers are forked (the pipeline scripts can't be re-imported by spawned workers), so the pool must be started
+# before any other threads are started - the workers are all forked when the first task is submitted
+def start_credential_generation_pool():
+    generation_pool = ProcessPoolExecutor(max_workers=CORP_CREDS_WORKERS, mp_context=multiprocessing.get_context('fork'), 
+                                          initializer=init_credential_generator)
+    generation_pool.submit(int).result()
+    return generation_pool
@@ -56,6 +56,34 @@ def test_scenario_dates_1():
     assert my_creds[1]['credential']['registration_id'] == 'BC1529559'
 
 
+# point-in-time lookups using the interval index should match the full scan
+def test_corp_rec_interval_index():
+    corp_recs = []
+    for (start_day, end_day, end_event_id) in [(0, 10, 1), (10, 20, 2), (10, 25, 3), (15, 12, 4), (20, 30, None), (5, 40, 5)]:
+        corp_recs.append({'effective_start_date': datetime.datetime(2001, 1, 1) + datetime.timedelta(days=start_day),
+                          'effective_end_date': datetime.datetime(2001, 1, 1) + datetime.timedelta(days=end_day),
+                          'end_event_id': end_event_id,
+                          'start_event': {'event_type_cd': 'FILE', 'event_timestmp': MIN_START_DATE, 'effective_date': MIN_START_DATE}})
+
+    with EventProcessor() as event_processor:
+        index = event_processor.corp_rec_interval_index(corp_recs)
+        assert index is not None
+        for day in range(-1, 45):
+            event = {'event_id': day, 'effective_date': datetime.datetime(2001, 1, 1) + datetime.timedelta(days=day)}
+            assert event_processor.corp_rec_at_effective_date(corp_recs, event, index) is event_processor.corp_rec_at_effective_date(corp_recs, event)
+
+
+# naive dates compare as wall-clock times (even across a DST change), naive/aware pairs as local time
+def test_compare_dates_dst():
+    with EventProcessor() as event_processor:
+        assert event_processor.compare_dates(datetime.datetime(2021, 3, 14, 2, 30), '<', datetime.datetime(2021, 3, 14, 3, 15), 'dst')
+        assert not event_processor.compare_dates(datetime.datetime(2021, 3, 14, 2, 30), '==', datetime.datetime(2021, 3, 14, 3, 30), 'dst')
+        assert event_processor.compare_dates(datetime.datetime(2021, 3, 14, 1, 30), '<', MAX_END_DATE, 'dst')
+        aware_date = datetime.datetime(2021, 3, 14, 10, 30, tzinfo=datetime.timezone.utc)
+        assert event_processor.compare_dates(datetime.datetime(2021, 3, 14, 2, 30), '==', aware_date, 'dst')
+        assert event_processor.compare_dates(aware_date, '>', datetime.datetime(2021, 3, 14, 1, 30), 'dst')
+
+
 # utility method to process the selected corp and generate credentails
 def generate_creds_for_corp(corp_dict):
     corp_num = corp_dict['corp_num']
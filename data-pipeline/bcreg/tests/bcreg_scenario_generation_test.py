@@ -1,8 +1,10 @@
 
 import time
+import json
 
-from bcreg.bcregistries import BCRegistries, system_type, MIN_START_DATE, MAX_END_DATE
-from bcreg.eventprocessor import EventProcessor
+from bcreg.bcregistries import BCRegistries, system_type, MIN_START_DATE, MAX_END_DATE, CustomJsonEncoder
+from bcreg import eventprocessor
+from bcreg.eventprocessor import EventProcessor, start_credential_generation_pool, generate_corp_credentials
 from bcreg.tests.sample_corps import sample_test_corps
 
 
@@ -296,3 +298,35 @@ def test_preset_corp_scenario_3dbas():
     assert corp_creds[3]['cred_type'] == 'REL'
     assert corp_creds[4]['cred_type'] == 'REL'
     assert corp_creds[5]['cred_type'] == 'REL'
+
+# credentials generated in the worker pool are the same as the ones generated in this process
+def test_preset_corp_scenario_generation_pool(monkeypatch):
+    monkeypatch.setattr(eventprocessor, 'CORP_CREDS_WORKERS', 2)
+    # (the pool is started before anything else, the workers are forked)
+    generation_pool = start_credential_generation_pool()
+    try:
+        start_event = {'event_id':0, 'event_date':MIN_START_DATE}
+        end_event   = {'event_id':9999999999, 'event_date':MAX_END_DATE}
+        corp_infos = {}
+        corp_creds_futures = {}
+        for test_corp in sample_test_corps.keys():
+            corp_num = sample_test_corps[test_corp]['corp_num']
+            corp_sqls = sample_test_corps[test_corp]['sqls']
+
+            with BCRegistries(True) as cached_bc_reg:
+                cached_bc_reg.cache_bcreg_code_tables()
+                cached_bc_reg.insert_cache_sqls(corp_sqls)
+                corp_infos[corp_num] = cached_bc_reg.get_bc_reg_corp_info(corp_num)
+            corp_creds_futures[corp_num] = generation_pool.submit(generate_corp_credentials, system_type, start_event, end_event, 
+                                                                  corp_num, corp_infos[corp_num])
+
+        event_processor = EventProcessor(connect=False)
+        cred_count = 0
+        for (corp_num, corp_info) in corp_infos.items():
+            corp_creds = event_processor.generate_credentials(system_type, start_event, end_event, corp_num, corp_info)
+            (pool_corp_creds, generation_time) = corp_creds_futures[corp_num].result()
+            cred_count = cred_count + len(corp_creds)
+            assert json.dumps(pool_corp_creds, cls=CustomJsonEncoder, sort_keys=True) == json.dumps(corp_creds, cls=CustomJsonEncoder, sort_keys=True)
+        assert 0 < cred_count
+    finally:
+        generation_pool.shutdown()
@@ -1,9 +1,14 @@
 
 import time
+import datetime
 import json
 
-from bcreg.bcregistries import BCRegistries, system_type, MIN_START_DATE, MAX_END_DATE, CustomJsonEncoder
-from bcreg.eventprocessor import EventProcessor
+import psycopg2
+
+from bcreg.bcregistries import BCRegistries, system_type, MIN_START_DATE, MAX_END_DATE, CustomJsonEncoder, event_dict
+from bcreg.bcreg_lear import lear_system_type
+from bcreg import eventprocessor
+from bcreg.eventprocessor import EventProcessor, CorpBatchSizer, StageTimings, credential_expiry_date
 
 
 def test_connect_bcreg():
@@ -177,3 +182,268 @@ def test_compare_corp_infos():
     assert 0 == len(diffs)
 
 
+
+def test_compare_corp_info_json_agg():
+    specific_corps = [
+                    '0641655',
+                    '0700450',
+                    '0803224',
+                    'LLC0000192',
+                    'C0277609',
+                    'A0072972',
+                    'A0051862',
+                    'C0874156',
+                    '0874244',
+                    '0593707',
+                    ]
+
+    corp_info_baseline = {}
+    with BCRegistries(False) as bc_registries:
+        for corp_num in specific_corps:
+            corp_info_baseline[corp_num] = bc_registries.get_bc_reg_corp_info(corp_num)
+            corp_info_baseline[corp_num]['current_date'] = None
+
+    corp_info = {}
+    with BCRegistries(False) as bc_registries:
+        bc_registries.preload_corp_info(specific_corps)
+        for corp_num in specific_corps:
+            corp_info[corp_num] = bc_registries.get_bc_reg_corp_info(corp_num)
+            corp_info[corp_num]['current_date'] = None
+
+    for corp_num in specific_corps:
+        assert bc_registries.to_json(corp_info[corp_num]) == bc_registries.to_json(corp_info_baseline[corp_num])
+
+def test_corp_batch_sizer():
+    batch_sizer = CorpBatchSizer(max_batch_size=3000, min_batch_size=100)
+    batch_sizer.get_max_rss_kb = lambda: batch_sizer.max_rss_kb
+    assert batch_sizer.batch_size == 3000
+
+    # shrink on caching errors, down to the minimum, then fall back to non-cached mode
+    assert batch_sizer.cache_failed()
+    assert batch_sizer.batch_size == 750
+    assert batch_sizer.cache_failed()
+    assert batch_sizer.cache_failed()
+    assert batch_sizer.batch_size == 100
+    assert not batch_sizer.cache_failed()
+
+    # grow back after full batches, but not past the processing time target
+    batch_sizer.batch_processed(100, 1.0, 10.0)
+    assert batch_sizer.batch_size == 150
+    batch_sizer.batch_processed(150, 1.0, 150.0)
+    assert batch_sizer.batch_size == 225
+    batch_sizer.batch_processed(225, 1.0, 225.0)
+    assert batch_sizer.batch_size == 300
+
+    # partial batches don't change the size
+    batch_sizer.batch_processed(20, 1.0, 1.0)
+    assert batch_sizer.batch_size == 300
+
+    # a slow cache load shrinks the batch
+    batch_sizer.batch_processed(300, 240.0, 30.0)
+    assert batch_sizer.batch_size == 150
+
+def test_stage_timings():
+    timings = StageTimings('test', system_type_cd='BC_REG')
+    for ms in [0.5, 3, 3, 4, 40, 90000]:
+        timings.record_seconds('stage', ms / 1000)
+    summary = timings.summary()['stage']
+    assert summary['count'] == 6
+    assert summary['max_ms'] == 90000
+    assert summary['p50_ms'] == 5
+    assert summary['p99_ms'] == 90000
+    assert summary['buckets'] == {'le_1': 1, 'le_5': 3, 'le_50': 1, 'inf': 1}
+
+    end_time = timings.record('other', time.perf_counter())
+    assert 'other' in timings.summary()
+    assert end_time <= time.perf_counter()
+    timings.write(corps=6)
+    assert timings.stages == {}
+
+def test_credential_expiry_date():
+    assert credential_expiry_date({}) is None
+    assert credential_expiry_date({'expiry_date': ''}) is None
+    assert credential_expiry_date({'expiry_date': 'not a date'}) is None
+    assert credential_expiry_date({'expiry_date': '2020-13-45T08:00:00+00:00'}) is None
+    assert credential_expiry_date({'expiry_date': '2020-01-01T08:00:00+00:00'}) == '2020-01-01T08:00:00+00:00'
+    # stored the same way as in the credential json
+    expiry_date = datetime.datetime(2020, 1, 1)
+    assert credential_expiry_date({'expiry_date': expiry_date}) == json.loads(json.dumps(expiry_date, cls=CustomJsonEncoder))
+
+def test_concurrency_controllers():
+    from bcreg.credssubmitter import create_concurrency_controller
+
+    # latency grows once there are more than 10 concurrent posts
+    for name in ['aimd', 'gradient']:
+        controller = create_concurrency_controller(name)
+        controller.max_limit = 32
+        for _i in range(500):
+            latency = 1.0 + max(0, controller.limit - 10) * 0.5
+            controller.record(5, 0, latency)
+            controller.update()
+        assert 1 <= controller.limit < 20
+        metrics = controller.metrics()
+        assert metrics['controller'] == name and metrics['limit'] == controller.limit
+
+    # errors cut the limit
+    controller = create_concurrency_controller('errors')
+    limit = controller.limit
+    for _i in range(20):
+        controller.record(0, 5, 1.0)
+    assert controller.update() < limit
+    assert controller.metrics()['decreases'] == 1
+
+def test_unchanged_corp_future_events():
+    # loads a fixed LEAR corp, as of current_date
+    class CorpSource:
+        current_date = None
+        def get_bc_reg_corp_info(self, corp_num):
+            return {'corp_num': corp_num, 'corp_typ_cd': 'SP', 'state_typ_cd': 'ACT', 'current_date': self.current_date,
+                    'versions': [{'effective_date': datetime.datetime(2021, 1, 1)}, {'effective_date': datetime.datetime(2021, 6, 1)}]}
+        def to_json(self, corp_info):
+            return json.dumps(corp_info, cls=CustomJsonEncoder, sort_keys=True)
+
+    corp = {'CORP_NUM': 'FM0000001', 'SYSTEM_TYPE_CD': lear_system_type, 
+            'PREV_EVENT': event_dict(0, MIN_START_DATE), 'LAST_EVENT': event_dict(1, MIN_START_DATE)}
+    corp_source = CorpSource()
+    event_processor = EventProcessor(connect=False)
+    timings = StageTimings('test')
+    def load(last_corp_hashes):
+        return event_processor.load_corp_for_processing(corp, corp_source, None, lear_system_type, True, True, 
+                                                        ['SP'], [], last_corp_hashes, timings)
+
+    # first pass, the second event is in the future and is deferred
+    corp_source.current_date = datetime.datetime(2021, 3, 1)
+    loaded = load({})
+    assert len(loaded['effective_events']) == 1 and len(loaded['future_events']) == 1
+    assert not loaded['unchanged_corp']
+    deferred_hash = loaded['corp_json_hash']
+    assert not load({corp['CORP_NUM']: (deferred_hash, 'Y')})['unchanged_corp']
+
+    # re-queued after the future event is effective, the data is the same but the credentials must be generated
+    corp_source.current_date = datetime.datetime(2021, 7, 1)
+    loaded = load({corp['CORP_NUM']: (deferred_hash, 'Y')})
+    assert len(loaded['effective_events']) == 2 and len(loaded['future_events']) == 0
+    assert loaded['corp_json_hash'] != deferred_hash
+    assert not loaded['unchanged_corp']
+
+    # once it has been processed, the corp is unchanged (unless the last attempt failed)
+    assert load({corp['CORP_NUM']: (loaded['corp_json_hash'], 'Y')})['unchanged_corp']
+    assert not load({corp['CORP_NUM']: (loaded['corp_json_hash'], 'N')})['unchanged_corp']
+
+# event processor connection that keeps statements until they are committed, with (postgres) savepoint semantics
+class SavepointConnection:
+    def __init__(self, rows, fail):
+        self.rows = rows
+        self.fail = fail
+        self.committed = []
+        self.pending = []
+        self.savepoints = {}
+        self.aborted = False
+
+    def cursor(self, name=None):
+        return SavepointCursor(self)
+
+    def commit(self):
+        assert not self.aborted
+        self.committed.extend(self.pending)
+        self.pending = []
+        self.savepoints = {}
+
+    def rollback(self):
+        self.pending = []
+        self.savepoints = {}
+        self.aborted = False
+
+    def close(self):
+        pass
+
+    def execute(self, sql, params):
+        if sql.startswith('rollback to savepoint '):
+            del self.pending[self.savepoints[sql.split()[-1]]:]
+            self.aborted = False
+            return []
+        if self.aborted:
+            raise psycopg2.InternalError('current transaction is aborted')
+        if sql.startswith('savepoint '):
+            self.savepoints[sql.split()[-1]] = len(self.pending)
+            return []
+        if sql.startswith('release savepoint '):
+            del self.savepoints[sql.split()[-1]]
+            return []
+        if sql.startswith('SELECT'):
+            (rows, self.rows) = (self.rows, [])
+            return rows
+        if self.fail(sql, params):
+            self.aborted = True
+            raise psycopg2.DatabaseError('Unable to execute: ' + sql)
+        self.pending.append((sql, params))
+        return []
+
+class SavepointCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.rows = list(self.conn.execute(sql.strip(), params))
+
+    def fetchone(self):
+        return self.rows.pop(0) if 0 < len(self.rows) else None
+
+    def close(self):
+        pass
+
+def test_group_commit_corp_isolation(monkeypatch):
+    # loads staged LEAR corps, where each credential is stored as one statement
+    class CorpSource:
+        def __enter__(self):
+            return self
+        def __exit__(self, exc_type, exc_value, traceback):
+            pass
+        def to_json(self, corp_info):
+            return json.dumps(corp_info, cls=CustomJsonEncoder, sort_keys=True)
+
+    def store_credentials(cur, system_type_cd, prev_event, last_event, corp_num, corp_state, corp_info, corp_creds):
+        for corp_cred in corp_creds:
+            cur.execute("INSERT INTO CREDENTIAL_LOG", (corp_num, corp_cred['cred_type'],))
+        return len(corp_creds)
+
+    def update_process_status(cur, table_name, outcomes):
+        cur.execute("UPDATE " + table_name, [(outcome[1], outcome[3],) for outcome in outcomes])
+
+    def staged_corp(record_id, corp_num, future_event=False):
+        versions = [{'event_id': 1, 'event_timestmp': datetime.datetime(2021, 1, 1), 'effective_date': datetime.datetime(2021, 1, 1)}]
+        if future_event:
+            versions.append({'event_id': 2, 'event_timestmp': datetime.datetime(2021, 1, 2), 'effective_date': datetime.datetime(2021, 6, 1)})
+        corp_info = {'corp_num': corp_num, 'corp_typ_cd': 'SP', 'state_typ_cd': 'ACT', 'op_state_typ_cd': 'ACT', 
+                     'current_date': datetime.datetime(2021, 3, 1), 'versions': versions}
+        return (record_id, lear_system_type, event_dict(0, MIN_START_DATE), event_dict(1, MIN_START_DATE), corp_num, corp_info, datetime.datetime(2021, 3, 1))
+
+    # the second corp fails re-queueing its future event (after its credentials are stored), the third fails storing its credentials
+    rows = [staged_corp(1, 'FM0000001'), staged_corp(2, 'FM0000002', True), staged_corp(3, 'FM0000003'), staged_corp(4, 'FM0000004')]
+    def fail(sql, params):
+        return ((sql.startswith("INSERT INTO EVENT_BY_CORP_FILING") and params[5] == 'FM0000002') or 
+                (sql.startswith("INSERT INTO CREDENTIAL_LOG") and params[0] == 'FM0000003'))
+
+    monkeypatch.setattr(eventprocessor, 'CORP_STATUS_COMMIT_SIZE', 10)
+    monkeypatch.setattr(eventprocessor, 'CORP_CREDS_WORKERS', 0)
+    monkeypatch.setattr(eventprocessor, 'update_process_status', update_process_status)
+    event_processor = EventProcessor(connect=False)
+    event_processor.conn = SavepointConnection(rows, fail)
+    monkeypatch.setattr(event_processor, 'get_max_event_for_other_system_type', lambda system_type_cd: (MIN_START_DATE, 0))
+    monkeypatch.setattr(event_processor, 'get_in_scope_corps_for_other_system_type', lambda system_type_cd: [])
+    monkeypatch.setattr(event_processor, 'bc_reg_processor', lambda system_type_cd, use_cache=False, shared_with=None: CorpSource())
+    monkeypatch.setattr(event_processor, 'generate_credentials', 
+                        lambda system_type_cd, prev_event, last_event, corp_num, corp_info: [{'cred_type': 'REG'}, {'cred_type': 'ADDR'}])
+    monkeypatch.setattr(event_processor, 'store_credentials', store_credentials)
+
+    event_processor.process_corp_event_queue_internal(lear_system_type, load_regs=False, generate_creds=True, corp_types=['SP'])
+
+    # the failed corps' writes are undone, and their errors are committed with the rest of the group
+    committed = event_processor.conn.committed
+    assert [params for (sql, params) in committed if sql == "INSERT INTO CREDENTIAL_LOG"] == [
+        ('FM0000001', 'REG'), ('FM0000001', 'ADDR'), ('FM0000004', 'REG'), ('FM0000004', 'ADDR')]
+    assert [params for (sql, params) in committed if sql.startswith("INSERT INTO EVENT_BY_CORP_FILING")] == []
+    assert [params for (sql, params) in committed if sql == "UPDATE CORP_HISTORY_LOG"] == [[('Y', 1), ('N', 2), ('N', 3), ('Y', 4)]]
+    assert [params for (sql, params) in committed if sql == "UPDATE EVENT_BY_CORP_FILING"] == [[('Y', 1), ('N', 2), ('N', 3), ('Y', 4)]]
+    assert event_processor.conn.pending == []
@@ -2,6 +2,8 @@
 import sqlite3
 import time
 from bcreg.bcregistries import BCRegistries
+from bcreg.bcreg_lear import BCReg_Lear
+from bcreg import bcreg_core
 
 
 def test_connect_sqlite3():
@@ -95,6 +97,48 @@ def test_cache_bcreg_table():
         assert len(rows) == len(c_rows)
         assert rows == c_rows
         
+def test_cache_bcreg_indexes():
+    with BCRegistries(True) as bc_registries:
+        bc_registries.cache_bcreg_corps(['0641655'])
+        cache_indexes = bc_registries.get_cache_indexes()
+        assert 'event_id' in cache_indexes['x_event']
+        assert 'corp_num' in cache_indexes['x_corporation']
+        assert 'addr_id' in cache_indexes['x_address']
+        assert 'identifier' in cache_indexes['x_sec_businesses']
+        assert 'id' in cache_indexes['x_sec_transaction']
+
+def test_cache_bcreg_concurrent_load(monkeypatch):
+    specific_corps = ['0641655', '0700450', '0803224', 'LLC0000192', 'C0277609']
+    tables = ['x_corp_party', 'x_event', 'x_filing', 'x_corporation', 'x_corp_name', 'x_office', 'x_address', 'x_sec_businesses', 'x_sec_filings']
+
+    cached_rows = {}
+    for workers in [1, 4]:
+        monkeypatch.setattr(bcreg_core, 'CACHE_LOAD_WORKERS', workers)
+        with BCRegistries(True) as bc_registries:
+            bc_registries.cache_bcreg_corps(specific_corps)
+            for table in tables:
+                rows = bc_registries.get_adhoc_query('select * from ' + table)
+                cached_rows.setdefault(table, []).append(rows)
+            if 1 < workers:
+                # the snapshot was exported and the tables were loaded over the worker connections
+                # (None means we fell back to loading sequentially)
+                conns = bc_registries.cache_load_conns.get(bc_registries.PG_DATABASE_NAME)
+                assert conns is not None
+                assert conns.qsize() == workers
+            else:
+                assert bc_registries.cache_load_conns == {}
+
+    for table in tables:
+        assert cached_rows[table][0] == cached_rows[table][1]
+
+def test_cache_bcreg_shared_lear():
+    with BCRegistries(True) as bc_registries:
+        bc_registries.cache_bcreg_corps(['0641655'])
+        lear_processor = BCReg_Lear(True, shared_with=bc_registries)
+        assert lear_processor.get_table_prefix() == 'x_sec_'
+        lear_rows = lear_processor.get_adhoc_query('select * from ' + lear_processor.get_table_prefix() + 'businesses')
+        assert lear_rows == bc_registries.get_adhoc_query('select * from x_sec_businesses', use_sec=True)
+
 def test_cache_bcreg_clients():
     specific_corps = [
                     '0641655',